@@ -0,0 +1,28 @@
+"""add a composite index on (fov_id, kind) to the microscopy_fov_result table
+
+Revision ID: 61cc13de448f
+Revises: ce13bd676914
+Create Date: 2026-10-17 11:41:52.306118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '61cc13de448f'
+down_revision = 'ce13bd676914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'idx_microscopy_fov_result_fov_id_kind',
+        'microscopy_fov_result',
+        ['fov_id', 'kind'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('idx_microscopy_fov_result_fov_id_kind', table_name='microscopy_fov_result')
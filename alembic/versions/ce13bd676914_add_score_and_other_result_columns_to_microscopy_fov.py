@@ -0,0 +1,58 @@
+"""add score, laser_power_488, and cell_layer_center columns to the microscopy_fov table
+
+Revision ID: ce13bd676914
+Revises: eb701652249c
+Create Date: 2026-10-17 11:03:27.184406
+
+These columns are copies of frequently-read fields of the FOV results
+(which are maintained by the `insert_*` methods of fov_operations.MicroscopyFOVOperations),
+so that the best and top-scoring FOVs of each cell line can be selected by a single indexed query.
+The columns are backfilled from the existing results.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ce13bd676914'
+down_revision = 'eb701652249c'
+branch_labels = None
+depends_on = None
+
+
+# the result kind and the JSON key in the result data from which each column is copied
+BACKFILLS = [
+    ('score', 'fov-features', 'score'),
+    ('laser_power_488', 'raw-tiff-metadata', 'laser_power_488_488'),
+    ('cell_layer_center', 'clean-tiff-metadata', 'cell_layer_center'),
+]
+
+
+def upgrade():
+    op.add_column('microscopy_fov', sa.Column('score', sa.Float(), nullable=True))
+    op.add_column('microscopy_fov', sa.Column('laser_power_488', sa.Float(), nullable=True))
+    op.add_column('microscopy_fov', sa.Column('cell_layer_center', sa.Float(), nullable=True))
+
+    for column, kind, key in BACKFILLS:
+        op.execute(
+            f'''
+            update microscopy_fov fov set {column} = (result.data ->> '{key}') :: double precision
+            from microscopy_fov_result result
+            where result.fov_id = fov.id and result.kind = '{kind}'
+            and jsonb_typeof(result.data -> '{key}') = 'number';
+            '''
+        )
+
+    op.create_index(
+        'idx_microscopy_fov_cell_line_id_score',
+        'microscopy_fov',
+        ['cell_line_id', 'score'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('idx_microscopy_fov_cell_line_id_score', table_name='microscopy_fov')
+    op.drop_column('microscopy_fov', 'cell_layer_center')
+    op.drop_column('microscopy_fov', 'laser_power_488')
+    op.drop_column('microscopy_fov', 'score')
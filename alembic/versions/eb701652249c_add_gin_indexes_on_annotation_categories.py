@@ -0,0 +1,65 @@
+"""add GIN indexes on the categories of the cell line and FOV annotations
+
+Revision ID: eb701652249c
+Revises: 59835c0f5fe6
+Create Date: 2026-10-17 10:12:41.523719
+
+The indexes use the jsonb_path_ops operator class, which is smaller and faster than
+the default jsonb_ops but supports only the containment operator (`@>`), not `?`.
+The annotation filters (in metadata_operations.get_lines_by_annotation, export_annotations.py,
+and the public_cell_line and searchable_hgnc_metadata views) therefore use, e.g.,
+`categories @> '["publication_ready"]'` in place of unnesting `categories::json`.
+
+Benchmarking
+------------
+Compare the plan and runtime of the old and new publication-ready filters
+before and after running this migration (and after `ocdb --create-views`):
+
+    explain analyze
+    select cell_line_id from (
+        select cell_line_id, json_array_elements_text(categories::json) as cat
+        from cell_line_annotation
+    ) tmp where cat = 'publication_ready';
+
+    explain analyze
+    select cell_line_id from cell_line_annotation
+    where categories @> '["publication_ready"]';
+
+The first is always a sequential scan of the whole table followed by a set-returning unnest
+and a filter over every (cell line, category) pair; the second is a bitmap index scan
+on idx_cell_line_annotation_categories. Note that the planner may still prefer a sequential
+scan when the table is small or when most rows match (e.g., for 'publication_ready'
+once most lines are published); even then, the containment test avoids the cast and the unnest.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'eb701652249c'
+down_revision = '59835c0f5fe6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'idx_cell_line_annotation_categories',
+        'cell_line_annotation',
+        ['categories'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'categories': 'jsonb_path_ops'},
+    )
+    op.create_index(
+        'idx_microscopy_fov_annotation_categories',
+        'microscopy_fov_annotation',
+        ['categories'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'categories': 'jsonb_path_ops'},
+    )
+
+
+def downgrade():
+    op.drop_index('idx_microscopy_fov_annotation_categories', table_name='microscopy_fov_annotation')
+    op.drop_index('idx_cell_line_annotation_categories', table_name='cell_line_annotation')
@@ -9,6 +9,8 @@ from sqlalchemy.orm import scoped_session, sessionmaker
 
 from opencell.api import resources
 from opencell.api import settings
+from opencell.api import snapshot
+from opencell.api import utils as api_utils
 from opencell.database import models, utils
 from opencell.api.cache import cache
 
@@ -36,6 +38,9 @@ def create_app(config=None):
 
     app = Flask(__name__)
     app.config.from_object(config)
+
+    # NaN-safe and numpy-aware JSON encoding for all payloads
+    app.json_encoder = api_utils.JSONEncoder
     if app.config.get('CORS_ORIGINS'):
         CORS(app, origins=app.config['CORS_ORIGINS'])
 
@@ -50,6 +55,9 @@ def create_app(config=None):
     # used only to populate the table of search results on the SearchResults page
     api.add_resource(resources.FullTextSearch, '/fsearch/<string:query>')
 
+    # gene-name autocompletion (from the in-memory search index)
+    api.add_resource(resources.Autocomplete, '/autocomplete/<string:prefix>')
+
     # annotations (or 'comments') from uniprotkb
     api.add_resource(resources.UniProtKBAnnotation, '/uniprotkb_annotation/<string:uniprot_id>')
 
@@ -127,6 +135,14 @@ def create_app(config=None):
     url = utils.url_from_credentials(app.config['DB_CREDENTIALS_FILEPATH'])
     app.Session = create_session_registry(url)
 
+    # serve the read-only endpoints from a precomputed snapshot of their payloads
+    snapshot_filepath = os.environ.get(
+        'PAYLOAD_SNAPSHOT_FILEPATH', app.config['PAYLOAD_SNAPSHOT_FILEPATH']
+    )
+    if snapshot_filepath:
+        app.snapshot = snapshot.PayloadSnapshot(snapshot_filepath)
+        app.before_request(snapshot.serve_from_snapshot(app.snapshot))
+
     # close the session instance when a request is completed
     @app.teardown_appcontext
     def remove_session(error=None):
@@ -143,6 +159,7 @@ def parse_args():
     parser.add_argument('--mode', dest='mode', required=True)
     parser.add_argument('--credentials', dest='credentials_filepath')
     parser.add_argument('--opencell-microscopy-dir', dest='opencell_microscopy_dir')
+    parser.add_argument('--snapshot', dest='snapshot_filepath')
     return parser.parse_args()
 
 
@@ -156,6 +173,9 @@ def main():
     if args.opencell_microscopy_dir:
         config.OPENCELL_MICROSCOPY_DIR = args.opencell_microscopy_dir
 
+    if args.snapshot_filepath:
+        config.PAYLOAD_SNAPSHOT_FILEPATH = args.snapshot_filepath
+
     app = create_app(config)
     app.run(host='0.0.0.0', debug=True)
 
@@ -1,3 +1,260 @@
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import logging
+import os
+
+import flask
+import sqlalchemy as sa
 from flask_caching import Cache
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from opencell.api import settings, snapshot, utils
+from opencell.database import models
 
 cache = Cache()
+
+logger = logging.getLogger(__name__)
+
+# the cache key of the data-version token (this key is itself not namespaced)
+DATA_VERSION_KEY = 'data-version'
+
+# the prefix of the cache keys of the fingerprints of the individual tables and views
+FINGERPRINT_KEY_PREFIX = 'data-fingerprint:'
+
+# tables whose rows are modified in place (by the annotation endpoints),
+# for which counts and timestamps are not sufficient to detect changes
+MUTABLE_TABLES = [
+    'cell_line_annotation', 'microscopy_fov_annotation', 'mass_spec_pulldown_network'
+]
+
+# the materialized views used by the API (see define_views.sql),
+# which are fingerprinted by their filenodes because these change whenever a view is refreshed
+MATERIALIZED_VIEWS = ['searchable_hgnc_metadata', 'gene_name_alias']
+
+
+def list_fingerprinted_names():
+    '''
+    The names of all of the tables and views whose fingerprints make up the data version
+    '''
+    return [table.name for table in models.Base.metadata.sorted_tables] + MATERIALIZED_VIEWS
+
+
+def calculate_fingerprints(engine, names=None):
+    '''
+    The fingerprints of the given tables and views (or of all of them, if names is None),
+    as a dict keyed by name
+
+    The fingerprint of a table is its row count and its latest timestamp
+    (or, for the small tables that are modified in place, a digest of its full contents),
+    and the fingerprint of a materialized view is its filenode
+    '''
+    names = list_fingerprinted_names() if names is None else names
+
+    selects = []
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in names:
+            continue
+        if table.name in MUTABLE_TABLES:
+            row = sa.cast(sa.column(table.name), sa.Text)
+            fingerprint = sa.func.md5(sa.func.string_agg(row, aggregate_order_by(sa.literal(','), row)))
+        elif 'date_created' in table.columns:
+            fingerprint = sa.cast(sa.func.max(table.columns.date_created), sa.Text)
+        else:
+            fingerprint = sa.null()
+        selects.append(
+            sa.select(
+                sa.literal(table.name).label('name'),
+                sa.func.count().label('num_rows'),
+                fingerprint.label('fingerprint')
+            )
+            .select_from(table)
+        )
+
+    for view_name in MATERIALIZED_VIEWS:
+        if view_name not in names:
+            continue
+        filenode = sa.func.pg_relation_filenode(sa.func.to_regclass(sa.literal(view_name)))
+        selects.append(
+            sa.select(
+                sa.literal(view_name).label('name'),
+                sa.null().label('num_rows'),
+                sa.cast(filenode, sa.Text).label('fingerprint')
+            )
+        )
+
+    if not selects:
+        return {}
+    with engine.connect() as conn:
+        rows = conn.execute(sa.union_all(*selects)).fetchall()
+    return {name: '%s %s' % (num_rows, fingerprint) for name, num_rows, fingerprint in rows}
+
+
+def digest_fingerprints(fingerprints):
+    '''
+    A short digest of a dict of fingerprints
+    '''
+    fingerprint = '\n'.join(sorted('%s %s' % item for item in fingerprints.items()))
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+def calculate_data_version(engine, names=None):
+    '''
+    A token that changes whenever the data served by the API changes
+    (or, if names is provided, whenever the data in the given tables and views changes)
+    '''
+    return digest_fingerprints(calculate_fingerprints(engine, names))
+
+
+def get_fingerprints(names):
+    '''
+    The fingerprints of the given tables and views, which are stored in the cache
+    (the fingerprints that are missing from the cache are computed and stored)
+    '''
+    keys = [FINGERPRINT_KEY_PREFIX + name for name in names]
+    fingerprints = dict(zip(names, cache.get_many(*keys)))
+
+    missing_names = [name for name, fingerprint in fingerprints.items() if fingerprint is None]
+    if missing_names:
+        fingerprints.update(
+            calculate_fingerprints(flask.current_app.Session.get_bind(), missing_names)
+        )
+        cache.set_many(
+            {FINGERPRINT_KEY_PREFIX + name: fingerprints[name] for name in missing_names},
+            timeout=0
+        )
+    return fingerprints
+
+
+def get_data_version(names=None):
+    '''
+    The current data-version token (which is computed once and then stored in the cache)
+
+    names : optional list of tables and views; if provided, the token depends only
+        on the data in these tables and views (this is used to version the in-memory indexes,
+        so that they are not rebuilt when unrelated tables change)
+    '''
+    if names is not None:
+        return digest_fingerprints(get_fingerprints(names))
+
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        version = digest_fingerprints(get_fingerprints(list_fingerprinted_names()))
+        cache.set(DATA_VERSION_KEY, version, timeout=0)
+    return version
+
+
+def refresh_data_version(names=None):
+    '''
+    Recompute the data-version token
+
+    names : optional list of the tables that have changed; if provided,
+        only the fingerprints of these tables are recomputed (this is called
+        by the endpoints that modify the annotation tables, which are small)
+
+    Because all cache keys are prefixed with the token (see cache_key),
+    this invalidates the cached payloads if, and only if, the data has changed
+    '''
+    all_names = list_fingerprinted_names()
+    fingerprints = calculate_fingerprints(flask.current_app.Session.get_bind(), names)
+    cache.set_many(
+        {FINGERPRINT_KEY_PREFIX + name: fingerprint for name, fingerprint in fingerprints.items()},
+        timeout=0
+    )
+    if names is not None:
+        fingerprints = get_fingerprints(all_names)
+
+    version = digest_fingerprints(fingerprints)
+    cache.set(DATA_VERSION_KEY, version, timeout=0)
+    return version
+
+
+# copied from https://stackoverflow.com/questions/24816799/how-to-use-flask-cache-with-flask-restful
+# and namespaced by the data version, so that cached payloads are invalidated when the data changes
+def cache_key():
+    key = snapshot.snapshot_key(flask.request.path, flask.request.args)
+    return '%s:%s' % (get_data_version(), key)
+
+
+def cached_payload(view):
+    '''
+    Cache the payload returned by a view in compressed form, along with its ETag
+
+    This is used in place of `cache.cached` for the views that return JSON payloads,
+    so that the payloads are compressed and hashed only once, when the cache is filled
+    '''
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = cache_key()
+        cached = cache.get(key)
+        if cached is None:
+            response = flask.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            etag, gzipped_data = utils.compress_payload(response.get_data())
+            cached = (etag, response.mimetype, gzipped_data)
+            cache.set(key, cached)
+        return utils.make_compressed_response(*cached)
+    return wrapper
+
+
+def warm_cache(app, num_workers=8):
+    '''
+    Populate the cache with the payloads of all of the read-only endpoints
+    by requesting them concurrently from the app
+    (the URLs are the same as those rendered into a payload snapshot)
+    '''
+    client = app.test_client()
+    with app.app_context():
+        version = refresh_data_version()
+
+    urls = snapshot.list_urls(app)
+    logger.info('Warming the cache with %s payloads (data version %s)' % (len(urls), version))
+
+    def request(url):
+        return url, client.get(url).status_code
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for ind, (url, status_code) in enumerate(executor.map(request, urls)):
+            if status_code != 200:
+                logger.warning('Request to %s failed (status code %s)' % (url, status_code))
+            if ind % 1000 == 0:
+                logger.info('Requested %s of %s payloads' % (ind, len(urls)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', dest='mode', required=True)
+    parser.add_argument('--credentials', dest='credentials_filepath')
+    parser.add_argument('--workers', dest='num_workers', type=int, default=8)
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Warm the cache used by the app in the given mode, e.g.:
+    `python -m opencell.api.cache --mode aws-prod --workers 8`
+
+    Note that this is useful only for shared cache backends (i.e., redis)
+    '''
+    from opencell.api.app import create_app
+
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    config = settings.get_config(args.mode)
+    if args.credentials_filepath:
+        config.DB_CREDENTIALS_FILEPATH = args.credentials_filepath
+
+    if config.CACHE_TYPE != 'redis':
+        logger.warning('The cache type is %s and will not outlive this process' % config.CACHE_TYPE)
+
+    # the cache must be populated by the live endpoints, not from a snapshot
+    config.PAYLOAD_SNAPSHOT_FILEPATH = None
+    os.environ.pop('PAYLOAD_SNAPSHOT_FILEPATH', None)
+    warm_cache(create_app(config), num_workers=args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
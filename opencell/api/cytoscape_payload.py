@@ -1,5 +1,12 @@
+import collections
+import flask
 import pandas as pd
+import sqlalchemy as sa
+
 from opencell.api import payloads
+from opencell.api import cache as cache_utils
+from opencell.api.cache import cache
+from opencell.database import models
 
 
 def construct_node(hit=None, protein_group=None, kind=None):
@@ -17,8 +24,101 @@ def construct_node(hit=None, protein_group=None, kind=None):
     return node
 
 
+def get_bait_hits(session, pulldown_ids):
+    '''
+    The bait hit of each pulldown in one query, as a dict keyed by pulldown_id
+    (this is the bulk version of MassSpecPulldown.get_bait_hit(only_one=True);
+    pulldowns in which the bait does not appear as a hit are omitted)
+    '''
+    hits = (
+        session.query(models.MassSpecHit)
+        .join(models.MassSpecPulldown)
+        .join(models.CellLine, models.CellLine.id == models.MassSpecPulldown.cell_line_id)
+        .join(
+            models.ProteinGroupCrisprDesignAssociation,
+            sa.and_(
+                models.ProteinGroupCrisprDesignAssociation.protein_group_id
+                == models.MassSpecHit.protein_group_id,
+                models.ProteinGroupCrisprDesignAssociation.crispr_design_id
+                == models.CellLine.crispr_design_id,
+            )
+        )
+        .filter(models.MassSpecHit.pulldown_id.in_(pulldown_ids))
+        .filter(sa.or_(
+            models.MassSpecHit.is_minor_hit == True,  # noqa
+            models.MassSpecHit.is_significant_hit == True  # noqa
+        ))
+        .options(
+            sa.orm.joinedload(models.MassSpecHit.protein_group, innerjoin=True)
+            .joinedload(models.MassSpecProteinGroup.crispr_designs),
+            sa.orm.joinedload(models.MassSpecHit.protein_group, innerjoin=True)
+            .joinedload(models.MassSpecProteinGroup.hgnc_metadata),
+        )
+        .all()
+    )
+
+    # the bait hit is the hit with the greatest enrichment
+    bait_hits = {}
+    for hit in sorted(hits, key=lambda hit: -hit.enrichment):
+        bait_hits.setdefault(hit.pulldown_id, hit)
+    return bait_hits
+
+
+def get_hit_protein_group_ids(session, pulldown_ids):
+    '''
+    The protein_group_ids of the significant hits in each pulldown in one query,
+    as a dict of lists keyed by pulldown_id
+    '''
+    rows = (
+        session.query(models.MassSpecHit.pulldown_id, models.MassSpecHit.protein_group_id)
+        .filter(models.MassSpecHit.pulldown_id.in_(pulldown_ids))
+        .filter(sa.or_(
+            models.MassSpecHit.is_minor_hit == True,  # noqa
+            models.MassSpecHit.is_significant_hit == True  # noqa
+        ))
+        .order_by(models.MassSpecHit.id)
+        .all()
+    )
+    protein_group_ids = collections.defaultdict(list)
+    for row in rows:
+        protein_group_ids[row.pulldown_id].append(row.protein_group_id)
+    return protein_group_ids
+
+
+def get_best_pulldowns(session, crispr_design_ids):
+    '''
+    The best pulldown of the best cell line for each crispr design in one query,
+    as a dict keyed by crispr_design_id (designs without a pulldown are omitted)
+
+    This mimics `design.get_best_cell_line().get_best_pulldown()`:
+    the best cell line is the first resorted line if there is one,
+    and otherwise the first line with a pulldown
+    '''
+    cell_lines = (
+        session.query(models.CellLine)
+        .filter(models.CellLine.crispr_design_id.in_(crispr_design_ids))
+        .options(sa.orm.selectinload(models.CellLine.pulldowns))
+        .all()
+    )
+    cell_lines_by_design = collections.defaultdict(list)
+    for cell_line in cell_lines:
+        cell_lines_by_design[cell_line.crispr_design_id].append(cell_line)
+
+    best_pulldowns = {}
+    for design_id, lines in cell_lines_by_design.items():
+        resorted_lines = [line for line in lines if line.sort_count > 1]
+        lines_with_pulldowns = [line for line in lines if line.pulldowns]
+        best_line = (resorted_lines or lines_with_pulldowns or [None])[0]
+        if best_line is not None and best_line.get_best_pulldown():
+            best_pulldowns[design_id] = best_line.get_best_pulldown()
+    return best_pulldowns
+
+
 def construct_network(
-    target_pulldown=None, interacting_pulldowns=None, origin_protein_group=None
+    target_pulldown=None,
+    interacting_pulldown_ids=None,
+    origin_protein_group=None,
+    interaction_graph=None
 ):
     '''
     Construct the nodes and edges for the cytoscape network of interactions
@@ -29,7 +129,7 @@ def construct_network(
     For an opencell target, its pulldown must be provided as `target_pulldown`
     (its interacting pulldowns are determined from this pulldown).
 
-    For an opencell interactor, the list of interacting pulldowns
+    For an opencell interactor, the ids of the interacting pulldowns
     (i.e., the pulldowns in which the interactor appears as a hit) must be provided directly.
 
     For both cases, the protein group associated with the 'origin' node of the network -
@@ -40,24 +140,42 @@ def construct_network(
      and, if target_pulldown is provided, all of the significant hits in the target pulldown
     2) the direct interactions between the direct interactors
        (these exist when one direct interactor appears in the pulldown of another)
+
+    Note that the bait hits, the best pulldowns of the direct hits,
+    and the hits of all of these pulldowns are each loaded in a single query
+
+    If an InteractionGraph is provided, the interacting pulldowns and the hits of all pulldowns
+    are looked up in the graph instead of in the database
     '''
+    session = sa.orm.object_session(origin_protein_group)
 
-    bait_hit = None
+    direct_hits = []
     if target_pulldown:
-        bait_hit = target_pulldown.get_bait_hit(only_one=True)
+        direct_hits = target_pulldown.get_significant_hits()
+        if interaction_graph is not None:
+            protein_groups = target_pulldown.cell_line.crispr_design.protein_groups
+            interacting_pulldown_ids = [
+                pulldown_id
+                for pulldown_id in interaction_graph.get_pulldowns([pg.id for pg in protein_groups])
+                if pulldown_id != target_pulldown.id
+            ]
+        else:
+            interacting_pulldown_ids = [
+                pulldown.id for pulldown in target_pulldown.get_interacting_pulldowns()
+            ]
+
+    # the bait hits of the target pulldown and of each of the interacting pulldowns
+    bait_hits = get_bait_hits(
+        session, interacting_pulldown_ids + ([target_pulldown.id] if target_pulldown else [])
+    )
 
     # construct the bait node using the provided 'origin' protein group
     # (note that calling this node the 'bait' is an abuse of the nomenclature
     # when the network we are constructing is for an interactor and not a target)
+    bait_hit = bait_hits.get(target_pulldown.id) if target_pulldown else None
     origin_node = construct_node(hit=bait_hit, protein_group=origin_protein_group, kind='bait')
     nodes = [origin_node]
 
-    direct_hits = []
-    if target_pulldown:
-        direct_hits = target_pulldown.get_significant_hits()
-        interacting_pulldowns = target_pulldown.get_interacting_pulldowns()
-        origin_node['pulldown'] = target_pulldown
-
     # create nodes to represent the hits in the target's pulldown
     for direct_hit in direct_hits:
         if origin_node['id'] == direct_hit.protein_group.id:
@@ -66,90 +184,109 @@ def construct_network(
         node['hit'] = direct_hit
         nodes.append(node)
 
-    # the bait hits in each of the interacting pulldowns
-    # (this list will include Nones for pulldowns in which the bait hit does not exist)
-    interacting_bait_hits = [
-        interacting_pulldown.get_bait_hit(only_one=True)
-        for interacting_pulldown in interacting_pulldowns
-    ]
+    # the origin node's hits in the interacting pulldowns
+    origin_hits = {}
+    if interacting_pulldown_ids:
+        origin_hits = {
+            hit.pulldown_id: hit for hit in (
+                session.query(models.MassSpecHit)
+                .filter(models.MassSpecHit.pulldown_id.in_(interacting_pulldown_ids))
+                .filter(models.MassSpecHit.protein_group_id == origin_node['id'])
+                .filter(sa.or_(
+                    models.MassSpecHit.is_minor_hit == True,  # noqa
+                    models.MassSpecHit.is_significant_hit == True  # noqa
+                ))
+                .all()
+            )
+        }
 
     # create nodes to represent the interacting pulldowns
-    for interacting_pulldown, interacting_bait_hit in zip(
-        interacting_pulldowns, interacting_bait_hits
-    ):
+    for interacting_pulldown_id in interacting_pulldown_ids:
+
         # if no bait hit was found in the interacting pulldown,
         # we cannot create a node to represent the pulldown
         # TODO: technically, we can, if we use the 'primary' protein group
         # associated with the interacting pulldown's target
+        interacting_bait_hit = bait_hits.get(interacting_pulldown_id)
         if not interacting_bait_hit:
             continue
 
-        # the origin node's hit in the interacting pulldown
-        interacting_hit = interacting_pulldown.get_significant_hits(
-            protein_group_ids=[origin_node['id']], eagerload=False
-        )
+        interacting_hit = origin_hits.get(interacting_pulldown_id)
         if not interacting_hit:
             continue
-        interacting_hit = interacting_hit[0]
 
         # construct the node to represent the interacting pulldown
         node = construct_node(
             hit=interacting_hit, protein_group=interacting_bait_hit.protein_group, kind='pulldown'
         )
-        node['pulldown'] = interacting_pulldown
+        node['pulldown_id'] = interacting_pulldown_id
         nodes.append(node)
 
     # if no target pulldown was provided, the 'direct hits', for the purpose of constructing edges,
     #  are the bait hits from the interacting pulldowns
     if not target_pulldown:
-        direct_hits = [hit for hit in interacting_bait_hits if hit is not None]
+        direct_hits = [
+            bait_hits[pulldown_id] for pulldown_id in interacting_pulldown_ids
+            if pulldown_id in bait_hits
+        ]
+
+    # if a direct hit in the target's pulldown corresponds to a single opencell target
+    # (and therefore to a pulldown with its own hits), we need the best pulldown of that target
+    # note that this is complicated because there may be more than one crispr design
+    # for a protein group, and because there may be more than one cell line per design
+    # (e.g., for resorted targets)
+    for node in nodes:
+        if node['type'] != 'hit':
+            continue
+
+        # if the hit does not correspond to any opencell targets,
+        # or if the hit corresponds to multiple distinct opencell targets,
+        # we do not need to generate edges between the hit and the other hits
+        designs = node['hit'].protein_group.crispr_designs
+        num_distinct_designs = len(set([d.uniprot_id for d in designs]))
+        if designs and num_distinct_designs == 1:
+            node['designs'] = designs
+
+    best_pulldowns = get_best_pulldowns(
+        session, [design.id for node in nodes for design in node.get('designs', [])]
+    )
+    for node in nodes:
+        for design in node.get('designs', []):
+            if design.id in best_pulldowns:
+                node['pulldown_id'] = best_pulldowns[design.id].id
+                break
+
+    # the hits in all of the pulldowns represented by nodes
+    node_pulldown_ids = [
+        node['pulldown_id'] for node in nodes if node.get('pulldown_id') is not None
+    ]
+    if interaction_graph is not None:
+        hit_protein_group_ids = {
+            pulldown_id: interaction_graph.get_hits(pulldown_id)
+            for pulldown_id in node_pulldown_ids
+        }
+    else:
+        hit_protein_group_ids = get_hit_protein_group_ids(session, node_pulldown_ids)
 
     # generate the edges between direct nodes
     edges = []
-    all_node_ids = [node['id'] for node in nodes]
+    all_node_ids = set([node['id'] for node in nodes])
 
     for node in nodes:
-        indirect_hits = None
+        indirect_node_ids = None
 
         if node['type'] == 'bait':
-            indirect_hits = direct_hits
-
-        # if the node represents a pulldown, we already have the list of indirect hits
-        if node['type'] == 'pulldown':
-            indirect_hits = node['pulldown'].get_significant_hits(eagerload=False)
-
-        # if the node represents a direct hit in the target's pulldown,
-        # we need to determine whether the hit corresponds to an opencell target
-        # (and therefore to a pulldown with its own hits)
-        if node['type'] == 'hit':
-            designs = node['hit'].protein_group.crispr_designs
-
-            # if the hit does not correspond to any opencell targets,
-            # or if the hit corresponds to multiple distinct opencell targets,
-            # we do not need to generate edges between the hit and the other hits
-            num_distinct_designs = len(set([d.uniprot_id for d in designs]))
-            if not designs or num_distinct_designs > 1:
-                continue
+            indirect_node_ids = [hit.protein_group_id for hit in direct_hits]
+
+        # if the node represents a pulldown (or a hit that corresponds to a target),
+        # the indirect hits are the hits in its pulldown
+        elif node.get('pulldown_id') is not None:
+            indirect_node_ids = hit_protein_group_ids.get(node['pulldown_id'])
 
-            # if the hit does correspond to an opencell target,
-            # find the best cell line corresponding to the hit's protein group
-            # note that this is complicated because there may be more than one crispr design
-            # for a protein group, and because there may be more than one cell line per design
-            # (e.g., for resorted targets)
-            node_pulldown = None
-            for design in designs:
-                cell_line = design.get_best_cell_line()
-                if cell_line:
-                    node_pulldown = cell_line.get_best_pulldown()
-                    if node_pulldown:
-                        indirect_hits = node_pulldown.get_significant_hits(eagerload=False)
-                        break
-
-        if not indirect_hits:
+        if not indirect_node_ids:
             continue
 
-        for indirect_hit in indirect_hits:
-            indirect_node_id = indirect_hit.protein_group.id
+        for indirect_node_id in indirect_node_ids:
 
             # if the hit of the node is not among the nodes, we don't need to create an edge
             if indirect_node_id not in all_node_ids or indirect_node_id == node['id']:
@@ -162,53 +299,74 @@ def construct_network(
                 'target': indirect_node_id,
             })
 
-    # drop the pulldown and hit instances from the node dicts
+    # drop the hit instances and pulldown ids from the node dicts
     for node in nodes:
         node.pop('hit', None)
-        node.pop('pulldown', None)
+        node.pop('designs', None)
+        node.pop('pulldown_id', None)
 
     return nodes, edges
 
 
-def construct_compound_nodes(nodes, clustering_analysis_type, subcluster_type, engine):
+@cache.memoize()
+def get_cluster_memberships(clustering_analysis_type, data_version):
     '''
+    The cluster, subcluster, and core complex ids of all protein groups in a clustering analysis,
+    as a dict of (cluster_id, subcluster_id, core_complex_id) tuples keyed by protein_group_id
+
+    This is cached for each version of the data in the hit and cluster-heatmap tables
+    (see cache.get_data_version)
     '''
     clusters = pd.read_sql(
-        f'''
+        '''
         select protein_group_id, cluster_id, subcluster_id, core_complex_id
         from mass_spec_cluster_heatmap heatmap
         inner join mass_spec_hit hit on hit.id = heatmap.hit_id
-        where analysis_type = '{clustering_analysis_type}'
+        where analysis_type = %(analysis_type)s
         ''',
-        engine
+        flask.current_app.Session.get_bind(),
+        params={'analysis_type': clustering_analysis_type}
     )
 
     # cluster memberships are the same for all hits with the same protein group (by design)
-    clusters = clusters.groupby(['protein_group_id']).first().reset_index()
+    clusters = clusters.groupby(['protein_group_id']).first()
+
+    def to_int(value):
+        return int(value) if not pd.isna(value) else None
+
+    return {
+        row.Index: (to_int(row.cluster_id), to_int(row.subcluster_id), to_int(row.core_complex_id))
+        for row in clusters.itertuples()
+    }
+
+
+def construct_compound_nodes(nodes, clustering_analysis_type, subcluster_type):
+    '''
+    Assign the nodes to clusters and subclusters, and construct the parent (compound) nodes
+    that represent the clusters and subclusters in which more than one node appears
+    '''
+    memberships = get_cluster_memberships(
+        clustering_analysis_type,
+        cache_utils.get_data_version(['mass_spec_hit', 'mass_spec_cluster_heatmap'])
+    )
 
     # all clusters in which more than one node appears
-    clusters = clusters.loc[clusters.protein_group_id.isin([node['id'] for node in nodes])]
-    cluster_sizes = clusters.groupby('cluster_id').count().reset_index()
-    clusters = clusters.loc[
-        clusters.cluster_id.isin(
-            cluster_sizes.loc[cluster_sizes.protein_group_id > 1].cluster_id.values
-        )
-    ]
+    node_ids = set([node['id'] for node in nodes])
+    cluster_sizes = collections.Counter(
+        memberships[node_id][0] for node_id in node_ids if node_id in memberships
+    )
 
     # the type of subclustering that will be represented by the compound nodes
-    subcluster_id_name = 'core_complex_id'
+    subcluster_type_ind = 2
     if subcluster_type == 'subclusters':
-        subcluster_id_name = 'subcluster_id'
+        subcluster_type_ind = 1
 
     # append cluster, subcluster, and parent node ids to the nodes
     for node in nodes:
-        row = clusters.loc[clusters.protein_group_id == node['id']]
-        if len(row):
-            row = row.iloc[0]
-            node['cluster_id'] = int(row.cluster_id) if not pd.isna(row.cluster_id) else None
-            node['subcluster_id'] = (
-                int(row[subcluster_id_name]) if not pd.isna(row[subcluster_id_name]) else None
-            )
+        membership = memberships.get(node['id'])
+        if membership is not None and cluster_sizes[membership[0]] > 1:
+            node['cluster_id'] = membership[0]
+            node['subcluster_id'] = membership[subcluster_type_ind]
 
         # if the node is in a subcluster, its parent should be the subcluster compound node
         if node.get('subcluster_id'):
@@ -224,12 +382,14 @@ def construct_compound_nodes(nodes, clustering_analysis_type, subcluster_type, e
     parent_nodes = [{'id': '%s' % cluster_id} for cluster_id in list(set(cluster_ids))]
 
     # create the parent nodes for subclusters
+    parent_node_ids = set([node['id'] for node in parent_nodes])
     for node in nodes:
         if node.get('subcluster_id') is None:
             continue
         parent_node_id = node.get('parent')
-        if parent_node_id in [node['id'] for node in parent_nodes]:
+        if parent_node_id in parent_node_ids:
             continue
+        parent_node_ids.add(parent_node_id)
         parent_nodes.append({'id': parent_node_id, 'parent': node['cluster_id']})
 
     return nodes, parent_nodes
@@ -0,0 +1,208 @@
+import argparse
+import logging
+import os
+
+import flask
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from opencell.api import cache as cache_utils
+from opencell.database import utils as db_utils
+
+logger = logging.getLogger(__name__)
+
+# the tables from which the graph is built (the graph is versioned by the data in these tables only)
+INTERACTION_GRAPH_TABLES = ['mass_spec_pulldown', 'mass_spec_hit']
+
+
+class InteractionGraph:
+    '''
+    An in-memory index of the bipartite graph of pulldowns and their significant (or minor) hits
+
+    The graph is stored as CSR-style adjacency arrays, in both directions:
+    the hits of the pulldown with index i are
+        `protein_group_ids[hit_indices[hit_indptr[i]:hit_indptr[i + 1]]]`
+    and the pulldowns in which the protein group with index j appears are
+        `pulldown_ids[pulldown_indices[pulldown_indptr[j]:pulldown_indptr[j + 1]]]`
+
+    pulldown_ids : sorted array of all pulldown_ids
+    protein_group_ids : sorted array of the protein_group_ids of all significant hits
+    hit_indptr, hit_indices : the CSR adjacency from pulldowns to protein groups
+        (the hits of each pulldown are ordered by hit id)
+    is_displayed : boolean array of whether each pulldown can be displayed
+        (i.e., whether its manual_display_flag is either null or true)
+    version : the version of the data from which the graph was built
+        (see cache.get_data_version and INTERACTION_GRAPH_TABLES)
+    '''
+    def __init__(
+        self, pulldown_ids, protein_group_ids, hit_indptr, hit_indices, is_displayed, version=None
+    ):
+        self.pulldown_ids = pulldown_ids
+        self.protein_group_ids = protein_group_ids
+        self.hit_indptr = hit_indptr
+        self.hit_indices = hit_indices
+        self.is_displayed = is_displayed
+        self.version = version
+
+        self.pulldown_index = {_id: ind for ind, _id in enumerate(pulldown_ids.tolist())}
+        self.protein_group_index = {
+            _id: ind for ind, _id in enumerate(protein_group_ids.tolist())
+        }
+
+        # the transposed adjacency from protein groups to pulldowns
+        # (a stable sort keeps the pulldowns of each protein group ordered by pulldown_id)
+        hit_pulldown_indices = np.repeat(np.arange(len(pulldown_ids)), np.diff(hit_indptr))
+        order = np.argsort(hit_indices, kind='stable')
+        self.pulldown_indices = hit_pulldown_indices[order]
+        self.pulldown_indptr = np.concatenate((
+            [0], np.cumsum(np.bincount(hit_indices, minlength=len(protein_group_ids)))
+        ))
+
+
+    @classmethod
+    def from_database(cls, engine, version=None):
+        '''
+        Build the graph from the pulldown and hit tables (in two queries)
+        '''
+        pulldowns = pd.read_sql(
+            'select id, manual_display_flag from mass_spec_pulldown order by id', engine
+        )
+        hits = pd.read_sql(
+            '''
+            select pulldown_id, protein_group_id from mass_spec_hit
+            where is_significant_hit or is_minor_hit
+            order by pulldown_id, id
+            ''',
+            engine
+        )
+
+        pulldown_ids = pulldowns.id.values
+        protein_group_ids, hit_indices = np.unique(
+            np.asarray(hits.protein_group_id, dtype=str), return_inverse=True
+        )
+        hit_counts = np.bincount(
+            np.searchsorted(pulldown_ids, hits.pulldown_id.values), minlength=len(pulldown_ids)
+        )
+        hit_indptr = np.concatenate(([0], np.cumsum(hit_counts)))
+        is_displayed = pulldowns.manual_display_flag.isna().values | (
+            pulldowns.manual_display_flag.values == True  # noqa
+        )
+        return cls(
+            pulldown_ids=pulldown_ids,
+            protein_group_ids=protein_group_ids,
+            hit_indptr=hit_indptr,
+            hit_indices=hit_indices.ravel(),
+            is_displayed=is_displayed.astype(bool),
+            version=version,
+        )
+
+
+    @classmethod
+    def load(cls, filepath):
+        arrays = np.load(filepath, allow_pickle=False)
+        version = str(arrays['version']) or None
+        return cls(
+            pulldown_ids=arrays['pulldown_ids'],
+            protein_group_ids=arrays['protein_group_ids'],
+            hit_indptr=arrays['hit_indptr'],
+            hit_indices=arrays['hit_indices'],
+            is_displayed=arrays['is_displayed'],
+            version=version,
+        )
+
+
+    def save(self, filepath):
+        np.savez_compressed(
+            filepath,
+            pulldown_ids=self.pulldown_ids,
+            protein_group_ids=self.protein_group_ids,
+            hit_indptr=self.hit_indptr,
+            hit_indices=self.hit_indices,
+            is_displayed=self.is_displayed,
+            version=np.array(self.version or ''),
+        )
+
+
+    def get_hits(self, pulldown_id):
+        '''
+        The protein_group_ids of the significant hits in a pulldown
+        '''
+        ind = self.pulldown_index.get(pulldown_id)
+        if ind is None:
+            return []
+        indices = self.hit_indices[self.hit_indptr[ind]:self.hit_indptr[ind + 1]]
+        return self.protein_group_ids[indices].tolist()
+
+
+    def get_pulldowns(self, protein_group_ids, displayed_only=True):
+        '''
+        The pulldown_ids of the pulldowns in which any of the protein groups
+        appears as a significant hit (optionally only the pulldowns that can be displayed)
+        '''
+        indices = [
+            self.pulldown_indices[self.pulldown_indptr[ind]:self.pulldown_indptr[ind + 1]]
+            for ind in map(self.protein_group_index.get, protein_group_ids) if ind is not None
+        ]
+        if not indices:
+            return []
+        indices = np.unique(np.concatenate(indices))
+        if displayed_only:
+            indices = indices[self.is_displayed[indices]]
+        return self.pulldown_ids[indices].tolist()
+
+
+def get_interaction_graph():
+    '''
+    The interaction graph for the current app, which is built on first use
+    and rebuilt whenever the pulldowns or hits change (e.g., after the hits are re-ingested)
+
+    If the app's INTERACTION_GRAPH_FILEPATH is set, the graph is loaded from that file
+    if the file was built from the current data version
+    '''
+    app = flask.current_app
+    version = cache_utils.get_data_version(INTERACTION_GRAPH_TABLES)
+
+    graph = getattr(app, 'interaction_graph', None)
+    if graph is not None and graph.version == version:
+        return graph
+
+    filepath = app.config.get('INTERACTION_GRAPH_FILEPATH')
+    if filepath and os.path.isfile(filepath):
+        graph = InteractionGraph.load(filepath)
+
+    if graph is None or graph.version != version:
+        logger.info('Building the interaction graph for data version %s' % version)
+        graph = InteractionGraph.from_database(app.Session.get_bind(), version=version)
+
+    app.interaction_graph = graph
+    return graph
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--credentials', dest='credentials_filepath', required=True)
+    parser.add_argument('--dst', dest='dst_filepath', required=True)
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Build the interaction graph and save it to a file, e.g.:
+    `python -m opencell.api.interaction_graph --credentials db-credentials.json --dst graph.npz`
+    '''
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    engine = sa.create_engine(db_utils.url_from_credentials(args.credentials_filepath))
+    version = cache_utils.calculate_data_version(engine, INTERACTION_GRAPH_TABLES)
+    graph = InteractionGraph.from_database(engine, version=version)
+    graph.save(args.dst_filepath)
+    logger.info(
+        'Saved the interaction graph of %s pulldowns and %s protein groups to %s'
+        % (len(graph.pulldown_ids), len(graph.protein_group_ids), args.dst_filepath)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
+import base64
+import collections
 import re
-import json
 import numpy as np
 import pandas as pd
 
-from opencell.database import uniprot_utils
+from opencell.database import models, uniprot_utils
+from opencell.database import utils as db_utils
 from opencell.imaging.processors import FOVProcessor
 
 
@@ -16,6 +18,161 @@ def generate_cell_line_payload(cell_line, included_fields):
     '''
     design = cell_line.crispr_design
 
+    # get the thumbnail of the annotated ROI from the 'best' FOV
+    best_fov_payload = None
+    if 'best-fov' in included_fields:
+        fov = cell_line.get_best_fov()
+        if fov and fov.rois:
+            # hack: assume there is only one ROI (the annotated ROI)
+            thumbnail = fov.rois[0].get_thumbnail()
+            best_fov_payload = {'thumbnails': thumbnail.as_dict() if thumbnail else None}
+
+    pulldown = cell_line.get_best_pulldown()
+    return assemble_cell_line_payload(
+        cell_line,
+        design,
+        design.hgnc_metadata,
+        abundance_measurements=design.hgnc_metadata.abundance_measurements,
+        facs_scalars=cell_line.facs_dataset.scalars if cell_line.facs_dataset else None,
+        sequencing_scalars=(
+            cell_line.sequencing_dataset.scalars if cell_line.sequencing_dataset else {}
+        ),
+        categories=cell_line.annotation.categories if cell_line.annotation else None,
+        best_pulldown_id=pulldown.id if pulldown else None,
+        best_fov_payload=best_fov_payload,
+    )
+
+
+def generate_cell_line_payloads(session, rows, included_fields):
+    '''
+    Bulk version of generate_cell_line_payload for many cell lines at once
+
+    Rather than traversing the relationships of each cell line
+    (which requires either an enormous joinedload query or several queries per cell line),
+    each child table is loaded in one query keyed by cell_line_id (or ensg_id),
+    so the number of queries does not depend on the number of cell lines
+
+    rows : a list of (CellLine, CrisprDesign, HGNCMetadata) tuples
+    included_fields : a list of optional fields to include
+    '''
+    cell_line_ids = [line.id for line, _, _ in rows]
+    ensg_ids = list(set([hgnc_metadata.ensg_id for _, _, hgnc_metadata in rows]))
+
+    abundance_measurements = collections.defaultdict(list)
+    query = (
+        session.query(models.EnsemblUniprotAssociation.ensg_id, models.AbundanceMeasurement)
+        .join(
+            models.AbundanceMeasurement,
+            models.AbundanceMeasurement.uniprot_id == models.EnsemblUniprotAssociation.uniprot_id
+        )
+        .filter(models.EnsemblUniprotAssociation.ensg_id.in_(ensg_ids))
+        .order_by(models.AbundanceMeasurement.uniprot_id)
+    )
+    for ensg_id, measurement in query.all():
+        abundance_measurements[ensg_id].append(measurement)
+
+    facs_scalars = dict(
+        session.query(models.FACSDataset.cell_line_id, models.FACSDataset.scalars)
+        .filter(models.FACSDataset.cell_line_id.in_(cell_line_ids))
+        .all()
+    )
+    sequencing_scalars = dict(
+        session.query(models.SequencingDataset.cell_line_id, models.SequencingDataset.scalars)
+        .filter(models.SequencingDataset.cell_line_id.in_(cell_line_ids))
+        .all()
+    )
+    categories = dict(
+        session.query(models.CellLineAnnotation.cell_line_id, models.CellLineAnnotation.categories)
+        .filter(models.CellLineAnnotation.cell_line_id.in_(cell_line_ids))
+        .all()
+    )
+
+    pulldowns = collections.defaultdict(list)
+    query = (
+        session.query(
+            models.MassSpecPulldown.id,
+            models.MassSpecPulldown.cell_line_id,
+            models.MassSpecPulldown.manual_display_flag,
+        )
+        .filter(models.MassSpecPulldown.cell_line_id.in_(cell_line_ids))
+        .order_by(models.MassSpecPulldown.id)
+    )
+    for row in query.all():
+        pulldowns[row.cell_line_id].append(row)
+
+    # the thumbnail of the annotated ROI from the 'best' FOV of each cell line,
+    # where the 'best' FOV is the highest-scoring annotated FOV with an ROI thumbnail
+    # (as in CellLine.get_best_fov)
+    best_fov_thumbnails = {}
+    if 'best-fov' in included_fields:
+        query = (
+            session.query(models.MicroscopyFOV.cell_line_id, models.MicroscopyFOVROIThumbnail)
+            .select_from(models.MicroscopyFOVROIThumbnail)
+            .join(models.MicroscopyFOVROIThumbnail.roi)
+            .join(models.MicroscopyFOVROI.fov)
+            .join(models.MicroscopyFOV.annotation)
+            .filter(models.MicroscopyFOV.cell_line_id.in_(cell_line_ids))
+            .distinct(models.MicroscopyFOV.cell_line_id)
+            .order_by(
+                models.MicroscopyFOV.cell_line_id,
+                models.MicroscopyFOV.score.desc().nullslast(),
+                models.MicroscopyFOV.id,
+                models.MicroscopyFOVROI.id,
+                models.MicroscopyFOVROIThumbnail.id,
+            )
+        )
+        best_fov_thumbnails = dict(query.all())
+
+        # cell lines without such a thumbnail are omitted
+        # (this mimics the inner joins previously used to eager-load the FOVs and ROIs)
+        rows = [row for row in rows if row[0].id in best_fov_thumbnails]
+
+    cell_line_payloads = []
+    for cell_line, design, hgnc_metadata in rows:
+        best_pulldown = models.CellLine.select_best_pulldown(pulldowns.get(cell_line.id))
+
+        best_fov_payload = None
+        thumbnail = best_fov_thumbnails.get(cell_line.id)
+        if thumbnail is not None:
+            best_fov_payload = {'thumbnails': thumbnail.as_dict()}
+
+        payload = assemble_cell_line_payload(
+            cell_line,
+            design,
+            hgnc_metadata,
+            abundance_measurements=abundance_measurements.get(design.ensg_id),
+            facs_scalars=facs_scalars.get(cell_line.id),
+            sequencing_scalars=sequencing_scalars.get(cell_line.id, {}),
+            categories=categories.get(cell_line.id),
+            best_pulldown_id=best_pulldown.id if best_pulldown else None,
+            best_fov_payload=best_fov_payload,
+        )
+        cell_line_payloads.append(payload)
+
+    return cell_line_payloads
+
+
+def assemble_cell_line_payload(
+    cell_line,
+    design,
+    hgnc_metadata,
+    abundance_measurements,
+    facs_scalars,
+    sequencing_scalars,
+    categories,
+    best_pulldown_id,
+    best_fov_payload=None,
+):
+    '''
+    Assemble the cell line payload from already-loaded instances and values
+    (used by both generate_cell_line_payload and generate_cell_line_payloads)
+
+    facs_scalars : the scalars of the FACS dataset, or None if there is no FACS dataset
+    sequencing_scalars : the scalars of the sequencing dataset ({} if there is no dataset)
+    categories : the annotation categories, or None if there is no annotation
+    best_fov_payload : the optional 'best_fov' field (omitted if None)
+    '''
+
     # top-level metadata
     metadata_payload = {
         'cell_line_id': cell_line.id,
@@ -33,28 +190,22 @@ def generate_cell_line_payload(cell_line, included_fields):
     # TODO: merge this with top-level metadata above
     uniprot_metadata_payload = {
         'uniprot_id': design.uniprot_id,
-        'gene_name': design.hgnc_metadata.symbol,
-        'protein_name': uniprot_utils.prettify_hgnc_protein_name(design.hgnc_metadata.name),
+        'gene_name': hgnc_metadata.symbol,
+        'protein_name': uniprot_utils.prettify_hgnc_protein_name(hgnc_metadata.name),
     }
 
-    abundance_payload = generate_abundance_measurement_payload(
-        design.hgnc_metadata.abundance_measurements
-    )
+    abundance_payload = generate_abundance_measurement_payload(abundance_measurements)
 
     # the FACS area and relative median log intensity
     facs_payload = {}
-    if cell_line.facs_dataset:
+    if facs_scalars is not None:
         facs_payload = {
-            'area': cell_line.facs_dataset.scalars.get('area'),
-            'intensity': cell_line.facs_dataset.scalars.get('rel_median_log')
+            'area': facs_scalars.get('area'),
+            'intensity': facs_scalars.get('rel_median_log')
         }
 
-    sequencing_payload = {}
-    if cell_line.sequencing_dataset:
-        sequencing_payload = cell_line.sequencing_dataset.scalars
-
     # all of the manual annotation categories
-    categories = cell_line.annotation.categories if cell_line.annotation else []
+    categories = categories or []
     annotation_payload = {
         'categories': categories or None,
         'has_graded_annotations': bool(np.any([
@@ -62,29 +213,18 @@ def generate_cell_line_payload(cell_line, included_fields):
         ]))
     }
 
-    # the id of the 'best' pulldown
-    pulldown = cell_line.get_best_pulldown()
-    pulldown_id = pulldown.id if pulldown else None
-
     payload = {
         'metadata': metadata_payload,
         'facs': facs_payload,
-        'sequencing': sequencing_payload,
+        'sequencing': sequencing_scalars,
         'uniprot_metadata': uniprot_metadata_payload,
         'abundance_data': abundance_payload,
         'annotation': annotation_payload,
-        'best_pulldown': {'id': pulldown_id},
+        'best_pulldown': {'id': best_pulldown_id},
     }
 
-    # get the thumbnail of the annotated ROI from the 'best' FOV
-    if 'best-fov' in included_fields:
-        fov = cell_line.get_best_fov()
-        if fov and fov.rois:
-            # hack: assume there is only one ROI (the annotated ROI)
-            thumbnail = fov.rois[0].get_thumbnail()
-            payload['best_fov'] = {
-                'thumbnails': thumbnail.as_dict() if thumbnail else None
-            }
+    if best_fov_payload is not None:
+        payload['best_fov'] = best_fov_payload
     return payload
 
 
@@ -117,10 +257,8 @@ def generate_abundance_measurement_payload(abundance_measurements):
         protein_concentration
     )
 
-    # coerce nans to None
-    abundance_payload = json.loads(pd.Series(abundance_payload).to_json())
-
-    return abundance_payload
+    # coerce NaNs to None
+    return db_utils.to_jsonable(abundance_payload, coerce_datetimes=False)
 
 
 def generate_fov_payload(fov, include_rois=False, include_thumbnails=False):
@@ -140,16 +278,13 @@ def generate_fov_payload(fov, include_rois=False, include_thumbnails=False):
     # the 488 exposure settings
     tiff_metadata = fov.get_result('raw-tiff-metadata')
     if tiff_metadata:
-        metadata['laser_power_488'] = tiff_metadata.data.get('laser_power_488_488')
+        metadata['laser_power_488'] = fov.laser_power_488
         metadata['exposure_time_488'] = tiff_metadata.data.get('exposure_time_488')
         metadata['max_intensity_488'] = tiff_metadata.data.get('max_intensity_488')
 
     # the position of the cell layer center, relative to the bottom of the stack
-    tiff_metadata = fov.get_result('clean-tiff-metadata')
-    if tiff_metadata and tiff_metadata.data.get('cell_layer_center') is not None:
-        metadata['cell_layer_center'] = (
-            tiff_metadata.data.get('cell_layer_center')*metadata['z_step_size']
-        )
+    if fov.cell_layer_center is not None:
+        metadata['cell_layer_center'] = fov.cell_layer_center*metadata['z_step_size']
 
     fov_payload = {
         'metadata': metadata,
@@ -171,15 +306,52 @@ def generate_fov_payload(fov, include_rois=False, include_thumbnails=False):
     return fov_payload
 
 
-def generate_pulldown_hits_payload(pulldown, significant_hits, nonsignificant_hits):
+# the encodings of the nonsignificant hits in the pulldown hits payload
+NONSIGNIFICANT_HIT_ENCODINGS = ['pairs', 'columnar', 'base64']
+
+
+def encode_nonsignificant_hits(nonsignificant_hits, encoding='pairs'):
+    '''
+    Encode the (pval, enrichment) values of the nonsignificant hits
+
+    nonsignificant_hits : an (n, 2) array of the pval and enrichment of each hit
+    encoding : one of
+        'pairs' : a list of [pval, enrichment] pairs, rounded to three decimals (the default)
+        'columnar' : a dict of 'pval' and 'enrichment' lists, rounded to three decimals
+        'base64' : a dict of the shape and dtype of the values, and the values themselves
+            as a base64-encoded row-major array of little-endian float32s
+    '''
+    if encoding == 'columnar':
+        values = np.round(nonsignificant_hits, 3)
+        return {'pval': values[:, 0].tolist(), 'enrichment': values[:, 1].tolist()}
+
+    if encoding == 'base64':
+        values = np.ascontiguousarray(nonsignificant_hits, dtype='<f4')
+        return {
+            'dtype': 'float32',
+            'shape': list(values.shape),
+            'data': base64.b64encode(values.tobytes()).decode(),
+        }
+
+    # compress the nonsignificant hits by dropping digits
+    return [
+        [float('%0.3f' % pval), float('%0.3f' % enrichment)]
+        for pval, enrichment in nonsignificant_hits.tolist()
+    ]
+
+
+def generate_pulldown_hits_payload(
+    pulldown, significant_hits, nonsignificant_hits, encoding='pairs'
+):
     '''
     The JSON payload for a mass spec pulldown and all of its hits
 
     pulldown : a models.MassSpecPulldown instance
     significant_hits : a list of models.MassSpecHit instances corresponding to
         the pulldown's significant hits
-    nonsignificant_hits : a list of tuples of (pval, enrichment)
+    nonsignificant_hits : an (n, 2) array of (pval, enrichment)
         for all of the pulldown's non-significant hits (usually thousands)
+    encoding : the encoding of the nonsignificant hits (see encode_nonsignificant_hits)
     '''
 
     hit_attrs = ['pval', 'enrichment', 'interaction_stoich', 'abundance_stoich', 'is_minor_hit']
@@ -193,21 +365,15 @@ def generate_pulldown_hits_payload(pulldown, significant_hits, nonsignificant_hi
         )
         significant_hit_payloads.append(significant_hit_payload)
 
-    # hackish way to coerce NaNs and Infs to None
-    significant_hit_payloads = json.loads(
-        pd.DataFrame(data=significant_hit_payloads).to_json(orient='records')
+    # coerce NaNs and Infs to None
+    significant_hit_payloads = db_utils.to_jsonable(
+        significant_hit_payloads, coerce_datetimes=False
     )
 
-    # compress the nonsignificant hits by dropping digits
-    nonsignificant_hit_payloads = [
-        [float('%0.3f' % pval), float('%0.3f' % enrichment)]
-        for pval, enrichment in nonsignificant_hits
-    ]
-
     pulldown_hits_payload = {
         'metadata': pulldown.as_dict(),
         'significant_hits': significant_hit_payloads,
-        'nonsignificant_hits': nonsignificant_hit_payloads
+        'nonsignificant_hits': encode_nonsignificant_hits(nonsignificant_hits, encoding),
     }
     return pulldown_hits_payload
 
@@ -1,44 +1,45 @@
 import flask
+import functools
 import imageio
 import io
-import json
+import numpy as np
 import os
 import pandas as pd
 import sqlalchemy as sa
 import tifffile
-import urllib
 
 from flask_restful import Resource
 
 from opencell.imaging import utils
 from opencell.api import payloads, cytoscape_payload
+from opencell.api import utils as api_utils
+from opencell.api import cache as cache_utils
 from opencell.api.cache import cache
+from opencell.api.interaction_graph import get_interaction_graph
+from opencell.api.search_index import get_search_index
 from opencell.database import models, metadata_operations, uniprot_utils
 from opencell.database import utils as db_utils
 from opencell.imaging.processors import FOVProcessor
 
 
-# copied from https://stackoverflow.com/questions/24816799/how-to-use-flask-cache-with-flask-restful
-def cache_key():
-    args = flask.request.args
-    key = flask.request.path + '?' + urllib.parse.urlencode([
-        (k, v) for k in sorted(args) for v in sorted(args.getlist(k))
-    ])
-    return key
-
-
 class ClearCache(Resource):
+    '''
+    Invalidate the cached payloads if the data has changed
+    (or clear the entire cache if the `hard` parameter is 'true')
+    '''
     def get(self):
         with flask.current_app.app_context():
-            cache.clear()
-        return flask.jsonify({'result': 'cache cleared'})
+            if flask.request.args.get('hard') == 'true':
+                cache.clear()
+            version = cache_utils.refresh_data_version()
+        return flask.jsonify({'result': 'cache cleared', 'data_version': version})
 
 
 class GeneNameSearch(Resource):
     '''
     A list of cell_line_ids and ensg_ids that exactly correspond to a gene name
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, gene_name):
         payload = {}
         gene_name = gene_name.upper()
@@ -55,10 +56,9 @@ class GeneNameSearch(Resource):
         )
 
         if publication_ready_only:
-            cell_line_ids = metadata_operations.get_lines_by_annotation(
-                engine=flask.current_app.Session.get_bind(), annotation='publication_ready'
+            query = query.filter(
+                models.CellLine.id.in_(metadata_operations.select_publication_ready_lines())
             )
-            query = query.filter(models.CellLine.id.in_(cell_line_ids))
 
         # hack for the positive controls
         if gene_name in ['CLTA', 'BCAP31']:
@@ -98,8 +98,8 @@ class FullTextSearch(Resource):
     and we search the uniprot gene_names field for all gene names
     that start with, or exactly match, the query.
 
-    NOTE: the queries in this method rely on a materialized view
-    called 'searchable_hgnc_metadata' defined in `define_views.sql`
+    NOTE: the queries in this method rely on the materialized views
+    'searchable_hgnc_metadata' and 'gene_name_alias' defined in `define_views.sql`
     '''
     @staticmethod
     def get_approved_gene_name_from_query(session, query):
@@ -123,13 +123,9 @@ class FullTextSearch(Resource):
         else:
             result = pd.read_sql(
                 '''
-                select * from (
-                    select symbol, ensg_id, unnest(
-                        string_to_array(prev_symbol, '|') || string_to_array(alias_symbol, '|')
-                    ) as alias_or_prev
-                    from hgnc_metadata
-                ) tmp
-                where alias_or_prev ilike %(query)s
+                select hgnc.symbol, hgnc.ensg_id from gene_name_alias alias
+                inner join hgnc_metadata hgnc on hgnc.ensg_id = alias.ensg_id
+                where alias.kind != 'symbol' and alias.name = %(query)s
                 ''',
                 session.get_bind(),
                 params=dict(query=query.upper())
@@ -167,21 +163,13 @@ class FullTextSearch(Resource):
         '''
         Search for opencell targets and interactors any of whose HGNC gene names
         (current, previous, or alias) starts with the query
+        (this relies on the prefix index on the gene_name_alias materialized view)
         '''
         results = pd.read_sql(
             '''
             select * from searchable_hgnc_metadata
             where ensg_id in (
-                select ensg_id from (
-                    select ensg_id,
-                        unnest(
-                            string_to_array(symbol, '')
-                            || string_to_array(prev_symbol, '|')
-                            || string_to_array(alias_symbol, '|')
-                        ) as gene_name
-                    from hgnc_metadata
-                ) as tmp
-                where gene_name like %(query)s
+                select ensg_id from gene_name_alias where name like %(query)s
             );
             ''',
             engine,
@@ -194,29 +182,41 @@ class FullTextSearch(Resource):
         return results
 
 
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, query):
-        engine = flask.current_app.Session.get_bind()
-
         # eliminate trailing spaces
         query = query.strip()
 
+        # use the in-memory search index if possible, which avoids the queries below
+        if flask.current_app.config['USE_SEARCH_INDEX']:
+            index = get_search_index()
+            get_approved_gene_name = index.get_approved_gene_name
+            search_gene_names = index.search_gene_names
+            search_protein_names = index.search_protein_names
+        else:
+            engine = flask.current_app.Session.get_bind()
+            get_approved_gene_name = functools.partial(
+                self.get_approved_gene_name_from_query, flask.current_app.Session
+            )
+            search_gene_names = functools.partial(self.search_gene_names, engine)
+            search_protein_names = functools.partial(self.search_protein_names, engine)
+
         # attempt to look up the approved gene name from the query,
         # in the even that the query is an exact alias or previous gene name
         (
             query_is_valid_gene_name, query_is_legacy_gene_name, approved_gene_name
-        ) = self.get_approved_gene_name_from_query(flask.current_app.Session, query)
+        ) = get_approved_gene_name(query)
 
         # search for partial gene name matches
-        partial_gene_name_matches = self.search_gene_names(engine, query)
+        partial_gene_name_matches = search_gene_names(query)
 
         # if there are no partial matches but the query is an exact legacy gene name,
         # try again using the approved gene name
         if query_is_legacy_gene_name and not partial_gene_name_matches.shape[0]:
-            partial_gene_name_matches = self.search_gene_names(engine, approved_gene_name)
+            partial_gene_name_matches = search_gene_names(approved_gene_name)
 
         # always search the protein names with the original query
-        protein_name_matches = self.search_protein_names(engine, query)
+        protein_name_matches = search_protein_names(query)
 
         # combine the results from both searches
         all_results = pd.concat((partial_gene_name_matches, protein_name_matches), axis=0)
@@ -225,53 +225,61 @@ class FullTextSearch(Resource):
         all_results = all_results.groupby('ensg_id').first().reset_index()
 
         # hackish logic that determines whether the result is a target, interactor, or expressed
-        all_results['status'] = 'unknown'
-        for ind, row in all_results.iterrows():
-            if not pd.isna(row.published_cell_line_id):
-                status = 'Target'
-            elif not pd.isna(row.significant_protein_group_id):
-                status = 'Interactor'
-            elif not pd.isna(row.measured_expression):
-                status = 'Expressed'
-            else:
-                # the space prefix here is a deliberate hack to force undetected proteins
-                # to appear last when the search results are sorted by status in the frontend
-                status = ' Not detected'
-            all_results.at[ind, 'status'] = status
+        # (the space prefix in ' Not detected' is a deliberate hack to force undetected proteins
+        # to appear last when the search results are sorted by status in the frontend)
+        all_results['status'] = np.select(
+            [
+                all_results.published_cell_line_id.notna(),
+                all_results.significant_protein_group_id.notna(),
+                all_results.measured_expression.notna(),
+            ],
+            ['Target', 'Interactor', 'Expressed'],
+            default=' Not detected'
+        )
 
         # force the targets to the top of the search results, then sort by relevance
         all_results.sort_values(['status', 'relevance'], inplace=True, ascending=False)
 
-        # prettify the protein names
-        all_results['protein_name'] = all_results.protein_name.apply(
-            lambda s: uniprot_utils.prettify_hgnc_protein_name(s)
+        # drop unneeded columns (the search index omits the content column)
+        # (note that the protein names are prettified in the searchable_hgnc_metadata view)
+        all_results.drop(
+            labels=['content', 'significant_protein_group_id'], axis=1, inplace=True, errors='ignore'
         )
 
-        # drop unneeded column
-        all_results.drop(labels=['content', 'significant_protein_group_id'], axis=1, inplace=True)
-
         # if the query was a valid (approved or legacy) gene name,
         # set the relevance of its exact match, if there was one, to 10
         exact_match_found = False
         if approved_gene_name is not None:
-            mask = all_results.gene_name.apply(lambda names: approved_gene_name in names)
+            mask = all_results.gene_name.str.contains(approved_gene_name, regex=False, na=False)
             all_results.loc[mask, 'relevance'] = 10
-            exact_match_found = bool(mask.sum() > 0)
+            exact_match_found = bool(mask.any())
 
         return flask.jsonify({
             'is_valid_gene_name': query_is_valid_gene_name,
             'is_legacy_gene_name': query_is_legacy_gene_name,
             'approved_gene_name': approved_gene_name,
             'exact_match_found': exact_match_found,
-            'hits': json.loads(all_results.to_json(orient='records')),
+            'hits': api_utils.dataframe_to_records(all_results),
         })
 
 
+class Autocomplete(Resource):
+    '''
+    The opencell targets and interactors with a gene name (current, previous, or alias)
+    that starts with the prefix, using the in-memory search index
+
+    The payloads are not cached, since the index lookup is cheaper than a cache lookup
+    '''
+    def get(self, prefix):
+        limit = min(flask.request.args.get('limit', 10, type=int), 100)
+        return flask.jsonify(get_search_index().autocomplete(prefix.strip(), limit=limit))
+
+
 class UniProtKBAnnotation(Resource):
     '''
     The prettified functional annotation from UniProtKB
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, uniprot_id):
         metadata = (
             flask.current_app.Session.query(models.UniprotKBMetadata)
@@ -295,7 +303,7 @@ class AbundanceDataset(Resource):
     '''
     The full abundance dataset
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self):
         df = pd.read_sql(
             '''
@@ -307,26 +315,20 @@ class AbundanceDataset(Resource):
             ''',
             flask.current_app.Session.get_bind()
         )
-        return flask.jsonify(json.loads(df.to_json(orient='records')))
+        return flask.jsonify(api_utils.dataframe_to_records(df))
 
 
 class TargetNames(Resource):
     '''
     A list of the target names and HGNC protein names for all crispr designs
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self):
 
         publication_ready_only = flask.request.args.get('publication_ready') == 'true'
         if flask.current_app.config['HIDE_PRIVATE_DATA']:
             publication_ready_only = True
 
-        cell_line_ids = None
-        if publication_ready_only:
-            cell_line_ids = metadata_operations.get_lines_by_annotation(
-                engine=flask.current_app.Session.get_bind(), annotation='publication_ready'
-            )
-
         query = (
             flask.current_app.Session.query(
                 models.CrisprDesign.target_name,
@@ -334,10 +336,10 @@ class TargetNames(Resource):
             )
             .join(models.CrisprDesign.hgnc_metadata)
         )
-        if cell_line_ids is not None:
+        if publication_ready_only:
             query = (
                 query.join(models.CrisprDesign.cell_lines)
-                .filter(models.CellLine.id.in_(cell_line_ids))
+                .filter(models.CellLine.id.in_(metadata_operations.select_publication_ready_lines()))
             )
 
         names = pd.DataFrame(data=[row._asdict() for row in query.all()])
@@ -345,7 +347,7 @@ class TargetNames(Resource):
         # eliminate duplicates
         names = names.groupby('target_name').first().reset_index()
 
-        return flask.jsonify(json.loads(names.to_json(orient='records')))
+        return flask.jsonify(names.to_dict(orient='records'))
 
 
 class Plate(Resource):
@@ -368,7 +370,7 @@ class CellLines(Resource):
     A list of cell line metadata for all cell lines,
     possibly filtered by plate_id and the publication_ready annotation
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self):
 
         Session = flask.current_app.Session
@@ -386,95 +388,64 @@ class CellLines(Resource):
         cell_line_ids = args.get('ids')
         cell_line_ids = [int(_id) for _id in cell_line_ids.split(',')] if cell_line_ids else []
 
-        if publication_ready_only:
-            pr_cell_line_ids = metadata_operations.get_lines_by_annotation(
-                engine=flask.current_app.Session.get_bind(), annotation='publication_ready'
-            )
-            if len(cell_line_ids):
-                cell_line_ids = list(set(cell_line_ids).intersection(pr_cell_line_ids))
-            else:
-                cell_line_ids = pr_cell_line_ids
-
-        # cell line query with the eager-loading required by generate_cell_line_payload
+        # the cell lines and the metadata from their crispr designs
+        # (the child tables are loaded in bulk by generate_cell_line_payloads)
         query = (
-            Session.query(models.CellLine)
+            Session.query(models.CellLine, models.CrisprDesign, models.HGNCMetadata)
             .join(models.CellLine.crispr_design)
-            .options(
-                (
-                    sa.orm.joinedload(models.CellLine.crispr_design, innerjoin=True)
-                    .joinedload(models.CrisprDesign.hgnc_metadata, innerjoin=True)
-                    .joinedload(models.HGNCMetadata.abundance_measurements)
-                ), (
-                    sa.orm.joinedload(models.CellLine.crispr_design, innerjoin=True)
-                    .joinedload(models.CrisprDesign.uniprotkb_metadata, innerjoin=True)
-                ),
-                sa.orm.joinedload(models.CellLine.facs_dataset),
-                sa.orm.joinedload(models.CellLine.sequencing_dataset),
-                sa.orm.joinedload(models.CellLine.annotation),
-                sa.orm.joinedload(models.CellLine.pulldowns)
-            )
+            .join(models.CrisprDesign.hgnc_metadata)
+            .join(models.CrisprDesign.uniprotkb_metadata)
+            .order_by(models.CellLine.id)
         )
 
         if plate_id:
             query = query.filter(models.CrisprDesign.plate_design_id == plate_id)
         if cell_line_ids:
             query = query.filter(models.CellLine.id.in_(cell_line_ids))
-
-        if 'best-fov' in included_fields:
-            query = query.options(
-                (
-                    sa.orm.joinedload(models.CellLine.fovs, innerjoin=True)
-                    .joinedload(models.MicroscopyFOV.rois, innerjoin=True)
-                    .joinedload(models.MicroscopyFOVROI.thumbnails, innerjoin=True)
-                ), (
-                    sa.orm.joinedload(models.CellLine.fovs, innerjoin=True)
-                    .joinedload(models.MicroscopyFOV.annotation, innerjoin=True)
-                )
+        if publication_ready_only:
+            query = query.filter(
+                models.CellLine.id.in_(metadata_operations.select_publication_ready_lines())
             )
 
-        lines = query.all()
+        cell_line_payloads = payloads.generate_cell_line_payloads(
+            Session, query.all(), included_fields
+        )
+        line_ids = [payload['metadata']['cell_line_id'] for payload in cell_line_payloads]
 
-        # a separate query for counting FOVs and annotated FOVs per cell line
+        # a separate query for counting FOVs and annotated FOVs per cell line,
+        # and the same counts restricted to dragonfly-automation datasets
+        # (the 'dad' appendix stands for dragonfly-automation datasets)
+        fov_id = models.MicroscopyFOV.id
+        annotation_id = models.MicroscopyFOVAnnotation.id
+        dad_pmls = ['PML%04d' % ind for ind in range(196, 999)]
+        is_dad = models.MicroscopyFOV.pml_id.in_(dad_pmls)
         fov_counts_query = (
             Session.query(
                 models.CellLine.id,
-                sa.func.count(models.MicroscopyFOV.id).label('num_fovs'),
-                sa.func.count(models.MicroscopyFOVAnnotation.id).label('num_annotated_fovs'),
+                sa.func.count(fov_id).label('num_fovs'),
+                sa.func.count(annotation_id).label('num_annotated_fovs'),
+                sa.func.count(fov_id).filter(is_dad).label('num_fovs_dad'),
+                sa.func.count(annotation_id).filter(is_dad).label('num_annotated_fovs_dad'),
             )
             .outerjoin(models.CellLine.fovs)
             .outerjoin(models.MicroscopyFOV.annotation)
-            .filter(models.CellLine.id.in_([line.id for line in lines]))
+            .filter(models.CellLine.id.in_(line_ids))
             .group_by(models.CellLine.id)
         )
-        fov_counts = pd.DataFrame([row._asdict() for row in fov_counts_query.all()])
+        fov_counts = {row.id: row._asdict() for row in fov_counts_query.all()}
 
-        # hackish counting of the number of annotated FOVs from dragonfly-automation datasets
-        # (the 'dad' appendix stands for dragonfly-automation datasets)
-        dad_pmls = ['PML%04d' % ind for ind in range(196, 999)]
-        fov_counts_query = fov_counts_query.filter(models.MicroscopyFOV.pml_id == sa.any_(dad_pmls))
-        fov_counts_dad = pd.DataFrame([row._asdict() for row in fov_counts_query.all()])
-        fov_counts_dad.rename(
-            columns={column: '%s_dad' % column for column in fov_counts_dad.columns},
-            inplace=True
-        )
-        if fov_counts_dad.shape[0]:
-            fov_counts = pd.merge(
-                fov_counts, fov_counts_dad, left_on='id', right_on='id_dad', how='left'
-            )
-
-        # the list of pulldown_ids with saved cytoscape networks
-        pulldowns_with_saved_networks = [
+        # the set of pulldown_ids with saved cytoscape networks
+        pulldowns_with_saved_networks = set([
             row[0] for row in Session.query(models.MassSpecPulldownNetwork.pulldown_id).all()
-        ]
+        ])
 
-        cell_line_payloads = []
-        for line in lines:
-            payload = payloads.generate_cell_line_payload(line, included_fields)
+        for payload in cell_line_payloads:
+            cell_line_id = payload['metadata']['cell_line_id']
 
             # append the FOV counts (for the internal version of the frontend)
-            fov_count = fov_counts.loc[fov_counts.id == line.id].iloc[0]
-            if fov_count.shape[0]:
-                payload['fov_counts'] = json.loads(fov_count.to_json())
+            fov_count = fov_counts.get(cell_line_id)
+            if fov_count is not None:
+                payload['fov_counts'] = fov_count
 
             # append a flag for the existence of a saved pulldown network
             pulldown_id = payload['best_pulldown']['id']
@@ -483,8 +454,6 @@ class CellLines(Resource):
                     pulldown_id in pulldowns_with_saved_networks
                 )
 
-            cell_line_payloads.append(payload)
-
         return flask.jsonify(cell_line_payloads)
 
 
@@ -514,7 +483,7 @@ class CellLine(CellLineResource):
     '''
     The cell line metadata for a single cell line
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, cell_line_id):
         line = self.get_cell_line(cell_line_id)
         optional_fields, error = self.parse_listlike_arg('fields', allowed_values=['best-fov'])
@@ -593,7 +562,7 @@ class InteractorMetadata(InteractorResource):
     (note that the 'interactor' nomenclature is misleading;
     this is any gene in the genome, identified by an ensg_id)
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, ensg_id):
         payload = self.construct_metadata(ensg_id)
         return flask.jsonify(payload)
@@ -603,22 +572,25 @@ class InteractorNetwork(InteractorResource):
     '''
     The cytoscape interaction network for an interactor (identified by an ensg_id)
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, ensg_id):
 
         protein_groups = self.get_protein_groups(ensg_id)
         if not protein_groups:
             return flask.abort(404, 'There are no protein groups for ENSG ID %s' % ensg_id)
 
-        interacting_pulldowns = []
-        for protein_group in protein_groups:
-            interacting_pulldowns.extend(protein_group.get_pulldowns())
+        # the pulldowns in which any of the protein groups appears as a hit
+        interaction_graph = get_interaction_graph()
+        interacting_pulldown_ids = interaction_graph.get_pulldowns(
+            [protein_group.id for protein_group in protein_groups]
+        )
 
         # TODO: refactor construct_network so we do not have to pass a single primary protein group
         primary_protein_group = protein_groups[0]
         nodes, edges = cytoscape_payload.construct_network(
-            interacting_pulldowns=interacting_pulldowns,
+            interacting_pulldown_ids=interacting_pulldown_ids,
             origin_protein_group=primary_protein_group,
+            interaction_graph=interaction_graph,
         )
 
         # create compound nodes to represent superclusters and subclusters
@@ -626,7 +598,6 @@ class InteractorNetwork(InteractorResource):
             nodes,
             clustering_analysis_type=flask.request.args.get('clustering_analysis_type'),
             subcluster_type=flask.request.args.get('subcluster_type'),
-            engine=flask.current_app.Session.get_bind()
         )
         payload = {
             'parent_nodes': [{'data': node} for node in parent_nodes],
@@ -638,7 +609,7 @@ class InteractorNetwork(InteractorResource):
 
 
 class FACSDataset(CellLineResource):
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, cell_line_id):
         line = self.get_cell_line(cell_line_id)
         if not line.facs_dataset:
@@ -651,7 +622,7 @@ class MicroscopyFOVMetadata(CellLineResource):
     '''
     Metadata for all of the FOVs associated with a cell line
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, cell_line_id):
 
         only_annotated = flask.request.args.get('annotatedonly') == 'true'
@@ -721,28 +692,42 @@ class PulldownResource(CellLineResource):
 class PulldownHits(PulldownResource):
     '''
     The metadata and hits for a pulldown
+
+    The optional `encoding` parameter determines the encoding of the nonsignificant hits
+    (see payloads.encode_nonsignificant_hits); the default is a list of [pval, enrichment] pairs
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, pulldown_id):
         Session = flask.current_app.Session
+
+        encoding = flask.request.args.get('encoding') or 'pairs'
+        if encoding not in payloads.NONSIGNIFICANT_HIT_ENCODINGS:
+            return flask.abort(404, 'Invalid value passed to the encoding parameter')
+
         pulldown = self.get_pulldown(pulldown_id)
-        if not pulldown.hits:
+        has_hits = Session.query(
+            Session.query(models.MassSpecHit)
+            .filter(models.MassSpecHit.pulldown_id == pulldown.id)
+            .exists()
+        ).scalar()
+        if not has_hits:
             return flask.abort(404, 'Pulldown %s does not have any hits' % pulldown_id)
 
         significant_hits = pulldown.get_significant_hits()
 
         # we need only the pval and enrichment for the non-significant hits
-        nonsignificant_hits = (
+        nonsignificant_hits = np.array(
             Session.query(models.MassSpecHit.pval, models.MassSpecHit.enrichment)
             .filter(models.MassSpecHit.pulldown_id == pulldown.id)
             .filter(models.MassSpecHit.is_minor_hit == False)  # noqa
             .filter(models.MassSpecHit.is_significant_hit == False)  # noqa
-            .all()
-        )
+            .all(),
+            dtype=float
+        ).reshape(-1, 2)
 
         # construct the JSON payload from the pulldown and hit instances
         payload = payloads.generate_pulldown_hits_payload(
-            pulldown, significant_hits, nonsignificant_hits
+            pulldown, significant_hits, nonsignificant_hits, encoding=encoding
         )
         return flask.jsonify(payload)
 
@@ -752,7 +737,7 @@ class PulldownNetwork(PulldownResource):
     The cytoscape interaction network for a pulldown
     (see comments in cytoscape_payload.construct_network for details)
     '''
-    @cache.cached(key_prefix=cache_key)
+    @cache_utils.cached_payload
     def get(self, pulldown_id):
 
         pulldown = self.get_pulldown(pulldown_id)
@@ -788,7 +773,9 @@ class PulldownNetwork(PulldownResource):
         # create nodes to represent direct hits and/or interacting pulldowns,
         # and the edges between them
         nodes, edges = cytoscape_payload.construct_network(
-            target_pulldown=pulldown, origin_protein_group=origin_protein_group
+            target_pulldown=pulldown,
+            origin_protein_group=origin_protein_group,
+            interaction_graph=get_interaction_graph(),
         )
 
         # create compound nodes to represent superclusters and subclusters
@@ -796,7 +783,6 @@ class PulldownNetwork(PulldownResource):
             nodes,
             clustering_analysis_type=flask.request.args.get('clustering_analysis_type'),
             subcluster_type=flask.request.args.get('subcluster_type'),
-            engine=flask.current_app.Session.get_bind()
         )
 
         payload = {
@@ -807,9 +793,7 @@ class PulldownNetwork(PulldownResource):
         }
 
         # coerce NaNs and Infs in stoichiometries to None
-        payload['nodes'] = json.loads(
-            pd.DataFrame(data=payload['nodes']).to_json(orient='records')
-        )
+        payload['nodes'] = db_utils.to_jsonable(payload['nodes'], coerce_datetimes=False)
 
         return flask.jsonify(payload)
 
@@ -920,9 +904,9 @@ class PulldownClusters(PulldownResource):
 
         payload = {
             'metadata': {'cluster_id': cluster_id},
-            'tiles': json.loads(heatmap_tiles.to_json(orient='records')),
-            'rows': json.loads(heatmap_row_metadata.to_json(orient='records')),
-            'columns': json.loads(heatmap_column_metadata.to_json(orient='records')),
+            'tiles': api_utils.dataframe_to_records(heatmap_tiles),
+            'rows': api_utils.dataframe_to_records(heatmap_row_metadata),
+            'columns': api_utils.dataframe_to_records(heatmap_column_metadata),
         }
         return flask.jsonify(payload)
 
@@ -975,7 +959,7 @@ class MicroscopyFOV(Resource):
 
 class MicroscopyFOVROI(Resource):
 
-    @cache.cached(key_prefix=cache_key)
+    @cache.cached(key_prefix=cache_utils.cache_key)
     def get(self, roi_id, roi_kind, channel):
         '''
         Get the image data for a given ROI
@@ -1070,6 +1054,7 @@ class CellLineAnnotation(CellLineResource):
         except Exception as error:
             flask.abort(500, str(error))
 
+        cache_utils.refresh_data_version(['cell_line_annotation'])
         return flask.jsonify(annotation.as_dict())
 
 
@@ -1121,6 +1106,10 @@ class MicroscopyFOVAnnotation(Resource):
             )
         except Exception as error:
             flask.abort(500, str(error))
+
+        cache_utils.refresh_data_version(
+            ['microscopy_fov_annotation', 'microscopy_fov_roi', 'microscopy_fov_roi_thumbnail']
+        )
         return flask.jsonify(annotation.as_dict())
 
 
@@ -1141,6 +1130,10 @@ class MicroscopyFOVAnnotation(Resource):
             db_utils.delete_and_commit(flask.current_app.Session, fov.rois)
         except Exception as error:
             flask.abort(500, str(error))
+
+        cache_utils.refresh_data_version(
+            ['microscopy_fov_annotation', 'microscopy_fov_roi', 'microscopy_fov_roi_thumbnail']
+        )
         return ('', 204)
 
 
@@ -1177,6 +1170,8 @@ class SavedPulldownNetwork(PulldownResource):
             )
         except Exception as error:
             flask.abort(500, str(error))
+
+        cache_utils.refresh_data_version(['mass_spec_pulldown_network'])
         return flask.jsonify(network.as_dict())
 
     def delete(self, pulldown_id):
@@ -1189,6 +1184,8 @@ class SavedPulldownNetwork(PulldownResource):
             db_utils.delete_and_commit(flask.current_app.Session, pulldown.network)
         except Exception as error:
             flask.abort(500, str(error))
+
+        cache_utils.refresh_data_version(['mass_spec_pulldown_network'])
         return ('', 204)
 
 
@@ -1280,7 +1277,7 @@ class EmbeddingPositions(Resource):
 
         return flask.jsonify({
             'tile_filename': tile_filename,
-            'positions': json.loads(positions.to_json(orient='records'))
+            'positions': api_utils.dataframe_to_records(positions)
         })
 
 
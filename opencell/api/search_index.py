@@ -0,0 +1,261 @@
+import bisect
+import logging
+import re
+
+import flask
+import numpy as np
+import pandas as pd
+
+from opencell.api import cache as cache_utils
+
+logger = logging.getLogger(__name__)
+
+
+# a minimal english stopword list (the words ignored by postgres' `plainto_tsquery`
+# that are likely to appear in protein-name queries)
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from',
+    'in', 'into', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+}
+
+# the tables and views from which the index is built
+# (the index is versioned by the data in these tables and views only)
+SEARCH_INDEX_TABLES = ['hgnc_metadata', *cache_utils.MATERIALIZED_VIEWS]
+
+# the BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    '''
+    Split a protein name (or a full-text query) into lowercase alphanumeric tokens,
+    dropping stopwords and crudely stemming plurals (e.g., 'membranes' to 'membrane')
+    '''
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class SearchIndex:
+    '''
+    An in-memory index of the searchable_hgnc_metadata and gene_name_alias materialized views,
+    used in place of the SQL queries in FullTextSearch and by the autocomplete endpoint
+
+    records : the rows of searchable_hgnc_metadata, one row per ensg_id
+        (deduplicated in the same way as the results of FullTextSearch)
+    names, name_rows, name_kinds : the upper-cased current, previous, and alias gene names
+        in sorted order, the index of the record of each name, and the kind of each name
+        (a prefix search is then a pair of binary searches)
+    terms, term_indptr, posting_rows, posting_counts : an inverted index of protein-name tokens,
+        in CSR form: the records containing the term with index i are
+        `posting_rows[term_indptr[i]:term_indptr[i + 1]]` (in sorted order),
+        and `posting_counts` are the number of times the term appears in each record
+    version : the version of the data from which the index was built
+        (see cache.get_data_version and SEARCH_INDEX_TABLES)
+    '''
+    def __init__(self, records, names, protein_names, version=None):
+        self.records = records.reset_index(drop=True)
+        self.version = version
+
+        record_index = pd.Series(np.arange(len(self.records)), index=self.records.ensg_id)
+
+        # the prefix index of gene names
+        names = names.loc[names.ensg_id.isin(record_index.index)]
+        names = names.sort_values(['name', 'ensg_id'])
+        self.names = names.name.tolist()
+        self.name_rows = record_index.loc[names.ensg_id].values
+        self.name_kinds = names.kind.values
+
+        # exact approved gene names and exact legacy (previous or alias) gene names
+        self.approved_gene_names = set(self.records.gene_name.str.upper())
+        legacy_names = names.loc[names.kind != 'symbol'].drop_duplicates('name')
+        self.legacy_gene_names = dict(zip(
+            legacy_names.name, self.records.gene_name.values[record_index.loc[legacy_names.ensg_id]]
+        ))
+
+        # the inverted index of protein-name tokens
+        protein_names = protein_names.loc[protein_names.ensg_id.isin(record_index.index)]
+        tokens = pd.DataFrame({
+            'row': record_index.loc[protein_names.ensg_id].values,
+            'term': protein_names.text.map(tokenize).values,
+        })
+        tokens = tokens.explode('term').dropna()
+
+        self.document_lengths = np.bincount(
+            tokens.row.values.astype(int), minlength=len(self.records)
+        )
+        self.mean_document_length = max(self.document_lengths.mean(), 1)
+
+        postings = tokens.groupby(['term', 'row']).size().reset_index(name='count')
+        self.terms, term_inds = np.unique(postings.term.values.astype(str), return_inverse=True)
+        self.term_index = {term: ind for ind, term in enumerate(self.terms.tolist())}
+        self.term_indptr = np.concatenate((
+            [0], np.cumsum(np.bincount(term_inds.ravel(), minlength=len(self.terms)))
+        ))
+        self.posting_rows = postings.row.values.astype(int)
+        self.posting_counts = postings['count'].values
+
+
+    @classmethod
+    def from_database(cls, engine, version=None):
+        '''
+        Build the index from the materialized views (in three queries)
+        '''
+        records = pd.read_sql(
+            '''
+            select ensg_id, gene_name, protein_name, published_cell_line_id,
+                significant_protein_group_id, measured_expression,
+                measured_abundance, imputed_abundance
+            from searchable_hgnc_metadata
+            ''',
+            engine
+        )
+        records = records.groupby('ensg_id').first().reset_index()
+
+        names = pd.read_sql('select ensg_id, name, kind from gene_name_alias', engine)
+        protein_names = pd.read_sql(
+            "select ensg_id, concat_ws(' ', name, prev_name, alias_name) as text from hgnc_metadata",
+            engine
+        )
+        return cls(records, names, protein_names, version=version)
+
+
+    def get_approved_gene_name(self, query):
+        '''
+        Whether the query is an exact approved or legacy gene name,
+        and the approved gene name if it is either (see FullTextSearch.get_approved_gene_name_from_query)
+        '''
+        query = query.upper()
+        if query in self.approved_gene_names:
+            return True, False, query
+        approved_gene_name = self.legacy_gene_names.get(query)
+        return False, approved_gene_name is not None, approved_gene_name
+
+
+    def _prefix_match(self, prefix):
+        '''
+        The slice of the sorted gene names that start with the prefix
+        '''
+        prefix = prefix.upper()
+        start = bisect.bisect_left(self.names, prefix)
+        stop = bisect.bisect_left(self.names, prefix + chr(0x10FFFF), lo=start)
+        return slice(start, stop)
+
+
+    def search_gene_names(self, query):
+        '''
+        The records any of whose gene names start with the query
+        (these have a relevance of 1, as in FullTextSearch.search_gene_names)
+        '''
+        rows = np.unique(self.name_rows[self._prefix_match(query)])
+        results = self.records.iloc[rows].copy()
+        results['relevance'] = 1.0
+        return results
+
+
+    def search_protein_names(self, query):
+        '''
+        The records whose protein names contain all of the tokens in the query,
+        ranked by their BM25 score
+
+        The scores are mapped from [0, inf) to [0, 1) so that, as with `ts_rank_cd`
+        in FullTextSearch.search_protein_names, they are lower than the relevance
+        of the gene-name matches
+        '''
+        terms = set(tokenize(query))
+        term_inds = [self.term_index.get(term) for term in terms]
+        if not terms or None in term_inds:
+            return self.records.iloc[[]].assign(relevance=[])
+
+        postings = [
+            (
+                self.posting_rows[self.term_indptr[ind]:self.term_indptr[ind + 1]],
+                self.posting_counts[self.term_indptr[ind]:self.term_indptr[ind + 1]],
+            )
+            for ind in term_inds
+        ]
+
+        rows = postings[0][0]
+        for term_rows, _ in postings[1:]:
+            rows = np.intersect1d(rows, term_rows, assume_unique=True)
+
+        num_records = len(self.records)
+        length_norms = BM25_K1 * (
+            1 - BM25_B + BM25_B * self.document_lengths[rows] / self.mean_document_length
+        )
+        scores = np.zeros(len(rows))
+        for term_rows, term_counts in postings:
+            counts = term_counts[np.searchsorted(term_rows, rows)]
+            idf = np.log(1 + (num_records - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            scores += idf * counts * (BM25_K1 + 1) / (counts + length_norms)
+
+        results = self.records.iloc[rows].copy()
+        results['relevance'] = scores / (1 + scores)
+        return results
+
+
+    def autocomplete(self, prefix, limit=10):
+        '''
+        The gene names that start with the prefix, one per record
+
+        These are ranked first by whether the name matches the prefix exactly,
+        then by whether it is the approved gene name, then by whether the record is
+        an opencell target or interactor, and finally by the length of the name
+        '''
+        match = self._prefix_match(prefix)
+        names = np.array(self.names[match], dtype=object)
+        rows = self.name_rows[match]
+        if not len(rows):
+            return []
+
+        records = self.records.iloc[rows]
+        order = np.lexsort((
+            names,
+            [len(name) for name in names],
+            records.significant_protein_group_id.isna().values,
+            records.published_cell_line_id.isna().values,
+            self.name_kinds[match] != 'symbol',
+            names != prefix.upper(),
+        ))
+
+        # keep only the best-ranked name of each record
+        _, first_inds = np.unique(rows[order], return_index=True)
+        order = order[np.sort(first_inds)][:limit]
+
+        return [
+            {
+                'ensg_id': record.ensg_id,
+                'gene_name': record.gene_name,
+                'protein_name': record.protein_name,
+                'published_cell_line_id': (
+                    None if pd.isna(record.published_cell_line_id)
+                    else int(record.published_cell_line_id)
+                ),
+                'matched_name': name,
+            }
+            for name, record in zip(
+                names[order], records.iloc[order].itertuples(index=False)
+            )
+        ]
+
+
+def get_search_index():
+    '''
+    The search index for the current app, which is built on first use
+    and rebuilt whenever the hgnc_metadata table changes or the materialized views are refreshed
+    '''
+    app = flask.current_app
+    version = cache_utils.get_data_version(SEARCH_INDEX_TABLES)
+
+    index = getattr(app, 'search_index', None)
+    if index is None or index.version != version:
+        logger.info('Building the search index for data version %s' % version)
+        index = SearchIndex.from_database(app.Session.get_bind(), version=version)
+        app.search_index = index
+    return index
@@ -44,6 +44,17 @@ class Config:
     # hack to hide non-public data and endpoints (used in the flask app)
     HIDE_PRIVATE_DATA: bool = False
 
+    # optional path to a payload snapshot from which to serve the read-only endpoints
+    # (see opencell.api.snapshot)
+    PAYLOAD_SNAPSHOT_FILEPATH: str = None
+
+    # optional path to a precomputed interaction graph (see opencell.api.interaction_graph)
+    INTERACTION_GRAPH_FILEPATH: str = None
+
+    # whether to search using the in-memory search index (see opencell.api.search_index)
+    # instead of querying the materialized views directly
+    USE_SEARCH_INDEX: bool = True
+
     def __post_init__(self):
 
         # subdirectories of the microscopy data root directory
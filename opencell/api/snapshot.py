@@ -0,0 +1,297 @@
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import urllib
+
+import flask
+
+from opencell.api import settings, utils
+from opencell.database import models
+
+logger = logging.getLogger(__name__)
+
+
+# the clustering analysis type and subcluster types requested by the frontend
+# (see `clusteringAnalysisType` in client/src/settings/settings.js)
+CLUSTERING_ANALYSIS_TYPE = (
+    'primary:mcl_i3.0_haircut:keepcore_subcluster:mcl_hybrid_stoichs_7.0_1113'
+)
+SUBCLUSTER_TYPES = ['core-complexes', 'subclusters']
+
+
+def snapshot_key(path, args):
+    '''
+    The key of a request in the snapshot
+    (this is a canonical form of the path and query string that is also used for the cache keys)
+    '''
+    return path + '?' + urllib.parse.urlencode([
+        (k, v) for k in sorted(args) for v in sorted(args.getlist(k))
+    ])
+
+
+class PayloadSnapshot:
+    '''
+    A versioned, content-addressed store of the payloads of the read-only API endpoints
+
+    The snapshot is a single SQLite file with three tables:
+    `blobs` maps the sha256 digest of each distinct payload to its gzip-compressed bytes,
+    `routes` maps request keys (see snapshot_key) to payload digests,
+    and `info` records the snapshot version and when the snapshot was rendered.
+
+    The version is a digest over the sorted (key, digest) pairs,
+    so it changes if and only if the content of the snapshot changes.
+    '''
+    def __init__(self, filepath, readonly=True):
+        self.filepath = filepath
+        self.readonly = readonly
+        self._local = threading.local()
+
+        if not readonly:
+            with self.connection as conn:
+                conn.executescript(
+                    '''
+                    create table if not exists blobs (digest text primary key, data blob);
+                    create table if not exists routes (
+                        key text primary key, digest text, mimetype text
+                    );
+                    create table if not exists info (name text primary key, value text);
+                    '''
+                )
+
+    @property
+    def connection(self):
+        '''
+        One connection per thread, since sqlite connections cannot be shared across threads
+        '''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect('file:%s?mode=ro' % self.filepath, uri=True)
+            else:
+                conn = sqlite3.connect(self.filepath)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def version(self):
+        row = self.connection.execute("select value from info where name = 'version'").fetchone()
+        return row[0] if row else None
+
+    def put(self, key, data, mimetype):
+        '''
+        Store the uncompressed payload `data` (bytes) under the request key `key`
+        '''
+        etag, gzipped_data = utils.compress_payload(data)
+        digest = etag.strip('"')
+        with self.connection as conn:
+            conn.execute(
+                'insert or ignore into blobs (digest, data) values (?, ?)', (digest, gzipped_data)
+            )
+            conn.execute(
+                'insert or replace into routes (key, digest, mimetype) values (?, ?, ?)',
+                (key, digest, mimetype)
+            )
+        return digest
+
+    def get(self, key):
+        '''
+        Returns the digest, mimetype, and gzip-compressed payload for a request key,
+        or None if the key is not in the snapshot
+        '''
+        return self.connection.execute(
+            '''
+            select routes.digest, routes.mimetype, blobs.data from routes
+            inner join blobs on blobs.digest = routes.digest
+            where routes.key = ?
+            ''',
+            (key,)
+        ).fetchone()
+
+    def finalize(self):
+        '''
+        Delete orphaned blobs and record the version of the snapshot
+        '''
+        conn = self.connection
+        rows = conn.execute('select key, digest from routes order by key').fetchall()
+        version = hashlib.sha256(
+            '\n'.join('%s %s' % (key, digest) for key, digest in rows).encode()
+        ).hexdigest()
+
+        with conn:
+            conn.execute('delete from blobs where digest not in (select digest from routes)')
+            conn.executemany(
+                'insert or replace into info (name, value) values (?, ?)',
+                [
+                    ('version', version),
+                    ('date_created', datetime.datetime.now().isoformat()),
+                    ('num_routes', str(len(rows))),
+                ]
+            )
+        conn.execute('vacuum')
+        return version
+
+
+def serve_from_snapshot(snapshot):
+    '''
+    A before_request handler that returns the snapshotted payload for GET requests
+    whose key is in the snapshot, and otherwise falls through to the usual resources
+    '''
+    def handler():
+        if flask.request.method != 'GET':
+            return None
+
+        row = snapshot.get(snapshot_key(flask.request.path, flask.request.args))
+        if row is None:
+            return None
+
+        digest, mimetype, data = row
+        return utils.make_compressed_response('"%s"' % digest, mimetype, data)
+
+    return handler
+
+
+def enumerate_urls(app, cell_line_ids):
+    '''
+    The URLs of all of the payloads that the frontend requests for the given cell lines
+    '''
+    Session = app.Session
+    pulldown_ids = [
+        row.id for row in (
+            Session.query(models.MassSpecPulldown.id)
+            .filter(models.MassSpecPulldown.cell_line_id.in_(cell_line_ids))
+            .order_by(models.MassSpecPulldown.id)
+        )
+    ]
+
+    # the ENSG IDs of all protein groups that are significant hits in at least one pulldown
+    ensg_ids = [
+        row.ensg_id for row in (
+            Session.query(models.ProteinGroupEnsemblAssociation.ensg_id)
+            .join(
+                models.MassSpecHit,
+                models.MassSpecHit.protein_group_id
+                == models.ProteinGroupEnsemblAssociation.protein_group_id
+            )
+            .filter(models.MassSpecHit.is_significant_hit)
+            .filter(models.MassSpecHit.pulldown_id.in_(pulldown_ids))
+            .distinct()
+            .order_by(models.ProteinGroupEnsemblAssociation.ensg_id)
+        )
+    ]
+
+    network_query_strings = [
+        urllib.parse.urlencode({
+            'subcluster_type': subcluster_type,
+            'clustering_analysis_type': CLUSTERING_ANALYSIS_TYPE,
+        })
+        for subcluster_type in SUBCLUSTER_TYPES
+    ]
+
+    urls = []
+    for cell_line_id in cell_line_ids:
+        urls.append('/lines/%s?publication_ready=true' % cell_line_id)
+        urls.append('/lines/%s?fields=best-fov' % cell_line_id)
+
+    for pulldown_id in pulldown_ids:
+        urls.append('/pulldowns/%s/hits' % pulldown_id)
+        for query_string in network_query_strings:
+            urls.append('/pulldowns/%s/network?%s' % (pulldown_id, query_string))
+
+    for ensg_id in ensg_ids:
+        urls.append('/interactors/%s' % ensg_id)
+        for query_string in network_query_strings:
+            urls.append('/interactors/%s/network?%s' % (ensg_id, query_string))
+
+    return urls
+
+
+def list_urls(app):
+    '''
+    The URLs of the payloads of all of the read-only endpoints
+
+    The cell lines are those returned by the /lines endpoint
+    (which are only the publication-ready lines if the app hides private data)
+    '''
+    urls = [
+        '/lines',
+        '/lines?publication_ready=true',
+        '/target_names?publication_ready=true',
+        '/abundance',
+    ]
+    response = app.test_client().get(
+        '/lines?publication_ready=true' if app.config['HIDE_PRIVATE_DATA'] else '/lines'
+    )
+    cell_line_ids = [payload['metadata']['cell_line_id'] for payload in response.get_json()]
+
+    with app.app_context():
+        urls.extend(enumerate_urls(app, cell_line_ids))
+    return urls
+
+
+def render_snapshot(app, filepath):
+    '''
+    Render the payloads of all of the read-only endpoints into a new snapshot at `filepath`
+
+    The payloads are rendered by the app itself (via its test client)
+    so that they are identical to the payloads returned by the live endpoints
+    '''
+    if os.path.exists(filepath):
+        raise ValueError('A snapshot already exists at %s' % filepath)
+
+    snapshot = PayloadSnapshot(filepath, readonly=False)
+    client = app.test_client()
+
+    urls = list_urls(app)
+    logger.info('Rendering %s payloads' % len(urls))
+
+    for ind, url in enumerate(urls):
+        response = client.get(url)
+        if response.status_code != 200:
+            logger.warning('Skipping %s (status code %s)' % (url, response.status_code))
+            continue
+
+        path, _, query_string = url.partition('?')
+        args = flask.Request.parameter_storage_class(urllib.parse.parse_qsl(query_string))
+        snapshot.put(snapshot_key(path, args), response.data, response.mimetype)
+        if ind % 1000 == 0:
+            logger.info('Rendered %s of %s payloads' % (ind, len(urls)))
+
+    version = snapshot.finalize()
+    logger.info('Snapshot version %s written to %s' % (version, filepath))
+    return version
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', dest='mode', required=True)
+    parser.add_argument('--credentials', dest='credentials_filepath')
+    parser.add_argument('--dst', dest='dst_filepath', required=True)
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Render a snapshot of the read-only endpoints using the app in the given mode, e.g.:
+    `python -m opencell.api.snapshot --mode aws-prod --dst /path/to/snapshot.sqlite`
+    '''
+    from opencell.api.app import create_app
+
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    config = settings.get_config(args.mode)
+    if args.credentials_filepath:
+        config.DB_CREDENTIALS_FILEPATH = args.credentials_filepath
+
+    # the snapshot must be rendered from the live endpoints, not from another snapshot
+    config.PAYLOAD_SNAPSHOT_FILEPATH = None
+    os.environ.pop('PAYLOAD_SNAPSHOT_FILEPATH', None)
+    render_snapshot(create_app(config), args.dst_filepath)
+
+
+if __name__ == '__main__':
+    main()
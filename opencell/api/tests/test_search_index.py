@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from opencell.api.search_index import SearchIndex, tokenize
+
+
+@pytest.fixture
+def search_index():
+    '''
+    A search index of four records built from plain dataframes
+    (in place of the searchable_hgnc_metadata and gene_name_alias views and the hgnc_metadata table)
+    '''
+    records = pd.DataFrame(
+        [
+            ('ENSG01', 'LMNA', 'lamin A/C', 1, 10),
+            ('ENSG02', 'LMNB1', 'lamin B1', np.nan, 20),
+            ('ENSG03', 'POM121', 'nuclear envelope pore membrane protein', 3, np.nan),
+            ('ENSG04', 'NUP98', 'nucleoporin 98 and 96 precursor', np.nan, np.nan),
+        ],
+        columns=[
+            'ensg_id', 'gene_name', 'protein_name',
+            'published_cell_line_id', 'significant_protein_group_id'
+        ]
+    )
+    records['measured_expression'] = np.nan
+    records['measured_abundance'] = np.nan
+    records['imputed_abundance'] = np.nan
+
+    names = pd.DataFrame(
+        [
+            ('ENSG01', 'LMNA', 'symbol'),
+            ('ENSG01', 'LMN1', 'previous'),
+            ('ENSG02', 'LMNB1', 'symbol'),
+            ('ENSG02', 'LMN', 'alias'),
+            ('ENSG03', 'POM121', 'symbol'),
+            ('ENSG03', 'POM121A', 'previous'),
+            ('ENSG03', 'NUP', 'alias'),
+            ('ENSG04', 'NUP98', 'symbol'),
+            ('ENSG04', 'NUP96', 'alias'),
+        ],
+        columns=['ensg_id', 'name', 'kind']
+    )
+    protein_names = pd.DataFrame(
+        [
+            ('ENSG01', 'lamin A/C'),
+            ('ENSG02', 'lamin B1 lamins'),
+            ('ENSG03', 'nuclear envelope pore membrane protein'),
+            ('ENSG04', 'nucleoporin 98 and 96 precursor nuclear pore complex protein'),
+        ],
+        columns=['ensg_id', 'text']
+    )
+    return SearchIndex(records, names, protein_names, version='test')
+
+
+def test_tokenize():
+    assert tokenize('Nuclear envelope and pore membranes') == ['nuclear', 'envelope', 'pore', 'membrane']
+    assert tokenize('of the') == []
+    assert tokenize(None) == []
+
+
+def test_get_approved_gene_name(search_index):
+    assert search_index.get_approved_gene_name('lmna') == (True, False, 'LMNA')
+    assert search_index.get_approved_gene_name('LMN1') == (False, True, 'LMNA')
+    assert search_index.get_approved_gene_name('POM121A') == (False, True, 'POM121')
+    assert search_index.get_approved_gene_name('FOO') == (False, False, None)
+
+
+def test_search_gene_names(search_index):
+    '''
+    Any approved or legacy gene name starting with the query should match,
+    and each record should appear once
+    '''
+    results = search_index.search_gene_names('lmn')
+    assert results.ensg_id.tolist() == ['ENSG01', 'ENSG02']
+    assert (results.relevance == 1).all()
+
+    # 'NUP' matches the alias of POM121 and the approved name and the alias of NUP98
+    results = search_index.search_gene_names('nup')
+    assert sorted(results.ensg_id) == ['ENSG03', 'ENSG04']
+
+    assert search_index.search_gene_names('foo').empty
+
+
+def test_search_protein_names(search_index):
+    '''
+    Records should match only if their protein names contain all of the query tokens,
+    and the relevance should be lower than the relevance of the gene-name matches
+    '''
+    results = search_index.search_protein_names('nuclear pore')
+    assert sorted(results.ensg_id) == ['ENSG03', 'ENSG04']
+    assert ((results.relevance > 0) & (results.relevance < 1)).all()
+
+    # AND semantics: only one record contains both tokens
+    results = search_index.search_protein_names('pore membrane')
+    assert results.ensg_id.tolist() == ['ENSG03']
+
+    # stemmed plurals should match
+    results = search_index.search_protein_names('lamins')
+    assert sorted(results.ensg_id) == ['ENSG01', 'ENSG02']
+
+    # one unknown token means no records contain all of the tokens
+    assert search_index.search_protein_names('nuclear foo').empty
+
+
+def test_search_protein_names_empty_queries(search_index):
+    for query in ['', '   ', 'the of and', '/']:
+        results = search_index.search_protein_names(query)
+        assert results.empty
+        assert 'relevance' in results.columns
+
+
+def test_autocomplete(search_index):
+    '''
+    Exact matches should be ranked first, then approved names, then published targets,
+    and each record should appear once (with its best-ranked name)
+    '''
+    # the alias 'LMN' matches exactly, so it ranks first (in place of 'LMNB1' for its record);
+    # LMNA is then ranked by its approved name rather than by its previous name 'LMN1'
+    results = search_index.autocomplete('lmn')
+    assert [(r['ensg_id'], r['matched_name']) for r in results] == [
+        ('ENSG02', 'LMN'), ('ENSG01', 'LMNA')
+    ]
+
+    # without an exact match, the approved names rank before the legacy names
+    results = search_index.autocomplete('lmnb')
+    assert [(r['ensg_id'], r['matched_name']) for r in results] == [('ENSG02', 'LMNB1')]
+
+    results = search_index.autocomplete('pom12')
+    assert [(r['ensg_id'], r['matched_name']) for r in results] == [('ENSG03', 'POM121')]
+
+    # among approved names, the published targets rank first
+    results = search_index.autocomplete('l')
+    assert [(r['ensg_id'], r['matched_name']) for r in results] == [
+        ('ENSG01', 'LMNA'), ('ENSG02', 'LMNB1')
+    ]
+    assert results[0]['published_cell_line_id'] == 1
+
+    # the approved names rank before the aliases, even if the alias is shorter
+    # or belongs to a published target
+    results = search_index.autocomplete('nu')
+    assert [(r['ensg_id'], r['matched_name']) for r in results] == [
+        ('ENSG04', 'NUP98'), ('ENSG03', 'NUP')
+    ]
+    assert results[0]['published_cell_line_id'] is None
+
+    results = search_index.autocomplete('n')
+    assert [r['ensg_id'] for r in results] == ['ENSG04', 'ENSG03']
+
+    results = search_index.autocomplete('', limit=3)
+    assert len(results) == 3
+    assert len(set(r['ensg_id'] for r in results)) == 3
+
+    assert search_index.autocomplete('foo') == []
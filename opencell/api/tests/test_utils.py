@@ -0,0 +1,86 @@
+import datetime
+import flask
+import gzip
+import json
+import numpy as np
+import pandas as pd
+
+from opencell.api import utils as api_utils
+
+
+def test_json_encoder_dates_with_and_without_nans():
+    '''
+    Datetimes should be serialized in the same format whether or not the payload
+    contains NaNs (which require the payload to be made JSON-safe and encoded again)
+    '''
+    date_created = datetime.datetime(2021, 1, 2, 3, 4, 5)
+    encoder = api_utils.JSONEncoder()
+
+    payload = {'date_created': date_created, 'values': [np.float64(1.5), np.int64(2)]}
+    result = json.loads(encoder.encode(payload))
+    assert result == {'date_created': 'Sat, 02 Jan 2021 03:04:05 GMT', 'values': [1.5, 2]}
+
+    payload['values'].append(np.nan)
+    payload['nested'] = {'inf': float('inf'), 'date': pd.Timestamp(date_created)}
+    result = json.loads(encoder.encode(payload))
+    assert result == {
+        'date_created': 'Sat, 02 Jan 2021 03:04:05 GMT',
+        'values': [1.5, 2, None],
+        'nested': {'inf': None, 'date': 'Sat, 02 Jan 2021 03:04:05 GMT'},
+    }
+
+
+def test_dataframe_to_records():
+    df = pd.DataFrame({'a': [1.0, np.nan], 'b': ['x', None]})
+    records = api_utils.dataframe_to_records(df)
+    assert records == [{'a': 1.0, 'b': 'x'}, {'a': None, 'b': None}]
+    json.dumps(records, allow_nan=False)
+
+
+def test_make_compressed_response():
+    '''
+    The compressed and uncompressed payloads should have different strong ETags,
+    and each ETag should result in a 304 only for requests for the same representation
+    '''
+    data = b'{"some": "payload"}'
+    etag, gzipped_data = api_utils.compress_payload(data)
+    digest = etag.strip('"')
+    app = flask.Flask(__name__)
+
+    def get_response(headers):
+        with app.test_request_context(headers=headers):
+            return api_utils.make_compressed_response(etag, 'application/json', gzipped_data)
+
+    response = get_response({'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == '"%s-gzip"' % digest
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.get_data()) == data
+
+    response = get_response({})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == data
+
+    # the ETag of the same representation
+    response = get_response({'Accept-Encoding': 'gzip', 'If-None-Match': '"%s-gzip"' % digest})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"%s-gzip"' % digest
+    assert response.get_data() == b''
+
+    response = get_response({'If-None-Match': '"other", %s' % etag})
+    assert response.status_code == 304
+
+    # the ETag of the other representation
+    response = get_response({'If-None-Match': '"%s-gzip"' % digest})
+    assert response.status_code == 200
+    assert response.get_data() == data
+
+    response = get_response({'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 200
+
+    # the wildcard matches any representation
+    for headers in [{'If-None-Match': '*'}, {'Accept-Encoding': 'gzip', 'If-None-Match': '*'}]:
+        assert get_response(headers).status_code == 304
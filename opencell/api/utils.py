@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import numpy as np
+
+import flask
+
+from opencell.database import utils as db_utils
+
+
+class JSONEncoder(flask.json.JSONEncoder):
+    '''
+    A JSON encoder that serializes numpy scalars and arrays natively
+    and coerces NaNs and Infs to null
+
+    Payloads without NaNs or Infs are encoded in one pass (by the C encoder);
+    the payloads with NaNs or Infs fail to encode, and are then made JSON-safe
+    by db_utils.to_jsonable and encoded again (the payloads in which NaNs are common
+    are made JSON-safe by the resources themselves, to avoid encoding them twice).
+    In both cases, datetimes are serialized by `default` (as RFC 1123 dates)
+    '''
+    def __init__(self, *args, **kwargs):
+        kwargs['allow_nan'] = False
+        super().__init__(*args, **kwargs)
+
+    def default(self, o):
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return super().default(o)
+
+    def encode(self, o):
+        try:
+            return super().encode(o)
+        except ValueError:
+            return super().encode(db_utils.to_jsonable(o, coerce_datetimes=False))
+
+
+def dataframe_to_records(df):
+    '''
+    The rows of a dataframe as a list of dicts, with NaNs and Infs coerced to None
+    (so that the payload is encoded in one pass by JSONEncoder)
+    '''
+    return db_utils.to_jsonable(df.to_dict(orient='records'), coerce_datetimes=False)
+
+
+def compress_payload(data):
+    '''
+    Compute the strong ETag of a payload (bytes) and compress it
+
+    Returns a tuple of the ETag and the gzip-compressed payload
+    (the mtime is fixed so that the compressed bytes depend only on the payload)
+    '''
+    etag = '"%s"' % hashlib.sha256(data).hexdigest()
+    return etag, gzip.compress(data, mtime=0)
+
+
+def make_compressed_response(etag, mimetype, gzipped_data):
+    '''
+    Construct the response to the current request for a precompressed payload
+
+    Returns a 304 if the client already has the payload (as identified by its ETag);
+    otherwise, returns the compressed payload if the client accepts gzip,
+    and the decompressed payload if it does not
+
+    etag : the strong ETag of the uncompressed payload (see compress_payload);
+        the compressed payload is a different representation, so its ETag has a '-gzip' suffix
+    '''
+    digest = etag.strip('"')
+    accepts_gzip = 'gzip' in flask.request.headers.get('Accept-Encoding', '')
+    if accepts_gzip:
+        digest = '%s-gzip' % digest
+
+    # `contains` also matches `If-None-Match: *`
+    if flask.request.if_none_match.contains(digest):
+        response = flask.Response(status=304)
+    elif accepts_gzip:
+        response = flask.Response(gzipped_data, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = flask.Response(gzip.decompress(gzipped_data), mimetype=mimetype)
+
+    response.set_etag(digest)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
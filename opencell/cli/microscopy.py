@@ -1,16 +1,27 @@
 import argparse
+import collections
+import concurrent.futures
+import contextlib
 import dask
 import dask.diagnostics
+import dask.multiprocessing
+import functools
+import hashlib
+import json
 import logging
 import os
 import pathlib
 import sqlalchemy as sa
+import threading
+import time
 
 from opencell.api import settings
 from opencell.cli import utils as cli_utils
 from opencell.database import models, fov_operations, file_utils, utils as db_utils
 from opencell.database.fov_operations import MicroscopyFOVOperations
-from opencell.imaging.processors import FOVProcessor
+from opencell.imaging.processors import (
+    FOVProcessor, RAW_TIFF_PRODUCTS, RAW_TIFF_PRODUCT_RESULT_KINDS
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +35,14 @@ except ModuleNotFoundError:
 
 class FOVTaskDefinition:
 
-    def __init__(self, processor_method, populator_method):
+    def __init__(self, processor_method, populator_method, is_composite=False):
         '''
         An FOV task is a combination of a processor method of the FOVProcessor class
         and a database-population method of the MicroscopyFOVOperations class
+
+        is_composite : whether the processor method returns the results of other tasks
+            as a dict keyed by task name (in which case each result is inserted
+            using the populator method of its own task)
         '''
         if not hasattr(FOVProcessor, processor_method):
             raise ValueError("'%s' is not a valid processor method")
@@ -37,15 +52,48 @@ class FOVTaskDefinition:
 
         self.processor_method = processor_method
         self.populator_method = populator_method
+        self.is_composite = is_composite
 
     def get_processor_method(self, fov_processor):
         return getattr(fov_processor, self.processor_method)
 
     def get_populator_method(self, fov_operations):
+        if self.is_composite:
+            return functools.partial(self.populate_composite_result, fov_operations)
         if self.populator_method is None:
             return None
         return getattr(fov_operations, self.populator_method)
 
+    @staticmethod
+    def populate_composite_result(fov_operations, session, result):
+        '''
+        Insert the result of each task in a composite result using the task's own populator method
+
+        The tasks that failed (whose result is only an error message;
+        see FOVProcessor.process_raw_tiff_products) are not inserted, and the failure
+        of the populator method of one task does not prevent the other results from being inserted
+
+        Returns a dict of the error of each task (or None if the task succeeded), keyed by task name
+        '''
+        writer = fov_operations.writer
+        errors = {}
+        for task_name, task_result in result.items():
+            if isinstance(task_result, dict) and list(task_result.keys()) == ['error']:
+                errors[task_name] = task_result['error']
+                continue
+
+            num_buffered_rows = len(writer) if writer is not None else 0
+            populator_method = get_task_definition(task_name).get_populator_method(fov_operations)
+            try:
+                if populator_method is not None:
+                    populator_method(session, task_result)
+                errors[task_name] = None
+            except Exception as exception:
+                errors[task_name] = str(exception)
+                if writer is not None:
+                    writer.discard(num_buffered_rows)
+        return errors
+
 
 TASK_DEFINITIONS = [
     FOVTaskDefinition(
@@ -76,7 +124,10 @@ TASK_DEFINITIONS = [
     ),
     FOVTaskDefinition(
         processor_method='generate_nucleus_segmentation', populator_method=None
-    )
+    ),
+    FOVTaskDefinition(
+        processor_method='process_raw_tiff_products', populator_method=None, is_composite=True
+    ),
 ]
 
 
@@ -97,6 +148,17 @@ def parse_args():
     # the pml_id whose FOVs are to be inserted or processed
     parser.add_argument('--pml-id', dest='pml_id')
 
+    # the number of workers and the dask scheduler ('threads' or 'processes') used to run the tasks
+    parser.add_argument('--workers', dest='num_workers', type=int, required=False)
+    parser.add_argument(
+        '--executor', dest='executor', choices=['threads', 'processes'], default='threads'
+    )
+
+    # the tasks to run from a single read of each raw TIFF (only used with --process-raw-tiff-products)
+    parser.add_argument(
+        '--products', dest='products', nargs='+', choices=RAW_TIFF_PRODUCTS, required=False
+    )
+
     # FOV thumbnail scale and quality
     parser.add_argument('--thumbnail-scale', dest='thumbnail_scale', required=False)
     parser.add_argument('--thumbnail-quality', dest='thumbnail_quality', required=False)
@@ -115,6 +177,10 @@ def parse_args():
 
         # whether to process all FOVs or only unprocessed FOVs
         'process_all',
+
+        # whether to skip FOVs on which a task has already succeeded with the same inputs
+        # (according to the task-run ledger)
+        'resume',
     ]
 
     # all task names are also action args
@@ -133,76 +199,381 @@ class FOVTaskManager:
 
     def __init__(self, fov, config, task_name):
 
-        task_names = [task_def.processor_method for task_def in TASK_DEFINITIONS]
-        if task_name not in task_names:
-            raise ValueError("Invalid task name '%s'" % task_name)
-
-        self.task_definition = TASK_DEFINITIONS[task_names.index(task_name)]
+        self.task_definition = get_task_definition(task_name)
 
-        # instantiate a processor and operations class for each FOV
+        # instantiate a processor for the FOV
         self.fov_processor = FOVProcessor.from_database(fov)
-        self.fov_operations = MicroscopyFOVOperations(fov.id, errors='raise')
-
         self.fov_processor.set_paths(
             plate_microscopy_dir=config.PLATE_MICROSCOPY_DIR,
             raw_pipeline_microscopy_dir=config.RAW_PIPELINE_MICROSCOPY_DIR,
             dst_root_dir=config.OPENCELL_MICROSCOPY_DIR
         )
 
-    def do_task(self, Session, **task_kwargs):
+    def run_processor(self, **task_kwargs):
         '''
+        Run the processor method of the task and return its result
         '''
-        error_occurred = False
         processor_method = self.task_definition.get_processor_method(self.fov_processor)
-        populator_method = self.task_definition.get_populator_method(self.fov_operations)
+        return processor_method(**task_kwargs)
+
+    def input_fingerprint(self, **task_kwargs):
+        '''
+        A digest of the inputs to the task: the FOV metadata used by the processor,
+        the size and modification time of the raw TIFF, the manually annotated ROI (if any),
+        and the task kwargs (only scalars and lists, which excludes, e.g., the FOV scorer)
+        '''
+        return self._input_fingerprint(self.task_definition.processor_method, task_kwargs)
+
+    def task_fingerprints(self, task_names):
+        '''
+        The input fingerprints of the tasks run by a composite task, keyed by task name
+        (these are the fingerprints that the tasks would have if they were run by themselves)
+        '''
+        return {task_name: self._input_fingerprint(task_name, {}) for task_name in task_names}
+
+    def _input_fingerprint(self, task_name, task_kwargs):
+        processor = self.fov_processor
+        src_filepath = processor.src_filepath()
+        src_stat = os.stat(src_filepath) if os.path.isfile(src_filepath) else None
+
+        annotation = processor.fov.annotation
+        inputs = {
+            'task_name': task_name,
+            'processor': {
+                key: value for key, value in vars(processor).items()
+                if key not in ('fov', 'raw_tiff')
+            },
+            'src_file': (src_stat.st_size, src_stat.st_mtime_ns) if src_stat else None,
+            'annotated_roi': (
+                (annotation.roi_position_top, annotation.roi_position_left) if annotation else None
+            ),
+            'task_kwargs': {
+                key: value for key, value in task_kwargs.items()
+                if value is None or isinstance(value, (str, int, float, bool, list))
+            },
+        }
+        inputs = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+def get_task_definition(task_name):
+    task_names = [task_def.processor_method for task_def in TASK_DEFINITIONS]
+    if task_name not in task_names:
+        raise ValueError("Invalid task name '%s'" % task_name)
+    return TASK_DEFINITIONS[task_names.index(task_name)]
+
+
+# the scoped session registries of the worker processes, keyed by process id and database URL
+# (so that each worker process opens its own engine, and each worker thread its own session)
+_worker_sessions = {}
+_worker_sessions_lock = threading.Lock()
+
+
+def get_worker_session(url):
+    '''
+    The session of the current worker process and thread
+    '''
+    key = (os.getpid(), url)
+    with _worker_sessions_lock:
+        if key not in _worker_sessions:
+            _worker_sessions[key] = db_utils.SQLAlchemyInterface(url).make_scoped_session()
+    return _worker_sessions[key]()
+
+
+# the task kwargs of the current worker process (see set_worker_task_kwargs)
+_worker_task_kwargs = {}
+
+
+def set_worker_task_kwargs(task_kwargs):
+    '''
+    Set the task kwargs of the current worker process
+
+    This is called once by each worker process when it starts (see do_fov_tasks),
+    so that large kwargs (e.g., the FOV scorer) are sent to each worker process once,
+    rather than with every task
+    '''
+    _worker_task_kwargs.clear()
+    _worker_task_kwargs.update(task_kwargs)
+
+
+# the outcome of running a task on one FOV (see run_fov_task)
+# (task_fingerprints are the input fingerprints of the tasks run by a composite task)
+FOVTaskOutcome = collections.namedtuple(
+    'FOVTaskOutcome',
+    ['fov_id', 'result', 'error', 'duration', 'input_fingerprint', 'skipped', 'task_fingerprints'],
+    defaults=(None,)
+)
+
+
+def run_fov_task(url, config, task_name, fov_id, completed_fingerprint=None, **task_kwargs):
+    '''
+    Run the processor method of a task on a single FOV
+
+    This is called by the dask workers, which are passed only the FOV id
+    (and which load the FOV using their own session);
+    the result is inserted into the database by the parent process (see populate_results)
+
+    completed_fingerprint : the input fingerprint of the last successful run of the task
+        on this FOV; if the inputs have not changed since then, the task is skipped
+    task_kwargs : the kwargs of the processor method
+        (in addition to those set by set_worker_task_kwargs, if any)
+
+    Returns an FOVTaskOutcome
+    '''
+    task_kwargs = {**_worker_task_kwargs, **task_kwargs}
+    session = get_worker_session(url)
+    result, error, duration, input_fingerprint, task_fingerprints = None, None, None, None, None
+    try:
+        fov = (
+            session.query(models.MicroscopyFOV)
+            .filter(models.MicroscopyFOV.id == fov_id)
+            .one()
+        )
+        task_manager = FOVTaskManager(fov, config=config, task_name=task_name)
+        input_fingerprint = task_manager.input_fingerprint(**task_kwargs)
+        if completed_fingerprint is not None and input_fingerprint == completed_fingerprint:
+            return FOVTaskOutcome(fov_id, None, None, None, input_fingerprint, skipped=True)
+
+        # the tasks run by a composite task are the raw TIFF products
+        # (see FOVProcessor.process_raw_tiff_products)
+        if task_manager.task_definition.is_composite:
+            task_fingerprints = task_manager.task_fingerprints(
+                task_kwargs.get('products') or RAW_TIFF_PRODUCTS
+            )
+
+        start = time.perf_counter()
         try:
-            result = processor_method(**task_kwargs)
-            if populator_method is not None:
-                populator_method(Session(), result)
-        except Exception as error:
-            error_occurred = True
+            result = task_manager.run_processor(**task_kwargs)
+        finally:
+            duration = time.perf_counter() - start
+    except Exception as exception:
+        error = str(exception)
+    finally:
+        session.close()
+    return FOVTaskOutcome(
+        fov_id, result, error, duration, input_fingerprint, skipped=False,
+        task_fingerprints=task_fingerprints
+    )
+
+
+def populate_results(Session, task_name, outcomes, writer=None):
+    '''
+    Insert the results of a task into the database using the task's populator method,
+    and record each run of the task in the task-run ledger
+
+    outcomes : a list of the FOVTaskOutcomes returned by run_fov_task
+    writer : an optional fov_operations.BufferedWriter; if provided, the results are written
+        in bulk every `writer.max_rows` rows (and the remaining rows are written before returning);
+        if a bulk write fails, the results in it are inserted again one FOV at a time
+    Returns the number of FOVs for which an error occurred
+    '''
+    task_definition = get_task_definition(task_name)
+
+    # the outcomes whose rows are in the writer, and whether an error occurred for each one
+    buffered_outcomes = []
+
+    def flush():
+        try:
+            writer.flush()
+            num_errors = sum(has_error for _, has_error in buffered_outcomes)
+        except Exception as exception:
             logger.error(
-                "Error running task '%s' on fov_id %s: %s"
-                % (self.task_definition.processor_method, self.fov_processor.fov_id, str(error))
+                'Error writing the results of %s FOVs in bulk; inserting them one at a time: %s'
+                % (len(buffered_outcomes), exception)
+            )
+            num_errors = populate_results(
+                Session, task_name, [outcome for outcome, _ in buffered_outcomes]
             )
-        return error_occurred
+        buffered_outcomes.clear()
+        return num_errors
+
+    num_errors = 0
+    for outcome in outcomes:
+        if outcome.skipped:
+            continue
+
+        error = outcome.error
+        fov_operations = MicroscopyFOVOperations(outcome.fov_id, errors='raise', writer=writer)
+        num_buffered_rows = len(writer) if writer is not None else 0
+        task_errors = None
+        if error is None:
+            populator_method = task_definition.get_populator_method(fov_operations)
+            try:
+                if populator_method is not None:
+                    task_errors = populator_method(Session(), outcome.result)
+
+                # the results of the tasks of a composite task that succeeded are kept,
+                # but the composite task is recorded as failed if any of its tasks failed
+                if task_definition.is_composite:
+                    error = '; '.join(
+                        '%s: %s' % (name, task_error)
+                        for name, task_error in task_errors.items() if task_error is not None
+                    ) or None
+            except Exception as exception:
+                error = str(exception)
+                if writer is not None:
+                    writer.discard(num_buffered_rows)
+
+        fov_operations.insert_task_run(
+            Session(),
+            task_name,
+            error=error,
+            duration=outcome.duration,
+            input_fingerprint=outcome.input_fingerprint
+        )
 
+        # also record each of the tasks run by a composite task, with its own input fingerprint,
+        # so that resuming one of these tasks skips the FOVs on which the composite task ran it
+        if task_definition.is_composite and task_errors is not None:
+            task_fingerprints = outcome.task_fingerprints or {}
+            for name, task_error in task_errors.items():
+                fov_operations.insert_task_run(
+                    Session(),
+                    name,
+                    error=task_error,
+                    duration=None,
+                    input_fingerprint=task_fingerprints.get(name)
+                )
+
+        if error is not None:
+            logger.error(
+                "Error running task '%s' on fov_id %s: %s" % (task_name, outcome.fov_id, error)
+            )
 
-def do_fov_tasks(Session, config, task_name, fovs=None, **task_kwargs):
+        if writer is None:
+            num_errors += error is not None
+            continue
+
+        buffered_outcomes.append((outcome, error is not None))
+        if len(writer) >= writer.max_rows:
+            num_errors += flush()
+
+    if buffered_outcomes:
+        num_errors += flush()
+    return num_errors
+
+
+def do_fov_tasks(
+    Session,
+    config,
+    task_name,
+    fovs=None,
+    num_workers=None,
+    executor='threads',
+    batch_size=1000,
+    write_batch_size=1000,
+    resume=False,
+    **task_kwargs
+):
     '''
     Run a 'task' (a method of the FOVProcessor class) on all, or a subset of, the raw FOVs
 
+    The processor methods are run by dask workers (in threads or in processes),
+    to which only the FOV ids are sent; the workers load the FOVs using their own sessions.
+    The results are inserted by this (the parent) process, one batch of FOVs at a time.
+
     Parameters
     ----------
     Session :
     config : an API config (defined in opencell.api.settings)
     task_name : the name of the task (must be present in TASK_DEFINITIONS)
     task_kwargs : the kwargs required for the task (if any)
-    fovs : optional list of FOVs to be processed (if None, all FOVs are processed)
+    fovs : optional iterable of FOVs to be processed (if None, all FOVs are processed);
+        this can be a query of FOVs (e.g., from fov_operations.get_unprocessed_fovs),
+        in which case only the ids of the FOVs are loaded
+    num_workers : the number of dask workers (if None, the number of CPUs)
+    executor : the dask scheduler to use, either 'threads' or 'processes'
+        (the CPU-bound tasks scale much better with processes)
+    batch_size : the number of FOVs to process before inserting their results
+    write_batch_size : the number of rows to buffer before writing them in bulk
+        (see fov_operations.BufferedWriter)
+    resume : whether to skip the FOVs on which the task has already succeeded
+        with the same inputs (according to the task-run ledger)
     '''
+    get_task_definition(task_name)
+    if executor not in ['threads', 'processes']:
+        raise ValueError("Invalid executor '%s'" % executor)
 
     # if a list of FOVs was not provided, process all FOVs
     if fovs is None:
-        fovs = Session.query(models.MicroscopyFOV).all()
+        fov_ids = [
+            row.id for row in
+            Session.query(models.MicroscopyFOV.id).order_by(models.MicroscopyFOV.id)
+        ]
+    elif isinstance(fovs, sa.orm.Query):
+        # only load the ids (which may be repeated if the query has joins)
+        fov_ids = list(dict.fromkeys(
+            row.id for row in fovs.with_entities(models.MicroscopyFOV.id)
+        ))
+    else:
+        fov_ids = [fov.id for fov in fovs]
 
-    if not len(fovs):
+    if not len(fov_ids):
         logger.warning('There are no FOVs to be processed')
         return
 
-    tasks = []
-    for fov in fovs:
-        task_manager = FOVTaskManager(fov, config=config, task_name=task_name)
-        task = dask.delayed(task_manager.do_task)(Session, **task_kwargs)
-        tasks.append(task)
+    url = Session.get_bind().url.render_as_string(hide_password=False)
+
+    completed_fingerprints = {}
+    if resume:
+        completed_fingerprints = fov_operations.get_completed_fov_tasks(Session, task_name)
+
+    # send the task kwargs to each worker once, rather than with every task:
+    # the worker processes receive them when they start (see set_worker_task_kwargs),
+    # and the worker threads share a single delayed copy of each kwarg
+    # (the same pool of worker processes is used for all of the batches)
+    pool = contextlib.nullcontext()
+    compute_kwargs = {}
+    if executor == 'processes':
+        pool = concurrent.futures.ProcessPoolExecutor(
+            num_workers or os.cpu_count(),
+            mp_context=dask.multiprocessing.get_context(),
+            initializer=functools.partial(set_worker_task_kwargs, task_kwargs)
+        )
+        compute_kwargs['pool'] = pool
+        task_kwargs = {}
+    else:
+        task_kwargs = {key: dask.delayed(value) for key, value in task_kwargs.items()}
 
-    logger.info("Performing task '%s' on %s FOVs" % (task_name, len(fovs)))
-    with dask.diagnostics.ProgressBar():
-        error_flags = dask.compute(*tasks)
+    logger.info(
+        "Performing task '%s' on %s FOVs using %s %s"
+        % (task_name, len(fov_ids), num_workers or os.cpu_count(), executor)
+    )
+    num_errors, num_skipped = 0, 0
+    with pool:
+        for ind in range(0, len(fov_ids), batch_size):
+            tasks = [
+                dask.delayed(run_fov_task)(
+                    url,
+                    config,
+                    task_name,
+                    fov_id,
+                    completed_fingerprint=completed_fingerprints.get(fov_id),
+                    **task_kwargs
+                )
+                for fov_id in fov_ids[ind:ind + batch_size]
+            ]
+            with dask.diagnostics.ProgressBar():
+                outcomes = dask.compute(
+                    *tasks, scheduler=executor, num_workers=num_workers, **compute_kwargs
+                )
+
+            num_skipped += sum(outcome.skipped for outcome in outcomes)
+            writer = fov_operations.BufferedWriter(Session(), max_rows=write_batch_size)
+            num_errors += populate_results(Session, task_name, outcomes, writer=writer)
+            logger.info(
+                "Completed task '%s' on %s of %s FOVs"
+                % (task_name, min(ind + batch_size, len(fov_ids)), len(fov_ids))
+            )
 
-    if sum(error_flags):
+    if num_skipped:
+        logger.info(
+            "Skipped %s FOVs on which task '%s' had already succeeded" % (num_skipped, task_name)
+        )
+    if num_errors:
         logger.info(
             "Errors occurred for %s/%s FOVs while running task '%s'"
-            % (sum(error_flags), len(fovs), task_name)
+            % (num_errors, len(fov_ids), task_name)
         )
     else:
         logger.info("No errors occurred while running task '%s'" % task_name)
@@ -219,9 +590,13 @@ def main():
     log_filepath = os.path.join(log_dir, '%s_microscopy-cli.log' % db_utils.timestamp())
     cli_utils.configure_logging(log_filepath)
 
-    # note: a scoped session is required for dask-delayed processing methods
     Session = interface.make_scoped_session()
 
+    # the kwargs that determine how the FOV tasks are executed
+    executor_kwargs = dict(
+        num_workers=args.num_workers, executor=args.executor, resume=args.resume
+    )
+
     # insert microscopy datasets in the 'raw-pipeline-microscopy' directory
     # (these datasets started at PML0196, are manually defined in the 'PMLs' tab
     # of the 'pipeline-microscopy-master-key' google sheet,
@@ -243,7 +618,7 @@ def main():
         fov_operations.insert_microscopy_fovs(Session, fov_metadata)
 
     # if a pml_id was provided, only process the FOVs from that dataset
-    fovs = None
+    dataset_fovs = None
     if args.pml_id:
         dataset = (
             Session.query(models.MicroscopyDataset)
@@ -252,28 +627,60 @@ def main():
         )
         if dataset is None:
             raise ValueError('No dataset found for %s' % args.pml_id)
-        fovs = dataset.fovs
+        dataset_fovs = dataset.fovs
+    fovs = dataset_fovs
 
     # process all raw tiffs
     if args.process_raw_tiff:
         task_name = 'process_raw_tiff'
         if not args.process_all:
             fovs = fov_operations.get_unprocessed_fovs(Session, result_kind='raw-tiff-metadata')
-        do_fov_tasks(Session, config, task_name, fovs=fovs)
+        do_fov_tasks(Session, config, task_name, fovs=fovs, **executor_kwargs)
+
+    # run several of the tasks that read the raw TIFFs from a single read of each raw TIFF
+    # (by default, all but the ROI-cropping tasks, which are only run on the top-scoring FOVs
+    # and on the newly-annotated FOVs, respectively)
+    if args.process_raw_tiff_products:
+        task_name = 'process_raw_tiff_products'
+        products = args.products or [
+            product for product in RAW_TIFF_PRODUCTS
+            if product not in ('crop_corner_rois', 'crop_annotated_roi')
+        ]
+
+        # unless --process-all is set, only process the FOVs without the result of any one
+        # of the products (the FOVs are selected here, rather than by the previous tasks),
+        # and only run the products whose results each FOV does not have
+        product_fovs = dataset_fovs
+        if not args.process_all:
+            product_fovs = fov_operations.get_unprocessed_fovs(
+                Session,
+                result_kind=[RAW_TIFF_PRODUCT_RESULT_KINDS[product] for product in products]
+            )
+            if args.pml_id:
+                product_fovs = product_fovs.filter(models.MicroscopyFOV.pml_id == args.pml_id)
+        do_fov_tasks(
+            Session,
+            config,
+            task_name,
+            fovs=product_fovs,
+            products=products,
+            skip_existing=(not args.process_all),
+            **executor_kwargs
+        )
 
     # calculate z-profiles
     if args.calculate_z_profiles:
         task_name = 'calculate_z_profiles'
         if not args.process_all:
             fovs = fov_operations.get_unprocessed_fovs(Session, result_kind='z-profiles')
-        do_fov_tasks(Session, config, task_name, fovs=fovs)
+        do_fov_tasks(Session, config, task_name, fovs=fovs, **executor_kwargs)
 
     # crop around the cell layer in z
     if args.generate_clean_tiff:
         task_name = 'generate_clean_tiff'
         if not args.process_all:
             fovs = fov_operations.get_unprocessed_fovs(Session, result_kind='clean-tiff-metadata')
-        do_fov_tasks(Session, config, task_name, fovs=fovs)
+        do_fov_tasks(Session, config, task_name, fovs=fovs, **executor_kwargs)
 
     # calculate FOV features and score (requires the dragonfly-automation package)
     if args.calculate_fov_features:
@@ -293,7 +700,9 @@ def main():
 
         if not args.process_all:
             fovs = fov_operations.get_unprocessed_fovs(Session, result_kind='fov-features')
-        do_fov_tasks(Session, config, task_name, fovs=fovs, fov_scorer=fov_scorer)
+        do_fov_tasks(
+            Session, config, task_name, fovs=fovs, fov_scorer=fov_scorer, **executor_kwargs
+        )
 
     if args.generate_fov_thumbnails:
         task_name = 'generate_fov_thumbnails'
@@ -303,24 +712,16 @@ def main():
             task_name,
             fovs=fovs,
             scale=int(args.thumbnail_scale),
-            quality=int(args.thumbnail_quality)
+            quality=int(args.thumbnail_quality),
+            **executor_kwargs
         )
 
     if args.crop_corner_rois:
         task_name = 'crop_corner_rois'
 
         # only crop ROIs from the two highest-scoring FOVs per line
-        query = (
-            Session.query(models.CellLine)
-            .options(
-                sa.orm.joinedload(models.CellLine.fovs, innerjoin=True)
-                .joinedload(models.MicroscopyFOV.results, innerjoin=True)
-            )
-        )
-        fovs_to_crop = []
-        for line in query.all():
-            fovs_to_crop.extend(line.get_top_scoring_fovs(ntop=2))
-        do_fov_tasks(Session, config, task_name, fovs=fovs_to_crop)
+        fovs_to_crop = fov_operations.get_top_scoring_fovs(Session, ntop=2)
+        do_fov_tasks(Session, config, task_name, fovs=fovs_to_crop, **executor_kwargs)
 
     if args.crop_annotated_roi:
         task_name = 'crop_annotated_roi'
@@ -332,7 +733,7 @@ def main():
         # (this means ROIs from FOVs with existing but newly-edited annotations will not be updated)
         if not args.process_all:
             query = query.filter(~models.MicroscopyFOV.rois.any())
-        do_fov_tasks(Session, config, task_name, fovs=query.all())
+        do_fov_tasks(Session, config, task_name, fovs=query, **executor_kwargs)
 
     if args.generate_annotated_roi_thumbnails:
         task_name = 'generate_annotated_roi_thumbnails'
@@ -347,15 +748,16 @@ def main():
             Session,
             config,
             task_name,
-            fovs=query.all(),
+            fovs=query,
             scale=int(args.thumbnail_scale),
-            quality=int(args.thumbnail_quality)
+            quality=int(args.thumbnail_quality),
+            **executor_kwargs
         )
 
     if args.generate_nucleus_segmentation:
         task_name = 'generate_nucleus_segmentation'
         fovs = Session.query(models.MicroscopyFOV).all()
-        do_fov_tasks(Session, config, task_name, fovs=fovs)
+        do_fov_tasks(Session, config, task_name, fovs=fovs, **executor_kwargs)
 
 
 if __name__ == '__main__':
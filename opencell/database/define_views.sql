@@ -13,22 +13,12 @@ CREATE OR REPLACE VIEW cell_line_metadata AS (
 
 CREATE OR REPLACE VIEW public_cell_line AS (
     SELECT
-        ant.cell_line_id AS id
+        cell_line_id AS id
     FROM
-        (
-            SELECT
-                ant_1.cell_line_id,
-                unnest(
-                    ARRAY(
-                        SELECT json_array_elements_text(ant_1.categories :: json) AS json_array_elements_text
-                    )
-                ) AS category
-            FROM
-                cell_line_annotation ant_1
-                LEFT JOIN cell_line ON cell_line.id = ant_1.cell_line_id
-        ) ant
+        cell_line_annotation
     WHERE
-        ant.category = 'publication_ready'
+        -- containment (rather than unnesting the categories) can use the GIN index on categories
+        categories @> '["publication_ready"]'
 );
 
 
@@ -36,17 +26,16 @@ CREATE OR REPLACE VIEW fov_rank AS (
     SELECT
         fov.cell_line_id,
         fov.id AS fov_id,
-        (result.data ->> 'score') :: double precision AS score,
+        fov.score,
         row_number() OVER (
             PARTITION BY fov.cell_line_id
             ORDER BY
-                COALESCE((result.data ->> 'score') :: double precision, -1) DESC
+                fov.score DESC
         ) AS rank
     FROM
         microscopy_fov fov
-        LEFT JOIN microscopy_fov_result result ON fov.id = result.fov_id
     WHERE
-        result.kind = 'fov-features'
+        fov.score IS NOT NULL
 );
 
 
@@ -58,17 +47,11 @@ CREATE MATERIALIZED VIEW searchable_hgnc_metadata AS (
             ant.cell_line_id AS id,
             cd.ensg_id
         FROM
-            (
-                SELECT
-                    cell_line_annotation.cell_line_id,
-                    json_array_elements_text(cell_line_annotation.categories :: json) AS category
-                FROM
-                    cell_line_annotation
-            ) ant
+            cell_line_annotation ant
             JOIN cell_line ON cell_line.id = ant.cell_line_id
             JOIN crispr_design cd ON cd.id = cell_line.crispr_design_id
         WHERE
-            ant.category = 'publication_ready'
+            ant.categories @> '["publication_ready"]'
     ),
     abundance_by_ensg_id AS (
         SELECT
@@ -85,7 +68,12 @@ CREATE MATERIALIZED VIEW searchable_hgnc_metadata AS (
     SELECT
         hgnc.ensg_id,
         hgnc.symbol AS gene_name,
-        hgnc.name AS protein_name,
+        -- the protein names are prettified here, rather than per search request,
+        -- in the same way as by uniprot_utils.prettify_hgnc_protein_name
+        replace(
+            replace(upper(left(hgnc.name, 1)) || substr(hgnc.name, 2), ' like', '-like'),
+            ' related', '-related'
+        ) AS protein_name,
         published_cell_line.id AS published_cell_line_id,
         pgea.protein_group_id AS significant_protein_group_id,
         ab.measured_expression,
@@ -98,3 +86,42 @@ CREATE MATERIALIZED VIEW searchable_hgnc_metadata AS (
         LEFT JOIN protein_group_ensembl_association pgea ON pgea.ensg_id = hgnc.ensg_id
         LEFT JOIN abundance_by_ensg_id ab ON ab.ensg_id = hgnc.ensg_id
 );
+
+
+-- all current, previous, and alias HGNC gene names, one row per (ensg_id, name),
+-- upper-cased so that both exact and prefix matches can use the btree index
+-- (the trigram index supports case-insensitive and infix matches)
+DROP MATERIALIZED VIEW IF EXISTS gene_name_alias;
+
+CREATE MATERIALIZED VIEW gene_name_alias AS (
+    SELECT DISTINCT
+        ensg_id,
+        upper(name) AS name,
+        kind
+    FROM
+        (
+            SELECT ensg_id, symbol AS name, 'symbol' AS kind FROM hgnc_metadata
+            UNION ALL
+            SELECT
+                ensg_id,
+                unnest(string_to_array(prev_symbol, '|')) AS name,
+                'prev_symbol' AS kind
+            FROM
+                hgnc_metadata
+            UNION ALL
+            SELECT
+                ensg_id,
+                unnest(string_to_array(alias_symbol, '|')) AS name,
+                'alias_symbol' AS kind
+            FROM
+                hgnc_metadata
+        ) names
+    WHERE
+        name IS NOT NULL AND name != ''
+);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX idx_gene_name_alias_name ON gene_name_alias (name text_pattern_ops);
+CREATE INDEX idx_gene_name_alias_name_trgm ON gene_name_alias USING gin (name gin_trgm_ops);
+CREATE INDEX idx_gene_name_alias_ensg_id ON gene_name_alias (ensg_id);
@@ -1,6 +1,7 @@
+import collections
 import json
 import logging
-import pandas as pd
+import sqlalchemy as sa
 
 from opencell.database import models, utils, metadata_operations
 
@@ -53,24 +54,141 @@ def insert_microscopy_fovs(session, fov_metadata):
         line_ops.insert_microscopy_fovs(session, grouped.get_group(group))
 
 
-def get_unprocessed_fovs(session, result_kind):
+def get_unprocessed_fovs(session, result_kind, batch_size=1000):
     '''
     Retrieve all FOV instances without any results of the specified kind
     in the MicroscopyFOVResult table
+
+    result_kind : a result kind, or a list of result kinds
+        (in which case the FOVs without a result of any one of the kinds are retrieved)
+
+    This is a single anti-join (which uses the index on microscopy_fov_result (fov_id, kind)),
+    and the FOVs are streamed from the database in batches of `batch_size`
+    (so the returned query should be iterated over only once)
+    '''
+    result_kinds = [result_kind] if isinstance(result_kind, str) else result_kind
+    is_unprocessed = sa.or_(*(
+        ~(
+            sa.exists()
+            .where(models.MicroscopyFOVResult.fov_id == models.MicroscopyFOV.id)
+            .where(models.MicroscopyFOVResult.kind == kind)
+        )
+        for kind in result_kinds
+    ))
+    return (
+        session.query(models.MicroscopyFOV)
+        .filter(is_unprocessed)
+        .order_by(models.MicroscopyFOV.id)
+        .yield_per(batch_size)
+    )
+
+
+def get_top_scoring_fovs(session, ntop):
     '''
-    query = '''
-        select fov.*, res.kind as kind from microscopy_fov fov
-        left join (select * from microscopy_fov_result where kind = '%s') res
-        on fov.id = res.fov_id
-        where kind is null;
+    The ntop highest-scoring FOVs of every cell line, in a single query
+    (FOVs without a score are omitted)
     '''
-    d = pd.read_sql(query % result_kind, session.get_bind())
-    unprocessed_fovs = (
+    rank = (
+        sa.func.row_number()
+        .over(
+            partition_by=models.MicroscopyFOV.cell_line_id,
+            order_by=(models.MicroscopyFOV.score.desc(), models.MicroscopyFOV.id)
+        )
+        .label('rank')
+    )
+    ranked_fovs = (
+        session.query(models.MicroscopyFOV.id, rank)
+        .filter(models.MicroscopyFOV.score.isnot(None))
+        .subquery()
+    )
+    return (
         session.query(models.MicroscopyFOV)
-        .filter(models.MicroscopyFOV.id.in_(list(d.id)))
+        .join(ranked_fovs, ranked_fovs.c.id == models.MicroscopyFOV.id)
+        .filter(ranked_fovs.c.rank <= ntop)
+        .order_by(models.MicroscopyFOV.cell_line_id, ranked_fovs.c.rank)
         .all()
     )
-    return unprocessed_fovs
+
+
+def get_completed_fov_tasks(session, task_name):
+    '''
+    The input fingerprints of the FOVs on which the most recent run of a task succeeded,
+    as a dict keyed by fov_id (see models.MicroscopyFOVTaskRun)
+    '''
+    TaskRun = models.MicroscopyFOVTaskRun
+    query = (
+        session.query(TaskRun.fov_id, TaskRun.status, TaskRun.input_fingerprint)
+        .filter(TaskRun.task_name == task_name)
+        .distinct(TaskRun.fov_id)
+        .order_by(TaskRun.fov_id, TaskRun.id.desc())
+    )
+    return {row.fov_id: row.input_fingerprint for row in query if row.status == 'succeeded'}
+
+
+class BufferedWriter:
+    '''
+    A buffer of the rows inserted (and the FOV columns updated) by MicroscopyFOVOperations
+    that writes them in bulk, so that the results of many FOVs are written in one transaction
+
+    The rows are grouped by model and written using bulk_insert_mappings
+    (or bulk_update_mappings), in the order in which each model was first buffered
+    '''
+    def __init__(self, session, max_rows=1000):
+        '''
+        max_rows : the number of buffered rows at which the owner of the writer should flush it
+            (see cli.microscopy.populate_results)
+        '''
+        self.session = session
+        self.max_rows = max_rows
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, instances):
+        '''
+        Buffer the insertion of new (unsaved) model instances
+        '''
+        for instance in instances:
+            state = sa.inspect(instance)
+            mapping = {
+                attr.key: state.dict[attr.key]
+                for attr in state.mapper.column_attrs if attr.key in state.dict
+            }
+            self.rows.append(('insert', type(instance), mapping))
+
+    def update(self, model, mapping):
+        '''
+        Buffer an update of an existing row (the mapping must include the primary key)
+        '''
+        self.rows.append(('update', model, mapping))
+
+    def discard(self, num_rows):
+        '''
+        Discard the rows buffered after the first `num_rows` rows
+        (used to discard the rows from a failed call to an `insert_*` method)
+        '''
+        del self.rows[num_rows:]
+
+    def flush(self):
+        '''
+        Write and commit all of the buffered rows (the rows are discarded if an error occurs)
+        '''
+        groups = collections.defaultdict(list)
+        for method, model, mapping in self.rows:
+            groups[(method, model)].append(mapping)
+        self.rows = []
+
+        try:
+            for (method, model), mappings in groups.items():
+                if method == 'insert':
+                    self.session.bulk_insert_mappings(model, mappings)
+                else:
+                    self.session.bulk_update_mappings(model, mappings)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
 
 
 class MicroscopyFOVOperations:
@@ -87,12 +205,27 @@ class MicroscopyFOVOperations:
 
     '''
 
-    def __init__(self, fov_id, errors):
+    def __init__(self, fov_id, errors, writer=None):
         '''
         errors : kwarg passed to add_and_commit; either 'raise' or 'warn'
+        writer : an optional BufferedWriter; if provided, the `insert_*` methods
+            add their rows to the writer instead of committing them immediately
         '''
         self.fov_id = fov_id
         self.errors = errors
+        self.writer = writer
+
+
+    def _add(self, session, instances):
+        '''
+        Insert new rows, either immediately or via the writer
+        '''
+        if not isinstance(instances, list):
+            instances = [instances]
+        if self.writer is None:
+            utils.add_and_commit(session, instances, errors=self.errors)
+        else:
+            self.writer.add(instances)
 
 
     def insert_nothing(self, session, result):
@@ -102,6 +235,46 @@ class MicroscopyFOVOperations:
         return
 
 
+    def _update_fov(self, session, **values):
+        '''
+        Copy frequently-read fields of a result to the corresponding columns of the FOV
+        (the update is committed along with the result by the subsequent call to `_add`)
+        '''
+        for column, value in values.items():
+            try:
+                values[column] = float(value) if value is not None else None
+            except (TypeError, ValueError):
+                values[column] = None
+
+        if self.writer is not None:
+            self.writer.update(models.MicroscopyFOV, dict(id=self.fov_id, **values))
+            return
+        (
+            session.query(models.MicroscopyFOV)
+            .filter(models.MicroscopyFOV.id == self.fov_id)
+            .update(values, synchronize_session=False)
+        )
+
+
+    def insert_task_run(self, session, task_name, error, duration, input_fingerprint):
+        '''
+        Record a run of an FOV task in the task-run ledger
+        error : the error message, or None if the task succeeded
+        '''
+        row = models.MicroscopyFOVTaskRun(
+            fov_id=self.fov_id,
+            task_name=task_name,
+            status=('failed' if error is not None else 'succeeded'),
+            duration=duration,
+            error=error,
+            input_fingerprint=input_fingerprint,
+        )
+        if self.writer is None:
+            utils.add_and_commit(session, row, errors='warn')
+        else:
+            self.writer.add([row])
+
+
     def insert_raw_tiff_metadata(self, session, result):
         '''
         Insert the raw tiff metadata and raw TIFF processing events
@@ -117,16 +290,17 @@ class MicroscopyFOVOperations:
         metadata = result.get('metadata')
         events = result.get('events')
 
-        row = models.MicroscopyFOVResult(
-            fov_id=self.fov_id, kind='raw-tiff-metadata', data=metadata
-        )
-        utils.add_and_commit(session, row, errors=self.errors)
-
+        self._update_fov(session, laser_power_488=metadata.get('laser_power_488_488'))
+        rows = [
+            models.MicroscopyFOVResult(fov_id=self.fov_id, kind='raw-tiff-metadata', data=metadata)
+        ]
         if len(events):
-            row = models.MicroscopyFOVResult(
-                fov_id=self.fov_id, kind='raw-tiff-processing-events', data=events
+            rows.append(
+                models.MicroscopyFOVResult(
+                    fov_id=self.fov_id, kind='raw-tiff-processing-events', data=events
+                )
             )
-            utils.add_and_commit(session, row, errors=self.errors)
+        self._add(session, rows)
 
 
     def insert_fov_features(self, session, result):
@@ -135,10 +309,11 @@ class MicroscopyFOVOperations:
         result : dict returned by FOVProcessor.calculate_fov_features
         '''
         result = utils.to_jsonable(result)
+        self._update_fov(session, score=result.get('score'))
         row = models.MicroscopyFOVResult(
             fov_id=self.fov_id, kind='fov-features', data=result
         )
-        utils.add_and_commit(session, row, errors=self.errors)
+        self._add(session, row)
 
 
     def insert_fov_thumbnails(self, session, result):
@@ -152,7 +327,7 @@ class MicroscopyFOVOperations:
             size=result['size'],
             data=result['encoded_thumbnails']['rgb']
         )
-        utils.add_and_commit(session, thumbnail, errors=self.errors)
+        self._add(session, thumbnail)
 
 
     def insert_roi_thumbnails(self, session, result):
@@ -170,7 +345,7 @@ class MicroscopyFOVOperations:
             size=result['size'],
             data=result['encoded_thumbnails']['rgb']
         )
-        utils.add_and_commit(session, thumbnail, errors=self.errors)
+        self._add(session, thumbnail)
 
 
     def insert_z_profiles(self, session, result):
@@ -182,7 +357,7 @@ class MicroscopyFOVOperations:
         row = models.MicroscopyFOVResult(
             fov_id=self.fov_id, kind='z-profiles', data=result
         )
-        utils.add_and_commit(session, row, errors=self.errors)
+        self._add(session, row)
 
 
     def insert_clean_tiff_metadata(self, session, result):
@@ -190,10 +365,11 @@ class MicroscopyFOVOperations:
         Insert result from the generate_clean_tiff method
         '''
         result = utils.to_jsonable(result)
+        self._update_fov(session, cell_layer_center=result.get('cell_layer_center'))
         row = models.MicroscopyFOVResult(
             fov_id=self.fov_id, kind='clean-tiff-metadata', data=result
         )
-        utils.add_and_commit(session, row, errors=self.errors)
+        self._add(session, row)
 
 
     def insert_corner_rois(self, session, result):
@@ -227,7 +403,7 @@ class MicroscopyFOVOperations:
         row = models.MicroscopyFOVResult(
             fov_id=self.fov_id, kind=result_kind, data=result
         )
-        utils.add_and_commit(session, row, errors=self.errors)
+        self._add(session, row)
 
         rois = []
         for roi_props in all_roi_props:
@@ -236,4 +412,4 @@ class MicroscopyFOVOperations:
                 fov_id=self.fov_id, kind=roi_kind, props=roi_props
             )
             rois.append(roi)
-        utils.add_and_commit(session, rois, errors=self.errors)
+        self._add(session, rois)
@@ -1,3 +1,4 @@
+import json
 import logging
 import pandas as pd
 import sqlalchemy as sa
@@ -167,20 +168,30 @@ def create_polyclonal_lines(session, progenitor_cell_line, plate_design, date):
         utils.add_and_commit(session, cell_line)
 
 
+def select_publication_ready_lines():
+    '''
+    A select of the ids of all publication-ready cell lines (from the public_cell_line view)
+
+    This is intended for filters like `models.CellLine.id.in_(select_publication_ready_lines())`,
+    which the database evaluates as a semi-join, rather than filtering by a list of ids
+    returned by `get_lines_by_annotation`
+    '''
+    public_cell_line = sa.table('public_cell_line', sa.column('id'))
+    return sa.select(public_cell_line.c.id)
+
+
 def get_lines_by_annotation(engine, annotation):
     '''
     Get the ids of all cell lines with a particular manual annotation category
+    (the containment operator can use the GIN index on the categories column)
     '''
     result = pd.read_sql(
         '''
-        select cell_line_id from(
-            select cell_line_id, json_array_elements_text(categories::json) as cat
-            from cell_line_annotation
-        ) tmp
-        where cat = %(annotation)s
+        select cell_line_id from cell_line_annotation
+        where categories @> cast(%(categories)s as jsonb)
         ''',
         engine,
-        params=dict(annotation=annotation)
+        params=dict(categories=json.dumps([annotation]))
     )
     return result.cell_line_id.tolist()
 
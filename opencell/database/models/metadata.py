@@ -8,7 +8,7 @@ import sqlalchemy.ext.hybrid
 import sqlalchemy.ext.declarative
 from sqlalchemy.dialects import postgresql
 
-from opencell.database import utils
+from opencell.database import utils, models
 from opencell.database.models import Base, enums, mixins
 
 import logging
@@ -81,8 +81,12 @@ class CellLine(Base):
     )
 
     # one cell_line to many pulldowns
+    # (ordered so that the choice of 'best' pulldown in get_best_pulldown is deterministic)
     pulldowns = sa.orm.relationship(
-        'MassSpecPulldown', back_populates='cell_line', passive_deletes='all'
+        'MassSpecPulldown',
+        back_populates='cell_line',
+        passive_deletes='all',
+        order_by='MassSpecPulldown.id',
     )
 
     def __repr__(self):
@@ -103,50 +107,56 @@ class CellLine(Base):
         This logic is necessary because there may be multiple pulldowns per cell line,
         but only ever one 'good' one whose hits should be displayed/analyzed
         '''
-        if not self.pulldowns:
+        return self.select_best_pulldown(self.pulldowns)
+
+
+    @staticmethod
+    def select_best_pulldown(pulldowns):
+        '''
+        Select the 'good' pulldown from a list of pulldowns
+        (these can be MassSpecPulldown instances or any rows with `manual_display_flag`,
+        so that the same logic can be used by the bulk payload builders)
+        '''
+        if not pulldowns:
             return None
 
         # the manually-flagged 'good' pulldowns
         # (there should be only one of these, but we don't enforce this)
         candidate_pulldowns = [
-            pulldown for pulldown in self.pulldowns if pulldown.manual_display_flag
+            pulldown for pulldown in pulldowns if pulldown.manual_display_flag
         ]
         if not candidate_pulldowns:
-            candidate_pulldowns = self.pulldowns
+            candidate_pulldowns = pulldowns
         return candidate_pulldowns[0]
 
 
     def get_top_scoring_fovs(self, ntop=None):
         '''
-        Get the n highest-scoring FOVs
+        Get the n highest-scoring FOVs (FOVs without a score are omitted)
         '''
-        scores = np.array([fov.get_score() for fov in self.fovs])
-
-        # sort the FOVs by score
-        mask = ~pd.isna(scores)
-        scores[~mask] = -1
-        inds = np.argsort(np.array(scores))[::-1]
-
-        # drop inds without a score
-        scores = [score for score in scores if score is not None]
-        inds = inds[mask[inds]]
-
-        # the n-highest-scoring FOVs
-        ntop = len(inds) if ntop is None else ntop
-        top_fovs = [self.fovs[ind] for ind in inds[:ntop]]
-        return top_fovs
+        return (
+            sa.orm.object_session(self).query(models.MicroscopyFOV)
+            .filter(models.MicroscopyFOV.cell_line_id == self.id)
+            .filter(models.MicroscopyFOV.score.isnot(None))
+            .order_by(models.MicroscopyFOV.score.desc(), models.MicroscopyFOV.id)
+            .limit(ntop)
+            .all()
+        )
 
 
     def get_best_fov(self):
         '''
         Get the 'best' FOV
-        For now, this is the first FOV that is manually annotated
-        (using get_top_scoring_fovs is too slow)
+        This is the highest-scoring FOV that is manually annotated
+        (or the first annotated FOV, if none of the annotated FOVs have a score)
         '''
-        for fov in self.fovs:
-            if fov.annotation:
-                return fov
-        return None
+        return (
+            sa.orm.object_session(self).query(models.MicroscopyFOV)
+            .filter(models.MicroscopyFOV.cell_line_id == self.id)
+            .filter(models.MicroscopyFOV.annotation.has())
+            .order_by(models.MicroscopyFOV.score.desc().nullslast(), models.MicroscopyFOV.id)
+            .first()
+        )
 
 
 class PlateDesign(Base):
@@ -493,10 +503,12 @@ class HGNCMetadata(Base, mixins.TimestampMixin):
         viewonly=True
     )
 
+    # (ordered so that the 'first' measurement used by the API payloads is deterministic)
     abundance_measurements = sa.orm.relationship(
         'AbundanceMeasurement',
         secondary='ensembl_uniprot_association',
         secondaryjoin='EnsemblUniprotAssociation.uniprot_id == AbundanceMeasurement.uniprot_id',
+        order_by='AbundanceMeasurement.uniprot_id',
         uselist=True,
         viewonly=True
     )
@@ -620,3 +632,10 @@ class CellLineAnnotation(Base, mixins.TimestampMixin):
 
     # the client-side timestamp, app state, etc
     client_metadata = sa.Column(postgresql.JSONB)
+
+    # for containment queries on the categories (e.g., `categories @> '["publication_ready"]'`)
+    __table_args__ = (
+        sa.Index(
+            None, categories, postgresql_using='gin', postgresql_ops={'categories': 'jsonb_path_ops'}
+        ),
+    )
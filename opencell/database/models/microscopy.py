@@ -114,10 +114,25 @@ class MicroscopyFOV(Base):
     # the path to the original raw TIFF, relative to the root_directory
     raw_filename = sa.Column(sa.String)
 
+    # frequently-read fields of the FOV results, copied from the results
+    # by the `insert_*` methods of fov_operations.MicroscopyFOVOperations
+    # the predicted FOV score (from the 'fov-features' result)
+    score = sa.Column(sa.Float)
+
+    # the laser power of the 488 channel (from the 'raw-tiff-metadata' result)
+    laser_power_488 = sa.Column(sa.Float)
+
+    # the z-index of the cell layer center in the raw z-stack (from the 'clean-tiff-metadata' result)
+    cell_layer_center = sa.Column(sa.Float)
+
     # because we image by plate, each well_id is imaged once per plate
     # this fact can be expressed by the following constraint
     # (assuming that each cell line appears in only one well on each imaging plate)
-    __table_args__ = (sa.UniqueConstraint(pml_id, cell_line_id, site_num),)
+    # the index on (cell_line_id, score) is for selecting the highest-scoring FOVs of each cell line
+    __table_args__ = (
+        sa.UniqueConstraint(pml_id, cell_line_id, site_num),
+        sa.Index('idx_microscopy_fov_cell_line_id_score', cell_line_id, score),
+    )
 
     @sa.orm.validates('imaging_round_id')
     def validate_imaging_round_id(self, key, value):
@@ -148,8 +163,7 @@ class MicroscopyFOV(Base):
         )
 
     def get_score(self):
-        features = self.get_result('fov-features')
-        return features.data.get('score') if features else None
+        return self.score
 
     def get_thumbnail(self):
         return self.thumbnails[0] if self.thumbnails else None
@@ -178,6 +192,43 @@ class MicroscopyFOVResult(Base, TimestampMixin):
     # the result data
     data = sa.Column(postgresql.JSONB)
 
+    # for looking up the results of a given kind for an FOV (see fov_operations.get_unprocessed_fovs)
+    __table_args__ = (sa.Index('idx_microscopy_fov_result_fov_id_kind', fov_id, kind),)
+
+
+class MicroscopyFOVTaskRun(Base, TimestampMixin):
+    '''
+    A ledger of the runs of the FOV processing tasks (see cli.microscopy.do_fov_tasks)
+
+    There is one row for every run of a task on an FOV;
+    the input fingerprint is a digest of the inputs to the task (see cli.microscopy.FOVTaskManager),
+    so that FOVs on which a task has already succeeded with the same inputs can be skipped
+    '''
+    __tablename__ = 'microscopy_fov_task_run'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+
+    fov_id = sa.Column(sa.Integer, sa.ForeignKey('microscopy_fov.id', ondelete='CASCADE'))
+
+    # the name of the task (one of the processor methods in cli.microscopy.TASK_DEFINITIONS)
+    task_name = sa.Column(sa.String, nullable=False)
+
+    # either 'succeeded' or 'failed'
+    status = sa.Column(sa.String, nullable=False)
+
+    # the duration of the task in seconds
+    duration = sa.Column(sa.Float)
+
+    # the error message, if the task failed
+    error = sa.Column(sa.String)
+
+    # the digest of the inputs to the task
+    input_fingerprint = sa.Column(sa.String)
+
+    __table_args__ = (
+        sa.Index('idx_microscopy_fov_task_run_task_name_fov_id', task_name, fov_id),
+    )
+
 
 class MicroscopyFOVROI(Base, TimestampMixin):
     '''
@@ -267,3 +318,10 @@ class MicroscopyFOVAnnotation(Base, TimestampMixin):
 
     # the client-side timestamp, app state, etc
     client_metadata = sa.Column(postgresql.JSONB)
+
+    # for containment queries on the categories (e.g., `categories @> '["publication_ready"]'`)
+    __table_args__ = (
+        sa.Index(
+            None, categories, postgresql_using='gin', postgresql_ops={'categories': 'jsonb_path_ops'}
+        ),
+    )
@@ -1,4 +1,5 @@
 import pytest
+import collections
 import sqlalchemy as sa
 
 from opencell.database import models
@@ -20,7 +21,18 @@ def test_crispr_design_get_best_cell_line():
 
 
 def test_cell_line_get_best_pulldown():
-    pass
+
+    Pulldown = collections.namedtuple('Pulldown', ['id', 'manual_display_flag'])
+    assert models.CellLine.select_best_pulldown([]) is None
+    assert models.CellLine.select_best_pulldown(None) is None
+
+    # without flagged pulldowns, the first pulldown is the best one
+    pulldowns = [Pulldown(1, None), Pulldown(2, False)]
+    assert models.CellLine.select_best_pulldown(pulldowns).id == 1
+
+    # the manually-flagged pulldown is the best one
+    pulldowns = [Pulldown(1, None), Pulldown(2, True), Pulldown(3, False)]
+    assert models.CellLine.select_best_pulldown(pulldowns).id == 2
 
 
 def test_cell_line_get_top_scoring_fovs():
@@ -1,9 +1,12 @@
 import os
+import types
 import pytest
 import pandas as pd
 import sqlalchemy as sa
 
+from opencell.cli import microscopy
 from opencell.database import models, fov_operations, utils
+from opencell.imaging.processors import FOVProcessor
 
 
 def test_insert_microscopy_dataset(session):
@@ -102,3 +105,306 @@ def test_insert_microscopy_fovs_nonexistent_sort_count(session, insert_plate, fo
 
     fov_operations.insert_microscopy_fovs(session, fov_metadata)
     assert len(session.query(models.MicroscopyFOV).all()) == 0
+
+
+@pytest.fixture
+def fov_ids(session, microscopy_datasets, insert_plate, fov_metadata):
+    '''
+    The ids of the FOVs from the generic fov-metadata example
+    '''
+    insert_plate(fov_metadata.iloc[0].plate_id)
+    fov_operations.insert_microscopy_fovs(session, fov_metadata)
+    fovs = session.query(models.MicroscopyFOV).order_by(models.MicroscopyFOV.id).all()
+    assert len(fovs) >= 3
+    return [fov.id for fov in fovs]
+
+
+def get_fov_results(session, fov_id):
+    session.expire_all()
+    return (
+        session.query(models.MicroscopyFOVResult)
+        .filter(models.MicroscopyFOVResult.fov_id == fov_id)
+        .all()
+    )
+
+
+def get_fov_task_runs(session, fov_id):
+    session.expire_all()
+    return (
+        session.query(models.MicroscopyFOVTaskRun)
+        .filter(models.MicroscopyFOVTaskRun.fov_id == fov_id)
+        .order_by(models.MicroscopyFOVTaskRun.id)
+        .all()
+    )
+
+
+def test_buffered_writer(session, fov_ids):
+    '''
+    The result rows and the FOV column updates should be written together in one flush
+    '''
+    writer = fov_operations.BufferedWriter(session)
+    for ind, fov_id in enumerate(fov_ids[:2]):
+        fov_ops = fov_operations.MicroscopyFOVOperations(fov_id, errors='raise', writer=writer)
+        fov_ops.insert_fov_features(session, {'score': ind + 0.5})
+
+    # one result and one FOV update for each FOV, none of which have been written yet
+    assert len(writer) == 4
+    assert get_fov_results(session, fov_ids[0]) == []
+
+    writer.flush()
+    assert len(writer) == 0
+    for ind, fov_id in enumerate(fov_ids[:2]):
+        results = get_fov_results(session, fov_id)
+        assert [result.kind for result in results] == ['fov-features']
+        assert results[0].data == {'score': ind + 0.5}
+        assert session.query(models.MicroscopyFOV).get(fov_id).score == ind + 0.5
+
+    # the FOVs without results should not be updated
+    assert session.query(models.MicroscopyFOV).get(fov_ids[2]).score is None
+
+
+def test_buffered_writer_failed_flush(session, fov_ids):
+    '''
+    If the flush fails, none of the buffered rows or FOV updates should be written
+    '''
+    writer = fov_operations.BufferedWriter(session)
+    fov_ops = fov_operations.MicroscopyFOVOperations(fov_ids[0], errors='raise', writer=writer)
+    fov_ops.insert_clean_tiff_metadata(session, {'cell_layer_center': 12.5})
+
+    # a set is not JSON-serializable, so the insert of this result fails
+    fov_ops = fov_operations.MicroscopyFOVOperations(fov_ids[1], errors='raise', writer=writer)
+    fov_ops.insert_clean_tiff_metadata(session, {'cell_layer_center': 13.5, 'tags': {'a'}})
+
+    with pytest.raises(Exception):
+        writer.flush()
+
+    assert len(writer) == 0
+    assert get_fov_results(session, fov_ids[0]) == []
+    assert session.query(models.MicroscopyFOV).get(fov_ids[0]).cell_layer_center is None
+
+
+def test_unbuffered_result_and_fov_update_in_one_commit(session, fov_ids):
+    '''
+    Without a writer, the FOV update should be committed (or rolled back) with the result row
+    '''
+    fov_ops = fov_operations.MicroscopyFOVOperations(fov_ids[0], errors='raise')
+    fov_ops.insert_clean_tiff_metadata(session, {'cell_layer_center': 12.5})
+
+    # the update and the result should both be visible from a new connection
+    with session.get_bind().engine.connect() as connection:
+        center = connection.execute(
+            sa.select(models.MicroscopyFOV.cell_layer_center)
+            .where(models.MicroscopyFOV.id == fov_ids[0])
+        ).scalar()
+    assert center == 12.5
+    assert [result.kind for result in get_fov_results(session, fov_ids[0])] == [
+        'clean-tiff-metadata'
+    ]
+
+    # if the insert of the result fails, the update of the FOV should be rolled back
+    fov_ops = fov_operations.MicroscopyFOVOperations(fov_ids[1], errors='raise')
+    with pytest.raises(Exception):
+        fov_ops.insert_clean_tiff_metadata(session, {'cell_layer_center': 13.5, 'tags': {'a'}})
+
+    assert get_fov_results(session, fov_ids[1]) == []
+    assert session.query(models.MicroscopyFOV).get(fov_ids[1]).cell_layer_center is None
+
+
+def test_populate_results_discards_failed_populator(session, fov_ids):
+    '''
+    The rows buffered by a populator method that fails should be discarded,
+    without discarding the rows from the other FOVs
+    '''
+    outcomes = [
+        microscopy.FOVTaskOutcome(fov_ids[0], ({}, [{'x': 0}]), None, 1.0, 'fp0', skipped=False),
+
+        # the ROI props are missing, so the populator fails after buffering the result row
+        microscopy.FOVTaskOutcome(fov_ids[1], ({}, None), None, 1.0, 'fp1', skipped=False),
+
+        microscopy.FOVTaskOutcome(fov_ids[2], None, None, None, 'fp2', skipped=True),
+    ]
+    writer = fov_operations.BufferedWriter(session)
+    num_errors = microscopy.populate_results(
+        lambda: session, 'crop_corner_rois', outcomes, writer=writer
+    )
+    assert num_errors == 1
+    assert len(writer) == 0
+
+    assert [result.kind for result in get_fov_results(session, fov_ids[0])] == [
+        'corner-roi-cropping'
+    ]
+    assert len(session.query(models.MicroscopyFOVROI).all()) == 1
+    assert get_fov_results(session, fov_ids[1]) == []
+
+    runs = get_fov_task_runs(session, fov_ids[0])
+    assert [(run.status, run.input_fingerprint) for run in runs] == [('succeeded', 'fp0')]
+
+    runs = get_fov_task_runs(session, fov_ids[1])
+    assert [(run.status, run.input_fingerprint) for run in runs] == [('failed', 'fp1')]
+    assert runs[0].error is not None
+
+    # skipped FOVs should not be recorded in the ledger
+    assert get_fov_task_runs(session, fov_ids[2]) == []
+
+
+def test_populate_results_flush_failure_fallback(session, fov_ids):
+    '''
+    If a bulk write fails, the results should be inserted again one FOV at a time,
+    so that only the FOV whose result cannot be inserted fails
+    '''
+    results = [
+        {'cell_layer_center': 12.5},
+        {'cell_layer_center': 13.5, 'tags': {'a'}},
+        {'cell_layer_center': 14.5},
+    ]
+    outcomes = [
+        microscopy.FOVTaskOutcome(fov_id, result, None, 1.0, 'fp', skipped=False)
+        for fov_id, result in zip(fov_ids, results)
+    ]
+    writer = fov_operations.BufferedWriter(session)
+    num_errors = microscopy.populate_results(
+        lambda: session, 'generate_clean_tiff', outcomes, writer=writer
+    )
+    assert num_errors == 1
+
+    for fov_id, center in [(fov_ids[0], 12.5), (fov_ids[2], 14.5)]:
+        assert [result.kind for result in get_fov_results(session, fov_id)] == [
+            'clean-tiff-metadata'
+        ]
+        assert session.query(models.MicroscopyFOV).get(fov_id).cell_layer_center == center
+        assert [run.status for run in get_fov_task_runs(session, fov_id)] == ['succeeded']
+
+    assert get_fov_results(session, fov_ids[1]) == []
+    assert session.query(models.MicroscopyFOV).get(fov_ids[1]).cell_layer_center is None
+    assert [run.status for run in get_fov_task_runs(session, fov_ids[1])] == ['failed']
+
+
+def test_get_completed_fov_tasks(session, fov_ids):
+    '''
+    Only the most recent run of the task on each FOV should be considered
+    '''
+    runs = [
+        (fov_ids[0], 'process_raw_tiff', None, 'fp0'),
+        (fov_ids[0], 'calculate_z_profiles', 'some error', 'fp0'),
+
+        # a later failed run should override an earlier successful run
+        (fov_ids[1], 'process_raw_tiff', None, 'fp1'),
+        (fov_ids[1], 'process_raw_tiff', 'some error', 'fp1'),
+
+        # a later successful run should override an earlier failed run
+        (fov_ids[2], 'process_raw_tiff', 'some error', 'fp2'),
+        (fov_ids[2], 'process_raw_tiff', None, 'fp2-new'),
+    ]
+    for fov_id, task_name, error, input_fingerprint in runs:
+        fov_ops = fov_operations.MicroscopyFOVOperations(fov_id, errors='raise')
+        fov_ops.insert_task_run(
+            session, task_name, error=error, duration=1.0, input_fingerprint=input_fingerprint
+        )
+
+    completed = fov_operations.get_completed_fov_tasks(session, 'process_raw_tiff')
+    assert completed == {fov_ids[0]: 'fp0', fov_ids[2]: 'fp2-new'}
+
+    completed = fov_operations.get_completed_fov_tasks(session, 'calculate_z_profiles')
+    assert completed == {}
+
+
+def test_run_fov_task_resume(session, fov_ids, monkeypatch, tmp_path):
+    '''
+    A task should be skipped if the input fingerprint of its last successful run is unchanged,
+    and rerun if the fingerprint has changed (here, because the raw TIFF has changed)
+    '''
+    # the worker uses the test session in place of its own session
+    monkeypatch.setattr(microscopy, 'get_worker_session', lambda url: session)
+    config = types.SimpleNamespace(
+        PLATE_MICROSCOPY_DIR=str(tmp_path),
+        RAW_PIPELINE_MICROSCOPY_DIR=str(tmp_path),
+        OPENCELL_MICROSCOPY_DIR=str(tmp_path / 'dst'),
+    )
+    fov_id = fov_ids[0]
+    task_name = 'process_raw_tiff'
+
+    # the raw TIFF does not exist, so the task fails, but its fingerprint is still calculated
+    outcome = microscopy.run_fov_task(None, config, task_name, fov_id)
+    assert not outcome.skipped
+    assert outcome.error is not None
+    assert outcome.input_fingerprint is not None
+
+    # record a successful run with this fingerprint (as populate_results would)
+    fov_ops = fov_operations.MicroscopyFOVOperations(fov_id, errors='raise')
+    fov_ops.insert_task_run(
+        session, task_name, error=None, duration=1.0, input_fingerprint=outcome.input_fingerprint
+    )
+    completed = fov_operations.get_completed_fov_tasks(session, task_name)
+    assert completed == {fov_id: outcome.input_fingerprint}
+
+    # the inputs have not changed, so the task should be skipped
+    skipped_outcome = microscopy.run_fov_task(
+        None, config, task_name, fov_id, completed_fingerprint=completed[fov_id]
+    )
+    assert skipped_outcome.skipped
+    assert skipped_outcome.result is None and skipped_outcome.error is None
+    assert skipped_outcome.input_fingerprint == outcome.input_fingerprint
+
+    # skipped outcomes should not be recorded in the ledger
+    microscopy.populate_results(lambda: session, task_name, [skipped_outcome])
+    assert len(get_fov_task_runs(session, fov_id)) == 2
+
+    # create the raw TIFF, which changes the fingerprint, so the task should be rerun
+    processor = FOVProcessor.from_database(session.query(models.MicroscopyFOV).get(fov_id))
+    processor.set_paths(
+        plate_microscopy_dir=config.PLATE_MICROSCOPY_DIR,
+        raw_pipeline_microscopy_dir=config.RAW_PIPELINE_MICROSCOPY_DIR,
+    )
+    src_filepath = processor.src_filepath()
+    os.makedirs(os.path.dirname(src_filepath), exist_ok=True)
+    with open(src_filepath, 'wb') as file:
+        file.write(b'not a tiff')
+
+    rerun_outcome = microscopy.run_fov_task(
+        None, config, task_name, fov_id, completed_fingerprint=completed[fov_id]
+    )
+    assert not rerun_outcome.skipped
+    assert rerun_outcome.input_fingerprint != outcome.input_fingerprint
+
+    # the composite task should record the same fingerprints as the tasks run by themselves
+    composite_outcome = microscopy.run_fov_task(
+        None, config, 'process_raw_tiff_products', fov_id, products=[task_name]
+    )
+    assert composite_outcome.task_fingerprints == {task_name: rerun_outcome.input_fingerprint}
+
+
+def test_populate_results_composite_task(session, fov_ids):
+    '''
+    The results of the tasks of a composite task that succeeded should be inserted
+    even if another of its tasks failed
+    '''
+    result = {
+        'calculate_z_profiles': {'405': {'mean': [1, 2, 3]}},
+        'generate_clean_tiff': {'error': 'bad stack'},
+    }
+    task_fingerprints = {'calculate_z_profiles': 'fp-z', 'generate_clean_tiff': 'fp-clean'}
+    outcome = microscopy.FOVTaskOutcome(
+        fov_ids[0], result, None, 1.0, 'fp', skipped=False, task_fingerprints=task_fingerprints
+    )
+    writer = fov_operations.BufferedWriter(session)
+    num_errors = microscopy.populate_results(
+        lambda: session, 'process_raw_tiff_products', [outcome], writer=writer
+    )
+    assert num_errors == 1
+    assert [result.kind for result in get_fov_results(session, fov_ids[0])] == ['z-profiles']
+
+    # the composite task and each of its tasks should be recorded in the ledger
+    runs = get_fov_task_runs(session, fov_ids[0])
+    assert [(run.task_name, run.status, run.input_fingerprint) for run in runs] == [
+        ('process_raw_tiff_products', 'failed', 'fp'),
+        ('calculate_z_profiles', 'succeeded', 'fp-z'),
+        ('generate_clean_tiff', 'failed', 'fp-clean'),
+    ]
+    assert runs[0].error == 'generate_clean_tiff: bad stack'
+    assert runs[2].error == 'bad stack'
+
+    # so that resuming the tasks by themselves skips only the task that succeeded
+    assert fov_operations.get_completed_fov_tasks(session, 'calculate_z_profiles') == {
+        fov_ids[0]: 'fp-z'
+    }
+    assert fov_operations.get_completed_fov_tasks(session, 'generate_clean_tiff') == {}
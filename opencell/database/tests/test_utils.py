@@ -1,4 +1,8 @@
+import datetime
+import json
+import numpy as np
 import os
+import pandas as pd
 import pytest
 import opencell.database.utils as db_utils
 
@@ -41,3 +45,34 @@ def test_is_sequence():
     seqs = [' ', '-', 'b', 'abc', 'a.', 'a ', 'a a']
     for seq in seqs:
         assert not db_utils.is_sequence(seq), "'%s'" % seq
+
+
+def test_to_jsonable():
+
+    data = {
+        'int': np.int64(1),
+        'float': np.float32(0.5),
+        'nan': np.nan,
+        'inf': float('inf'),
+        'array': np.array([1.0, np.nan]),
+        'nested': {'values': [np.float64(-np.inf), None, 'a'], 1: pd.NaT},
+    }
+    result = db_utils.to_jsonable(data)
+    assert result == {
+        'int': 1,
+        'float': 0.5,
+        'nan': None,
+        'inf': None,
+        'array': [1.0, None],
+        'nested': {'values': [None, None, 'a'], '1': None},
+    }
+    assert type(result['int']) is int
+    assert type(result['float']) is float
+
+    # the result must be valid JSON
+    json.dumps(result, allow_nan=False)
+
+    # datetimes are coerced to ISO strings unless they are left to the JSON encoder
+    date = datetime.datetime(2021, 1, 2, 3, 4, 5)
+    assert db_utils.to_jsonable({'date': date}) == {'date': '2021-01-02T03:04:05'}
+    assert db_utils.to_jsonable({'date': date}, coerce_datetimes=False) == {'date': date}
@@ -1,6 +1,8 @@
 import datetime
 import json
 import logging
+import math
+import numpy as np
 import pandas as pd
 import re
 import sqlalchemy as sa
@@ -84,11 +86,29 @@ def delete_and_commit(session, instances, errors='warn'):
                 logger.warning('Error in delete_and_commit: %s' % exception)
 
 
-def to_jsonable(data):
+def to_jsonable(data, coerce_datetimes=True):
     '''
-    hackish way to make a dict JSON-safe
+    Recursively make a dict (or list) JSON-safe by coercing numpy scalars and arrays
+    to native python types, datetimes to ISO strings, and NaNs, Infs and NaTs to None
+
+    coerce_datetimes : whether to coerce datetimes to ISO strings; if False, they are left
+        to be serialized by the JSON encoder (as in api.utils.JSONEncoder)
     '''
-    return json.loads(pd.Series(data=data).to_json())
+    if isinstance(data, dict):
+        return {str(key): to_jsonable(value, coerce_datetimes) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_jsonable(value, coerce_datetimes) for value in data]
+    if isinstance(data, np.ndarray):
+        return to_jsonable(data.tolist(), coerce_datetimes)
+    if isinstance(data, np.generic):
+        data = data.item()
+    if isinstance(data, float):
+        return data if math.isfinite(data) else None
+    if data is pd.NaT or data is pd.NA:
+        return None
+    if coerce_datetimes and isinstance(data, (datetime.date, datetime.datetime)):
+        return data.isoformat()
+    return data
 
 
 def format_well_id(well_id):
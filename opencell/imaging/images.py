@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import tifffile
 
+from opencell.imaging import utils
+
 
 def timestamp():
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -65,8 +67,12 @@ class MicroManagerTIFF:
     def open_tiff(self):
         '''
         Open the stack using tifffile.TiffFile
+
+        The pages are cached, so that their tags are only decoded once
+        (by parse_micromanager_metadata) and not again when the pages are read
         '''
         self.tiff = tifffile.TiffFile(self.src_filepath)
+        self.tiff.pages.cache = True
 
 
     @staticmethod
@@ -112,6 +118,10 @@ class MicroManagerTIFF:
     def parse_micromanager_metadata(self):
         '''
         Parse the MicroManager metadata for each page in the TIFF file
+
+        The schema of the tags is detected from the first tag that can be parsed,
+        and the tags on all other pages are parsed using that schema
+        (the other schema is only tried if this fails)
         '''
 
         # the IJMetadata appears only in the first page
@@ -127,44 +137,53 @@ class MicroManagerTIFF:
             except Exception:
                 self.event_logger('IJMetadata could not be parsed by json.loads')
 
-        mm_metadata_rows = []
+        parsers = {
+            'v1': self._parse_mm_tag_schema_v1,
+            'v2': self._parse_mm_tag_schema_v2,
+        }
+
+        # the schema versions in the order in which they are tried
+        versions = ['v1', 'v2']
+
+        page_inds, errors, mm_metadata_rows = [], [], []
+        mm_metadata_version = None
         for ind, page in enumerate(self.tiff.pages):
-            mm_metadata_row = {
-                'page_ind': ind,
-                'error': False
-            }
+            page_inds.append(ind)
+            errors.append(False)
 
             mm_tag = page.tags.get('MicroManagerMetadata')
             if not isinstance(mm_tag, tifffile.tifffile.TiffTag):
                 self.event_logger('There was no MicroManagerMetadata tag found on page %s' % ind)
-                mm_metadata_row['error'] = True
-                mm_metadata_rows.append(mm_metadata_row)
+                errors[-1] = True
+                mm_metadata_rows.append({})
                 continue
 
-            try:
-                page_metadata_v1 = self._parse_mm_tag_schema_v1(mm_tag.value)
-            except Exception:
-                page_metadata_v1 = None
-            try:
-                page_metadata_v2 = self._parse_mm_tag_schema_v2(mm_tag.value)
-            except Exception:
-                page_metadata_v2 = None
-
-            page_metadata = {}
-            mm_metadata_version = None
-            if page_metadata_v1 is not None:
-                mm_metadata_version = 'v1'
-                page_metadata = page_metadata_v1
-            elif page_metadata_v2 is not None:
-                mm_metadata_version = 'v2'
-                page_metadata = page_metadata_v2
-            else:
-                mm_metadata_row['error'] = True
+            mm_tag_value = mm_tag.value
+            page_metadata = None
+            for version in versions:
+                try:
+                    page_metadata = parsers[version](mm_tag_value)
+                    break
+                except Exception:
+                    pass
+
+            if page_metadata is None:
+                mm_metadata_version = None
+                errors[-1] = True
                 self.event_logger('Unable to parse MicroManagerMetadata tag from page %s' % ind)
+                mm_metadata_rows.append({})
+                continue
 
-            mm_metadata_rows.append({**mm_metadata_row, **page_metadata})
+            # try the schema of this page first on the remaining pages
+            if version != versions[0]:
+                versions = [version] + [v for v in versions if v != version]
+
+            mm_metadata_version = version
+            mm_metadata_rows.append(page_metadata)
 
         self.mm_metadata = pd.DataFrame(data=mm_metadata_rows)
+        self.mm_metadata.insert(0, 'page_ind', page_inds)
+        self.mm_metadata.insert(1, 'error', errors)
         self.global_metadata['mm_metadata_version'] = mm_metadata_version
 
 
@@ -231,11 +250,11 @@ class RawPipelineTIFF(MicroManagerTIFF):
         # check that we can coerce the parsed columns as expected
         int_columns = ['slice_ind', 'channel_ind']
         for column in int_columns:
-            md[column] = md[column].apply(int)
+            md[column] = md[column].astype(int)
 
         float_columns = ['laser_power_405', 'laser_power_488', 'exposure_time']
         for column in float_columns:
-            md[column] = md[column].apply(float)
+            md[column] = md[column].astype(float)
 
         # if there are two distinct channels, we assign the first to 405 and the second to 488
         self.channel_inds = None
@@ -276,9 +295,12 @@ class RawPipelineTIFF(MicroManagerTIFF):
 
         # in each channel, check that slice_ind increments by 1.0
         # and that exposure time and laser power are consistent
+        # (the increments of all of these columns are calculated together)
+        step_columns = ['slice_ind', *float_columns]
+        values = md[step_columns].values.astype(float)
         for channel_ind in unique_channel_inds:
-            md_channel = md.loc[md.channel_ind == channel_ind]
-            steps = np.unique(np.diff(md_channel.slice_ind))
+            channel_steps = np.diff(values[md.channel_ind.values == channel_ind], axis=0)
+            steps = np.unique(channel_steps[:, 0]).astype(int)
 
             # check that slice inds are contiguous
             if len(steps) == 1 and steps[0] == 1:
@@ -293,9 +315,8 @@ class RawPipelineTIFF(MicroManagerTIFF):
                     'The slice_inds are not contiguous for channel_ind %s' % channel_ind
                 )
 
-            for column in float_columns:
-                steps = np.unique(np.diff(md_channel[column]))
-                if len(steps) > 1 or steps[0] != 0:
+            for ind, column in enumerate(float_columns, start=1):
+                if (channel_steps[:, ind] != 0).any():
                     self.event_logger(
                         'Inconsistent values found in column %s for channel_ind %s'
                         % (column, channel_ind)
@@ -373,8 +394,68 @@ class RawPipelineTIFF(MicroManagerTIFF):
 
     def concat_pages(self, page_inds):
         '''
+        Construct a z-stack from the pages with the given indices
+
+        If possible, the stack is a read-only memory-mapped view of the TIFF file
+        (see memmap_pages), so that only the slices and crops that are used are read from disk;
+        otherwise, the pages are read into memory
         '''
-        stack = np.array([self.tiff.pages[ind].asarray() for ind in page_inds])
+        stack = self.memmap_pages(page_inds)
+        if stack is None:
+            stack = np.array([self.tiff.pages[ind].asarray() for ind in page_inds])
+        return stack
+
+
+    def memmap_pages(self, page_inds):
+        '''
+        Memory-map the pages with the given indices as a single (read-only) z-stack
+
+        This is possible only if the pages are uncompressed, contiguous, in native byte order,
+        and evenly spaced in the file (with the same shape and dtype),
+        which is true of the pages of each channel in the raw MicroManager TIFFs
+        (in which the channels are either interleaved or consecutive);
+        returns None if it is not possible
+        '''
+        pages = [self.tiff.pages[int(ind)] for ind in page_inds]
+        if not pages:
+            return None
+
+        first_page = pages[0]
+        for page in pages:
+            if not getattr(page, 'is_memmappable', False):
+                return None
+            if page.shape != first_page.shape or page.dtype != first_page.dtype:
+                return None
+        if len(first_page.shape) != 2:
+            return None
+
+        # the bytes must be in native order
+        # (tifffile reports the dtype of the pages in native byte order, whatever the file's order)
+        if np.dtype(first_page.dtype).newbyteorder(self.tiff.byteorder) != np.dtype(first_page.dtype):
+            return None
+
+        # the pages must be evenly spaced (and in order) in the file
+        offsets = np.array([page.dataoffsets[0] for page in pages])
+        page_strides = np.unique(np.diff(offsets))
+        if len(page_strides) > 1 or (len(page_strides) and page_strides[0] < first_page.nbytes):
+            return None
+
+        dtype = np.dtype(first_page.dtype)
+        num_rows, num_cols = first_page.shape
+        page_stride = int(page_strides[0]) if len(page_strides) else first_page.nbytes
+        buffer = np.memmap(
+            self.src_filepath,
+            dtype='uint8',
+            mode='r',
+            offset=int(offsets[0]),
+            shape=(page_stride * (len(pages) - 1) + first_page.nbytes,)
+        )
+        stack = np.ndarray(
+            shape=(len(pages), num_rows, num_cols),
+            dtype=dtype,
+            buffer=buffer,
+            strides=(page_stride, num_cols * dtype.itemsize, dtype.itemsize),
+        )
         return stack
 
 
@@ -411,22 +492,36 @@ class RawPipelineTIFF(MicroManagerTIFF):
         '''
         stack = self.stacks[channel]
         return {
-            'min': np.array([zslice.min() for zslice in stack]).astype(int),
-            'max': np.array([zslice.max() for zslice in stack]).astype(int),
-            'mean': np.array([zslice.mean() for zslice in stack]).astype(int),
-            'p9999': np.array([np.percentile(zslice, 99.99) for zslice in stack]).astype(int),
+            'min': stack.min(axis=(1, 2)).astype(int),
+            'max': stack.max(axis=(1, 2)).astype(int),
+            'mean': self.calculate_z_profile_means(stack).astype(int),
+            'p9999': np.array([utils.exact_percentile(zslice, 99.99) for zslice in stack]).astype(int),
         }
 
 
     @staticmethod
-    def find_cell_layer(stack):
+    def calculate_z_profile_means(stack):
+        '''
+        The mean intensity of each z-slice
+
+        For integer stacks, the sums are exact, so the means are identical
+        to those calculated slice by slice (by `zslice.mean()`) but are calculated in one pass
+        '''
+        if not np.issubdtype(stack.dtype, np.integer):
+            return np.array([zslice.mean() for zslice in stack])
+        num_pixels = stack.shape[1] * stack.shape[2]
+        return stack.sum(axis=(1, 2), dtype=np.int64) / num_pixels
+
+
+    @classmethod
+    def find_cell_layer(cls, stack):
         '''
         Estimate the center of the cell layer using the center of mass
         of the z-profile of the mean intensity of the Hoechst staining
         '''
 
         # z-profile of the mean intensity in the Hoechst channel
-        raw_profile = np.array([zslice.mean() for zslice in stack]).astype(float)
+        raw_profile = cls.calculate_z_profile_means(stack).astype(float)
         profile = raw_profile - raw_profile.mean()
         profile[profile < 0] = 0
 
@@ -460,8 +555,10 @@ class RawPipelineTIFF(MicroManagerTIFF):
         stacks = {}
         result = {}
 
-        stack_405 = self.stacks[self.laser_405].copy()
-        stack_488 = self.stacks[self.laser_488].copy()
+        # note that the stacks are not copied, because they are only sliced below
+        # (and the slices are views, so that only the slices used by the caller are read from disk)
+        stack_405 = self.stacks[self.laser_405]
+        stack_488 = self.stacks[self.laser_488]
 
         # hard-coded chromatic aberration offset in microns
         # this is an empirically estimated median offset,
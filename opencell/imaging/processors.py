@@ -10,6 +10,27 @@ from opencell.imaging import images, utils, nucleus_segmentation
 logger = logging.getLogger(__name__)
 
 
+# the processor methods that read the raw TIFF and that can be run together,
+# from a single read of the raw TIFF, by FOVProcessor.process_raw_tiff_products
+RAW_TIFF_PRODUCTS = [
+    'process_raw_tiff',
+    'calculate_z_profiles',
+    'generate_clean_tiff',
+    'crop_corner_rois',
+    'crop_annotated_roi',
+]
+
+# the kind of the result inserted by each of the methods in RAW_TIFF_PRODUCTS
+# (see the `insert_*` methods of fov_operations.MicroscopyFOVOperations)
+RAW_TIFF_PRODUCT_RESULT_KINDS = {
+    'process_raw_tiff': 'raw-tiff-metadata',
+    'calculate_z_profiles': 'z-profiles',
+    'generate_clean_tiff': 'clean-tiff-metadata',
+    'crop_corner_rois': 'corner-roi-cropping',
+    'crop_annotated_roi': 'annotated-roi-cropping',
+}
+
+
 class FOVProcessor:
 
     def __init__(
@@ -57,6 +78,9 @@ class FOVProcessor:
         # create site_id from site_num
         self.site_id = 'S%02d' % int(self.site_num)
 
+        # the raw TIFF shared by the processor methods called by process_raw_tiff_products
+        self.raw_tiff = None
+
 
     def set_paths(
         self, plate_microscopy_dir=None, raw_pipeline_microscopy_dir=None, dst_root_dir=None
@@ -280,6 +304,25 @@ class FOVProcessor:
         return os.path.join(dst_dirpath, dst_filename)
 
 
+    def read_raw_tiff(self):
+        '''
+        Open, parse, and validate the raw TIFF and attempt to split it by channel
+        (if the raw TIFF was already read by process_raw_tiff_products, it is not read again)
+        '''
+        if self.raw_tiff is not None:
+            return self.raw_tiff
+
+        tiff = images.RawPipelineTIFF(self.src_filepath(), verbose=False)
+        tiff.parse_micromanager_metadata()
+        tiff.validate_micromanager_metadata()
+        tiff.split_channels()
+
+        # the tiff file must be manually closed
+        # (the channel stacks do not require the file to be open; see RawPipelineTIFF.concat_pages)
+        tiff.tiff.close()
+        return tiff
+
+
     def load_raw_tiff(self):
         '''
         Convenience method to open and parse a raw TIFF and attempt to split it by channel
@@ -287,15 +330,61 @@ class FOVProcessor:
         '''
         src_filepath = self.src_filepath()
         if os.path.isfile(src_filepath):
-            tiff = images.RawPipelineTIFF(src_filepath, verbose=False)
-            tiff.parse_micromanager_metadata()
-            tiff.validate_micromanager_metadata()
-            tiff.split_channels()
+            tiff = self.read_raw_tiff()
             if tiff.did_split_channels:
                 return tiff
             else:
                 logger.warning('Could not split the TIFF file at %s' % src_filepath)
-                tiff.tiff.close()
+
+
+    def process_raw_tiff_products(self, products=None, skip_existing=False):
+        '''
+        Run several of the processor methods that read the raw TIFF
+        (the methods in RAW_TIFF_PRODUCTS) from a single read of the raw TIFF
+
+        products : the names of the processor methods to run (if None, all of RAW_TIFF_PRODUCTS)
+        skip_existing : whether to skip the methods whose results the FOV already has
+            (as identified by their kinds; see RAW_TIFF_PRODUCT_RESULT_KINDS)
+        Returns a dict of the result of each method, keyed by method name
+
+        If a method raises an exception, its result is the error message (as `{'error': message}`),
+        so that the results of the other methods are not lost
+
+        The ROIs are not cropped again from FOVs that already have ROIs of the same kind
+        (because the cropped ROIs are inserted in addition to the existing ROIs),
+        and the result of the ROI-cropping methods is then None
+        '''
+        products = RAW_TIFF_PRODUCTS if products is None else products
+        for product in products:
+            if product not in RAW_TIFF_PRODUCTS:
+                raise ValueError("'%s' is not a raw TIFF product" % product)
+
+        if skip_existing:
+            existing_result_kinds = set(result.kind for result in self.fov.results)
+            products = [
+                product for product in products
+                if RAW_TIFF_PRODUCT_RESULT_KINDS[product] not in existing_result_kinds
+            ]
+
+        roi_kinds = {'crop_corner_rois': 'corner', 'crop_annotated_roi': 'annotated'}
+        existing_roi_kinds = set(row['kind'] for row in self.all_roi_rows)
+
+        results = {}
+        if not products:
+            return results
+        try:
+            self.raw_tiff = self.read_raw_tiff()
+            for product in products:
+                if roi_kinds.get(product) in existing_roi_kinds:
+                    results[product] = None
+                    continue
+                try:
+                    results[product] = getattr(self, product)()
+                except Exception as error:
+                    results[product] = {'error': str(error)}
+        finally:
+            self.raw_tiff = None
+        return results
 
 
     def process_raw_tiff(self):
@@ -314,20 +403,14 @@ class FOVProcessor:
         if not os.path.isfile(src_filepath):
             metadata['error'] = 'File does not exist'
 
-        tiff = images.RawPipelineTIFF(src_filepath, verbose=False)
-        tiff.parse_micromanager_metadata()
-        tiff.validate_micromanager_metadata()
+        tiff = self.read_raw_tiff()
 
-        # attempt to split the channels and project
-        tiff.split_channels()
+        # attempt to project the channels
         if tiff.did_split_channels:
             for channel in [tiff.laser_405, tiff.laser_488]:
                 dst_filepath = self.dst_filepath(kind='proj', channel=channel, ext='tif')
                 tiff.project_stack(channel_name=channel, axis='z', dst_filepath=dst_filepath)
 
-        # the tiff file must be manually closed
-        tiff.tiff.close()
-
         metadata.update(tiff.global_metadata)
 
         # return the parsed raw TIFF metadata and the parsing events (if any)
@@ -462,7 +545,7 @@ class FOVProcessor:
 
         for channel in (tiff.laser_405, tiff.laser_488):
             try:
-                result[channel] = tiff.calculate_z_profiles(tiff.stacks[channel])
+                result[channel] = tiff.calculate_z_profiles(channel)
             except Exception as error:
                 result[channel] = {'error': str(error)}
         return result
@@ -892,19 +975,29 @@ class FOVProcessor:
         '''
         Downsample the raw uint16 pixel intensities to uint8
         and return the black and white points used to do so
+
+        For uint16 stacks, the downsampling is applied using a lookup table
+        (see utils.autoscale)
         '''
 
-        stack = stack.astype(float)
-        minn, maxx = np.percentile(stack, (percentile, 100 - percentile))
+        use_lut = utils.is_lut_compatible(stack)
+        if use_lut:
+            minn, maxx = utils.exact_percentile(stack, (percentile, 100 - percentile))
+            values = utils.lut_values(stack)
+        else:
+            values = stack.astype(float)
+            minn, maxx = np.percentile(values, (percentile, 100 - percentile))
+
         if minn == maxx:
             maxx = minn + 1
 
-        stack -= minn
-        stack[stack < 0] = 0
-        stack /= (maxx - minn)
-        stack[stack > 1] = 1
+        values -= minn
+        values[values < 0] = 0
+        values /= (maxx - minn)
+        values[values > 1] = 1
 
-        stack = (255*stack).astype('uint8')
+        values = (255*values).astype('uint8')
+        stack = values[stack] if use_lut else values
         return stack, int(minn), int(maxx)
 
 
@@ -1,5 +1,7 @@
 import imageio
+import numpy as np
 import os
+import tifffile
 
 from opencell.imaging.images import RawPipelineTIFF
 from opencell.tests.fixtures.image_fixtures import *  # noqa: F403
@@ -110,3 +112,85 @@ def test_align_cell_layer(raw_v2_tiff, tmp_path):
     )
     assert 'error' in list(result.keys())
     assert not stacks.keys()
+
+
+def test_concat_pages(tmp_path):
+    '''
+    The stacks of interleaved channels should be memory-mapped from uncompressed TIFFs,
+    and read into memory from compressed TIFFs
+    '''
+    data = np.random.default_rng(seed=0).integers(0, 2**16, (10, 32, 48), dtype='uint16')
+
+    filepath = os.path.join(tmp_path, 'uncompressed.tif')
+    tifffile.imwrite(filepath, data)
+    tiff = RawPipelineTIFF(filepath, verbose=False)
+    for page_inds in ([0, 2, 4, 6, 8], [1, 3, 5, 7, 9], [5, 6, 7, 8, 9], [3]):
+        stack = tiff.concat_pages(page_inds)
+        assert isinstance(stack.base, np.memmap)
+        assert not stack.flags.writeable
+        np.testing.assert_array_equal(stack, data[page_inds])
+
+    # pages that are not evenly spaced cannot be memory-mapped
+    assert tiff.memmap_pages([0, 1, 3]) is None
+    np.testing.assert_array_equal(tiff.concat_pages([0, 1, 3]), data[[0, 1, 3]])
+
+    # big-endian TIFFs are read into memory (in native byte order)
+    filepath = os.path.join(tmp_path, 'big-endian.tif')
+    tifffile.imwrite(filepath, data, byteorder='>')
+    tiff = RawPipelineTIFF(filepath, verbose=False)
+    assert tiff.memmap_pages([0, 2, 4, 6, 8]) is None
+    stack = tiff.concat_pages([0, 2, 4, 6, 8])
+    assert stack.dtype.isnative
+    np.testing.assert_array_equal(stack, data[[0, 2, 4, 6, 8]])
+
+    filepath = os.path.join(tmp_path, 'compressed.tif')
+    tifffile.imwrite(filepath, data, compression='zlib')
+    tiff = RawPipelineTIFF(filepath, verbose=False)
+    stack = tiff.concat_pages([0, 2, 4, 6, 8])
+    assert not isinstance(stack.base, np.memmap)
+    np.testing.assert_array_equal(stack, data[[0, 2, 4, 6, 8]])
+
+
+def test_parse_and_validate_synthetic_tiffs(synthetic_raw_tiffs):
+    '''
+    The metadata parsed from synthetic TIFFs with v1 and v2 metadata tags should be the same
+    '''
+    tiffs = {}
+    for schema, filepath in synthetic_raw_tiffs.items():
+        tiff = RawPipelineTIFF(filepath, verbose=False)
+        parse_validate_split(tiff)
+        assert tiff.did_split_channels
+        assert tiff.has_valid_channel_inds and tiff.has_valid_slice_inds
+        assert tiff.global_metadata['mm_metadata_version'] == schema
+        assert tiff.global_metadata['exposure_time_488'] == 500
+
+        # the synthetic TIFFs have no IJMetadata tag, but should raise no other events
+        messages = [event['message'] for event in tiff.events]
+        assert messages == ['There was no IJMetadata tag found on the first page']
+        tiffs[schema] = tiff
+
+    assert tiffs['v1'].mm_metadata.shape == (40, 11)
+    assert tiffs['v1'].mm_metadata.equals(tiffs['v2'].mm_metadata)
+    assert list(tiffs['v1'].validated_mm_metadata.slice_ind[::2]) == list(range(20))
+
+
+def test_calculate_z_profiles(synthetic_raw_tiffs):
+    '''
+    The z-profiles calculated in one pass should be identical to those calculated slice by slice
+    '''
+    tiff = RawPipelineTIFF(synthetic_raw_tiffs['v2'], verbose=False)
+    parse_validate_split(tiff)
+
+    stack = tiff.stacks['405']
+    profiles = tiff.calculate_z_profiles('405')
+    np.testing.assert_array_equal(profiles['min'], [zslice.min() for zslice in stack])
+    np.testing.assert_array_equal(profiles['max'], [zslice.max() for zslice in stack])
+    np.testing.assert_array_equal(
+        profiles['mean'], np.array([zslice.mean() for zslice in stack]).astype(int)
+    )
+    np.testing.assert_array_equal(
+        profiles['p9999'], np.array([np.percentile(zslice, 99.99) for zslice in stack]).astype(int)
+    )
+
+    _, raw_profile = tiff.find_cell_layer(stack)
+    np.testing.assert_array_equal(raw_profile, [zslice.mean() for zslice in stack])
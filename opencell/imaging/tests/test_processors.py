@@ -1,3 +1,6 @@
+import types
+import numpy as np
+import pytest
 
 from opencell.imaging.processors import FOVProcessor
 
@@ -19,6 +22,78 @@ def test_calculate_fov_features(fov):
     pass
 
 
+def make_processor(all_roi_rows):
+    return FOVProcessor(
+        parental_line_name='czML0383',
+        cell_line_id=1,
+        fov_id=1,
+        pml_id='PML0001',
+        plate_id='P0001',
+        well_id='A01',
+        ensg_id='ENSG00000000001',
+        target_name='TARGET',
+        site_num=1,
+        src_type='raw_pipeline_microscopy',
+        raw_filepath='raw.ome.tif',
+        all_roi_rows=all_roi_rows
+    )
+
+
+def test_process_raw_tiff_products_existing_rois(monkeypatch):
+    '''
+    The ROIs should not be cropped again from FOVs that already have ROIs of the same kind
+    '''
+    processor = make_processor(all_roi_rows=[{'id': 1, 'kind': 'annotated'}])
+    monkeypatch.setattr(processor, 'read_raw_tiff', lambda: 'raw-tiff')
+    monkeypatch.setattr(processor, 'crop_corner_rois', lambda: 'corner-rois')
+    monkeypatch.setattr(processor, 'crop_annotated_roi', lambda: 'annotated-roi')
+
+    results = processor.process_raw_tiff_products(['crop_corner_rois', 'crop_annotated_roi'])
+    assert results == {'crop_corner_rois': 'corner-rois', 'crop_annotated_roi': None}
+    assert processor.raw_tiff is None
+
+
+def test_process_raw_tiff_products_errors(monkeypatch):
+    '''
+    The failure of one product should not prevent the others from being returned
+    '''
+    def generate_clean_tiff():
+        raise ValueError('bad stack')
+
+    processor = make_processor(all_roi_rows=[])
+    monkeypatch.setattr(processor, 'read_raw_tiff', lambda: 'raw-tiff')
+    monkeypatch.setattr(processor, 'calculate_z_profiles', lambda: {'405': {}})
+    monkeypatch.setattr(processor, 'generate_clean_tiff', generate_clean_tiff)
+
+    results = processor.process_raw_tiff_products(['generate_clean_tiff', 'calculate_z_profiles'])
+    assert results == {
+        'generate_clean_tiff': {'error': 'bad stack'}, 'calculate_z_profiles': {'405': {}}
+    }
+    assert processor.raw_tiff is None
+
+
+def test_process_raw_tiff_products_skip_existing(monkeypatch):
+    '''
+    With skip_existing, only the products whose results the FOV does not have should be run
+    '''
+    processor = make_processor(all_roi_rows=[])
+    processor.fov = types.SimpleNamespace(results=[types.SimpleNamespace(kind='raw-tiff-metadata')])
+    monkeypatch.setattr(processor, 'read_raw_tiff', lambda: 'raw-tiff')
+    monkeypatch.setattr(processor, 'process_raw_tiff', lambda: {'metadata': {}})
+    monkeypatch.setattr(processor, 'calculate_z_profiles', lambda: {'405': {}})
+
+    products = ['process_raw_tiff', 'calculate_z_profiles']
+    results = processor.process_raw_tiff_products(products, skip_existing=True)
+    assert results == {'calculate_z_profiles': {'405': {}}}
+
+    results = processor.process_raw_tiff_products(products)
+    assert results == {'process_raw_tiff': {'metadata': {}}, 'calculate_z_profiles': {'405': {}}}
+
+    # the raw TIFF should not be read if there is nothing to do
+    monkeypatch.setattr(processor, 'read_raw_tiff', lambda: pytest.fail('read_raw_tiff was called'))
+    assert processor.process_raw_tiff_products(['process_raw_tiff'], skip_existing=True) == {}
+
+
 def test_generate_fov_thumbnails(fov):
     pass
 
@@ -41,3 +116,25 @@ def test_generate_annotated_roi_thumbnails(fov):
 
 def test_generate_nucleus_segmentation(fov):
     pass
+
+
+def test_stack_to_uint8():
+    '''
+    The lookup-table downsampling of uint16 stacks should be identical
+    to downsampling a float copy of the stack
+    '''
+    rng = np.random.default_rng(seed=0)
+    stacks = [
+        rng.integers(0, 65535, size=(32, 32, 8), endpoint=True).astype('uint16'),
+        rng.poisson(500, size=(64, 64, 4)).astype('uint16'),
+        np.zeros((8, 8, 2), dtype='uint16') + 3,
+    ]
+    for stack in stacks:
+        for percentile in [0, 0.01, 1]:
+            stack_out, minn, maxx = FOVProcessor.stack_to_uint8(stack, percentile)
+            stack_ref, minn_ref, maxx_ref = FOVProcessor.stack_to_uint8(
+                stack.astype(float), percentile
+            )
+            assert (minn, maxx) == (minn_ref, maxx_ref)
+            assert stack_out.dtype == 'uint8'
+            np.testing.assert_array_equal(stack_out, stack_ref)
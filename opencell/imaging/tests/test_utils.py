@@ -36,3 +36,76 @@ def test_autoscale():
 
     im_out = utils.autoscale(im_in, percentile=11, dtype='uint8')
     assert set(im_out[:]) == set([0, ])
+
+
+def test_exact_percentile():
+    '''
+    The histogram-based percentiles of uint8 and uint16 images
+    should be identical to those calculated by np.percentile
+    '''
+    rng = np.random.default_rng(seed=0)
+    percentiles = [0, 0.01, 1, 25, 50, 99, 99.99, 100, 33.3]
+    for dtype, max_value in [('uint8', 255), ('uint16', 65535), ('uint16', 4095), ('uint16', 3)]:
+        for size in [1, 2, 7, 1000, 10001]:
+            im = rng.integers(0, max_value, size=size, endpoint=True).astype(dtype)
+            np.testing.assert_array_equal(
+                utils.exact_percentile(im, percentiles), np.percentile(im, percentiles)
+            )
+            for percentile in percentiles:
+                assert utils.exact_percentile(im, percentile) == np.percentile(im, percentile)
+
+    # a constant image
+    im = np.zeros((10, 10), dtype='uint16') + 7
+    np.testing.assert_array_equal(utils.exact_percentile(im, [0, 50, 100]), [7, 7, 7])
+
+    # other dtypes fall back to np.percentile
+    im = rng.normal(size=(10, 10))
+    assert utils.exact_percentile(im, 50) == np.percentile(im, 50)
+
+
+def autoscale_with_floats(im, percentile=0, dtype='uint8', gamma=None):
+    '''
+    Reference implementation of autoscale that rescales a float copy of the image
+    '''
+    max_values = {'float': 1.0, 'uint8': 255, 'uint16': 65535}
+    im = im.copy().astype(float)
+    minn, maxx = np.percentile(im, (percentile, 100 - percentile))
+    if minn == maxx:
+        return (im * 0).astype(dtype)
+
+    im = im - minn
+    im[im < 0] = 0
+    im = im/(maxx - minn)
+    im[im > 1] = 1
+    if gamma is not None:
+        im = im**gamma
+    return (im * max_values[dtype]).astype(dtype)
+
+
+def test_autoscale_lut_equivalence():
+    '''
+    The lookup-table rescaling of uint8 and uint16 images should be identical
+    to rescaling a float copy of the image
+    '''
+    rng = np.random.default_rng(seed=0)
+    ims = [
+        rng.integers(0, 65535, size=(64, 64), endpoint=True).astype('uint16'),
+        rng.integers(100, 4095, size=(3, 32, 48), endpoint=True).astype('uint16'),
+        rng.poisson(300, size=(128, 128)).astype('uint16'),
+        rng.integers(0, 255, size=(64, 64), endpoint=True).astype('uint8'),
+        np.zeros((16, 16), dtype='uint16') + 7,
+        np.array([1, 11], dtype='uint16'),
+    ]
+    for im in ims:
+        for percentile in [0, 0.01, 1, 6, 11]:
+            for dtype in ['uint8', 'uint16', 'float']:
+                for gamma in [None, 0.7, 2]:
+                    im_out = utils.autoscale(im, percentile=percentile, dtype=dtype, gamma=gamma)
+                    im_ref = autoscale_with_floats(im, percentile, dtype=dtype, gamma=gamma)
+                    assert im_out.dtype == im_ref.dtype
+                    np.testing.assert_array_equal(im_out, im_ref)
+
+    # the input image should not be modified
+    im = ims[0].copy()
+    utils.autoscale(im, percentile=1, gamma=0.7)
+    np.testing.assert_array_equal(im, ims[0])
@@ -29,8 +29,71 @@ def b64encode_image(image, format, **kwargs):
     return s
 
 
+def exact_percentile(im, percentiles):
+    '''
+    The exact percentiles of an image, identical to `np.percentile(im, percentiles)`
+
+    For uint8 and uint16 images, the percentiles are found from the cumulative histogram
+    of the intensities, which requires neither a float copy of the image nor a partial sort
+    '''
+    im = np.asarray(im)
+    if im.dtype not in (np.uint8, np.uint16) or im.size == 0:
+        return np.percentile(im, percentiles)
+
+    # the histogram is accumulated in chunks, because np.bincount casts its input to int64
+    im = im.ravel()
+    chunk_size = 2**20
+    counts = np.zeros(np.iinfo(im.dtype).max + 1, dtype=np.int64)
+    for ind in range(0, im.size, chunk_size):
+        counts += np.bincount(im[ind:ind + chunk_size], minlength=len(counts))
+    cumulative_counts = np.cumsum(counts)
+
+    # the positions of the percentiles in the sorted intensities,
+    # as defined by np.percentile's default 'linear' method
+    quantiles = np.true_divide(percentiles, 100)
+    virtual_inds = (im.size - 1) * np.asarray(quantiles, dtype=float)
+    previous_inds = np.minimum(np.floor(virtual_inds), im.size - 1)
+    next_inds = np.minimum(previous_inds + 1, im.size - 1)
+    gamma = virtual_inds - previous_inds
+
+    # the intensity with index i in the sorted intensities
+    # is the lowest intensity whose cumulative count exceeds i
+    previous_values = np.searchsorted(cumulative_counts, previous_inds, side='right').astype(float)
+    next_values = np.searchsorted(cumulative_counts, next_inds, side='right').astype(float)
+
+    # linear interpolation, as in np.percentile
+    diffs = next_values - previous_values
+    values = np.where(
+        gamma >= 0.5, next_values - diffs * (1 - gamma), previous_values + diffs * gamma
+    )
+    return values[()] if values.ndim == 0 else values
+
+
+def is_lut_compatible(im):
+    '''
+    Whether an image can be rescaled using a lookup table
+    (i.e., whether it is a uint8 or uint16 image)
+    '''
+    return im.dtype in (np.uint8, np.uint16)
+
+
+def lut_values(im):
+    '''
+    All possible intensities of a uint8 or uint16 image, as floats
+    (from which to calculate a lookup table)
+    '''
+    return np.arange(np.iinfo(im.dtype).max + 1, dtype=float)
+
+
 def autoscale(im, percentile=None, p=None, dtype='uint8', gamma=None):
     '''
+    Rescale the intensities of an image so that the given lower and upper percentiles
+    are mapped to zero and to the maximum value of the dtype (and optionally apply a gamma)
+
+    For uint8 and uint16 images, the percentiles are found from the histogram
+    and the rescaling is calculated once for each possible intensity and applied
+    using a lookup table, so no float copy of the image is made
+    (the result is identical to rescaling the image itself)
     '''
 
     max_values = {'float': 1.0, 'uint8': 255, 'uint16': 65535}
@@ -40,20 +103,26 @@ def autoscale(im, percentile=None, p=None, dtype='uint8', gamma=None):
     if percentile is None:
         percentile = 0
 
-    im = im.copy().astype(float)
-    minn, maxx = np.percentile(im, (percentile, 100 - percentile))
+    use_lut = is_lut_compatible(im)
+    if use_lut:
+        minn, maxx = exact_percentile(im, (percentile, 100 - percentile))
+        values = lut_values(im)
+    else:
+        values = im.copy().astype(float)
+        minn, maxx = np.percentile(values, (percentile, 100 - percentile))
+
     if minn == maxx:
-        return (im * 0).astype(dtype)
+        return np.zeros(im.shape, dtype=dtype)
 
-    im = im - minn
-    im[im < 0] = 0
-    im = im/(maxx - minn)
-    im[im > 1] = 1
+    values = values - minn
+    values[values < 0] = 0
+    values = values/(maxx - minn)
+    values[values > 1] = 1
     if gamma is not None:
-        im = im**gamma
+        values = values**gamma
 
-    im = (im * max_values[dtype]).astype(dtype)
-    return im
+    values = (values * max_values[dtype]).astype(dtype)
+    return values[im] if use_lut else values
 
 
 # alias for autoscale, for backwards compatibility
@@ -0,0 +1,108 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from opencell.database import utils
+
+
+# the gene-name queries used by FullTextSearch before the gene_name_alias view existed
+UNNEST_PREFIX_QUERY = '''
+    select * from searchable_hgnc_metadata
+    where ensg_id in (
+        select ensg_id from (
+            select ensg_id,
+                unnest(
+                    string_to_array(symbol, '')
+                    || string_to_array(prev_symbol, '|')
+                    || string_to_array(alias_symbol, '|')
+                ) as gene_name
+            from hgnc_metadata
+        ) as tmp
+        where gene_name like %(query)s
+    );
+'''
+
+UNNEST_LEGACY_QUERY = '''
+    select * from (
+        select symbol, ensg_id, unnest(
+            string_to_array(prev_symbol, '|') || string_to_array(alias_symbol, '|')
+        ) as alias_or_prev
+        from hgnc_metadata
+    ) tmp
+    where alias_or_prev ilike %(query)s
+'''
+
+# the queries that use the gene_name_alias view
+ALIAS_PREFIX_QUERY = '''
+    select * from searchable_hgnc_metadata
+    where ensg_id in (
+        select ensg_id from gene_name_alias where name like %(query)s
+    );
+'''
+
+ALIAS_LEGACY_QUERY = '''
+    select hgnc.symbol, hgnc.ensg_id from gene_name_alias alias
+    inner join hgnc_metadata hgnc on hgnc.ensg_id = alias.ensg_id
+    where alias.kind != 'symbol' and alias.name = %(query)s
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--credentials', dest='credentials', required=True)
+    parser.add_argument('--num-queries', dest='num_queries', type=int, default=200)
+    return parser.parse_args()
+
+
+def time_queries(engine, sql, queries):
+    '''
+    The latency, in milliseconds, of each query
+    '''
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        pd.read_sql(sql, engine, params=dict(query=query))
+        latencies.append(1000 * (time.perf_counter() - start))
+    return np.array(latencies)
+
+
+def main():
+    '''
+    Compare the latency of the gene-name searches in FullTextSearch
+    with and without the gene_name_alias materialized view
+    '''
+    args = parse_args()
+    engine = sa.create_engine(utils.url_from_credentials(args.credentials))
+
+    rng = np.random.default_rng(seed=0)
+    names = pd.read_sql('select name, kind from gene_name_alias', engine)
+
+    # prefixes of one to four characters of random gene names (as typed in the search bar)
+    symbols = rng.choice(names.name.values, size=args.num_queries)
+    lengths = rng.integers(1, 5, size=args.num_queries)
+    prefix_queries = ['%s%%' % symbol[:length] for symbol, length in zip(symbols, lengths)]
+
+    # exact legacy gene names
+    legacy_queries = rng.choice(
+        names.loc[names.kind != 'symbol'].name.values, size=args.num_queries
+    )
+
+    benchmarks = [
+        ('prefix', 'unnest', UNNEST_PREFIX_QUERY, prefix_queries),
+        ('prefix', 'gene_name_alias', ALIAS_PREFIX_QUERY, prefix_queries),
+        ('legacy', 'unnest', UNNEST_LEGACY_QUERY, legacy_queries),
+        ('legacy', 'gene_name_alias', ALIAS_LEGACY_QUERY, legacy_queries),
+    ]
+    for search, method, sql, queries in benchmarks:
+        latencies = time_queries(engine, sql, queries)
+        print(
+            '%s search using %s: p50 = %0.1f ms, p99 = %0.1f ms'
+            % (search, method, np.percentile(latencies, 50), np.percentile(latencies, 99))
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from opencell.imaging.images import RawPipelineTIFF
+from opencell.tests.fixtures.image_fixtures import mock_synthetic_micromanager_tiff
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-slices', dest='num_slices', type=int, default=200)
+    parser.add_argument('--num-repeats', dest='num_repeats', type=int, default=20)
+    parser.add_argument('--schema', dest='schema', choices=['v1', 'v2'], default='v2')
+    return parser.parse_args()
+
+
+def time_steps(filepath):
+    '''
+    The time, in milliseconds, to parse, validate, and split a raw TIFF
+    '''
+    timings = {}
+    tiff = RawPipelineTIFF(filepath, verbose=False)
+
+    start = time.perf_counter()
+    tiff.parse_micromanager_metadata()
+    timings['parse'] = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tiff.validate_micromanager_metadata()
+    timings['validate'] = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tiff.split_channels()
+    timings['split'] = 1000 * (time.perf_counter() - start)
+
+    tiff.tiff.close()
+    return timings
+
+
+def main():
+    '''
+    Time the parsing and validation of the MicroManager metadata tags
+    of a synthetic two-channel raw TIFF, e.g.:
+    `python -m opencell.scripts.benchmark_micromanager_parsing --num-slices 200`
+    '''
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = os.path.join(dirpath, 'synthetic-raw-tiff.tif')
+        mock_synthetic_micromanager_tiff(
+            filepath, num_slices=args.num_slices, shape=(64, 64), schema=args.schema
+        )
+
+        # the first run opens the file cold, so it is not included
+        time_steps(filepath)
+        all_timings = [time_steps(filepath) for _ in range(args.num_repeats)]
+
+    for step in ['parse', 'validate', 'split']:
+        timings = np.array([timings[step] for timings in all_timings])
+        print(
+            '%s (%s pages, %s tags): median = %0.1f ms, min = %0.1f ms'
+            % (step, 2*args.num_slices, args.schema, float(np.median(timings)), float(timings.min()))
+        )
+
+
+if __name__ == '__main__':
+    main()
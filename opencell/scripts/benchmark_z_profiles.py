@@ -0,0 +1,99 @@
+import argparse
+import time
+
+import numpy as np
+
+from opencell.imaging.images import RawPipelineTIFF
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-slices', dest='num_slices', type=int, default=60)
+    parser.add_argument('--num-repeats', dest='num_repeats', type=int, default=5)
+    return parser.parse_args()
+
+
+def calculate_z_profiles_by_slice(stack):
+    '''
+    The z-profiles calculated slice by slice (the implementation that preceded
+    RawPipelineTIFF.calculate_z_profiles)
+    '''
+    return {
+        'min': np.array([zslice.min() for zslice in stack]).astype(int),
+        'max': np.array([zslice.max() for zslice in stack]).astype(int),
+        'mean': np.array([zslice.mean() for zslice in stack]).astype(int),
+        'p9999': np.array([np.percentile(zslice, 99.99) for zslice in stack]).astype(int),
+    }
+
+
+def find_cell_layer_by_slice(stack):
+    '''
+    The cell layer center calculated slice by slice
+    (the implementation that preceded RawPipelineTIFF.find_cell_layer)
+    '''
+    raw_profile = np.array([zslice.mean() for zslice in stack]).astype(float)
+    profile = raw_profile - raw_profile.mean()
+    profile[profile < 0] = 0
+    x = np.arange(len(profile))
+    return (profile * x).sum()/profile.sum(), raw_profile
+
+
+def time_method(method, num_repeats):
+    '''
+    The minimum time, in milliseconds, to run the method, and its last result
+    '''
+    timings = []
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        result = method()
+        timings.append(1000 * (time.perf_counter() - start))
+    return min(timings), result
+
+
+def main():
+    '''
+    Compare the time to calculate the z-profiles and the cell layer center
+    of a synthetic 1024x1024xZ uint16 stack slice by slice and in one pass, e.g.:
+    `python -m opencell.scripts.benchmark_z_profiles --num-slices 60`
+    '''
+    args = parse_args()
+
+    # a synthetic Hoechst-like stack with a bright cell layer in the middle of the stack
+    rng = np.random.default_rng(seed=0)
+    z = np.arange(args.num_slices)
+    layer = 2000 * np.exp(-(z - args.num_slices/2)**2 / (2 * (args.num_slices/8)**2))
+    stack = rng.poisson(500 + layer[:, None, None], size=(args.num_slices, 1024, 1024))
+    stack = stack.astype('uint16')
+
+    tiff = RawPipelineTIFF.__new__(RawPipelineTIFF)
+    tiff.stacks = {'405': stack}
+
+    benchmarks = [
+        (
+            'z-profiles',
+            lambda: calculate_z_profiles_by_slice(stack),
+            lambda: tiff.calculate_z_profiles('405'),
+        ),
+        (
+            'cell layer',
+            lambda: find_cell_layer_by_slice(stack),
+            lambda: RawPipelineTIFF.find_cell_layer(stack),
+        ),
+    ]
+    for name, method_by_slice, method in benchmarks:
+        time_by_slice, result_by_slice = time_method(method_by_slice, args.num_repeats)
+        time_one_pass, result = time_method(method, args.num_repeats)
+
+        if isinstance(result, dict):
+            is_identical = all(np.array_equal(result[key], result_by_slice[key]) for key in result)
+        else:
+            is_identical = all(np.array_equal(a, b) for a, b in zip(result, result_by_slice))
+
+        print(
+            '%s (%s slices): by slice = %0.1f ms, one pass = %0.1f ms, identical results: %s'
+            % (name, args.num_slices, time_by_slice, time_one_pass, is_identical)
+        )
+
+
+if __name__ == '__main__':
+    main()
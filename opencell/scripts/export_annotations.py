@@ -69,7 +69,9 @@ def export_clean_graded_annotations(engine, dst_dir, public_only=False):
 
     annotations = pd.read_sql(
         '''
-        select line.id as cell_line_id, cd.target_name, cd.ensg_id, ant.categories
+        select
+            line.id as cell_line_id, cd.target_name, cd.ensg_id, ant.categories,
+            ant.categories @> '["publication_ready"]' as is_publication_ready
         from cell_line line
         left join crispr_design cd on cd.id = line.crispr_design_id
         left join cell_line_annotation ant on ant.cell_line_id = line.id;
@@ -94,7 +96,7 @@ def export_clean_graded_annotations(engine, dst_dir, public_only=False):
     )
 
     all_pr_cell_line_ids = (
-        annotations.loc[annotations.category == 'publication_ready'].cell_line_id.values
+        annotations.loc[annotations.is_publication_ready.astype(bool)].cell_line_id.values
     )
 
     public_lines_mask = annotations.cell_line_id.isin(all_pr_cell_line_ids)
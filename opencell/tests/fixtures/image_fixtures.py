@@ -1,5 +1,6 @@
 from collections import namedtuple
 import json
+import numpy as np
 from pathlib import Path
 import pytest
 import os
@@ -107,6 +108,67 @@ def mock_raw_micromanager_tiff(
     dst_tiff.close()
 
 
+def mock_synthetic_micromanager_tiff(
+    dst_filepath, num_slices=200, shape=(64, 64), schema='v2', interleaved=True
+):
+    '''
+    Generate a synthetic two-channel MicroManager-like raw TIFF with random pixel intensities
+    dst_filepath :
+    num_slices : the number of z-slices in each channel
+    shape : the x-y shape of each z-slice
+    schema : the schema of the MicroManager metadata tags ('v1' or 'v2')
+    interleaved : whether the pages of the two channels are interleaved
+        (otherwise, all of the pages of the first channel precede those of the second)
+    '''
+    # the MicroManagerMetadata tag
+    mm_tag_code = 51123
+
+    # the (slice_ind, channel_ind) of each page
+    page_inds = [(slice_ind, channel_ind) for channel_ind in (0, 1) for slice_ind in range(num_slices)]
+    if interleaved:
+        page_inds = sorted(page_inds)
+
+    rng = np.random.default_rng(seed=0)
+    dst_tiff = tifffile.TiffWriter(dst_filepath)
+    for slice_ind, channel_ind in page_inds:
+        properties = {
+            'EMCCD-Exposure': 50 if channel_ind == 0 else 500,
+            'ILE-A-Laser 405-Power Enable': 1 - channel_ind,
+            'ILE-A-Laser 405-Power Setpoint': 10,
+            'ILE-A-Laser 488-Power Enable': channel_ind,
+            'ILE-A-Laser 488-Power Setpoint': 20,
+        }
+        if schema == 'v1':
+            mm_tag_value = {'Andor%s' % key: value for key, value in properties.items()}
+        else:
+            mm_tag_value = {'Andor %s' % key: {'PropVal': value} for key, value in properties.items()}
+
+        mm_tag_value.update({
+            'SliceIndex': slice_ind,
+            'FrameIndex': 0,
+            'ChannelIndex': channel_ind,
+            'PositionIndex': 0,
+        })
+        mm_tag = (mm_tag_code, 's', 0, json.dumps(mm_tag_value), False)
+        page = rng.integers(0, 2**12, shape, dtype='uint16')
+        dst_tiff.write(page, extratags=[mm_tag], contiguous=False)
+    dst_tiff.close()
+
+
+@pytest.fixture(scope='session')
+def synthetic_raw_tiffs(tmp_dirpath):
+    '''
+    The filepaths to small synthetic raw MicroManager TIFFs with v1 and v2 metadata tags
+    '''
+    filepaths = {}
+    for schema in ['v1', 'v2']:
+        filepaths[schema] = os.path.join(tmp_dirpath, 'synthetic-raw-tiff-%s.tif' % schema)
+        mock_synthetic_micromanager_tiff(
+            filepaths[schema], num_slices=20, shape=(16, 16), schema=schema
+        )
+    return filepaths
+
+
 @pytest.fixture(scope='session')
 def test_images_dirpath(test_data_dirpath):
     return os.path.join(test_data_dirpath, 'microscopy')